@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Team, Activity, Leaderboard, Workout
+from .models import User, Team, Activity, Leaderboard, TeamLeaderboard, Workout, ActivityRollup, Job
 
 
 @admin.register(User)
@@ -14,7 +14,7 @@ class UserAdmin(admin.ModelAdmin):
 @admin.register(Team)
 class TeamAdmin(admin.ModelAdmin):
     """Admin interface for Team model"""
-    list_display = ('name', 'description', 'created_at')
+    list_display = ('name', 'description', 'member_count', 'created_at')
     list_filter = ('created_at',)
     search_fields = ('name', 'description')
     ordering = ('-created_at',)
@@ -39,6 +39,23 @@ class LeaderboardAdmin(admin.ModelAdmin):
     ordering = ('rank',)
 
 
+@admin.register(TeamLeaderboard)
+class TeamLeaderboardAdmin(admin.ModelAdmin):
+    """Admin interface for TeamLeaderboard model"""
+    list_display = ('team_name', 'member_count', 'total_calories', 'average_calories', 'total_activities', 'rank')
+    search_fields = ('team_name',)
+    ordering = ('rank',)
+
+
+@admin.register(ActivityRollup)
+class ActivityRollupAdmin(admin.ModelAdmin):
+    """Admin interface for ActivityRollup model"""
+    list_display = ('user_id', 'team_id', 'period', 'period_start', 'total_calories', 'total_activities')
+    list_filter = ('period',)
+    search_fields = ('user_id', 'team_id')
+    ordering = ('-period_start',)
+
+
 @admin.register(Workout)
 class WorkoutAdmin(admin.ModelAdmin):
     """Admin interface for Workout model"""
@@ -46,3 +63,11 @@ class WorkoutAdmin(admin.ModelAdmin):
     list_filter = ('difficulty', 'category')
     search_fields = ('name', 'description', 'category')
     ordering = ('name',)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    """Admin interface for Job model"""
+    list_display = ('name', 'status', 'attempts', 'run_at', 'created_at', 'finished_at')
+    list_filter = ('status', 'name')
+    ordering = ('-created_at',)
@@ -0,0 +1,18 @@
+from django.apps import AppConfig
+from pymongo import monitoring
+
+
+class OctofitTrackerConfig(AppConfig):
+    name = 'octofit_tracker'
+
+    def ready(self):
+        # Connect model signal receivers and register background tasks
+        from . import (  # noqa: F401
+            cache, catalog, denormalize, ingest, leaderboard, ranking, rebuild, recommendations, rollups, team_leaderboard, teams
+        )
+        from .pool_metrics import pool_metrics
+        from .profiling import command_profiler
+
+        # Observe the connection pools and commands of every Mongo client in the process
+        monitoring.register(pool_metrics)
+        monitoring.register(command_profiler)
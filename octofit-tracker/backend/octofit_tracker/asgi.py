@@ -2,6 +2,10 @@
 ASGI config for octofit_tracker project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server (e.g. ``uvicorn octofit_tracker.asgi:application``)
+so the ``/api/async/`` read endpoints in async_views.py run on the event loop
+and the live leaderboard stream in live.py (``/api/stream/leaderboard/`` and
+``/ws/leaderboard/``) is available.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
@@ -13,4 +17,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up, since it loads models
+from octofit_tracker.live import live_leaderboard  # noqa: E402
+
+application = live_leaderboard(django_application)
@@ -0,0 +1,136 @@
+"""
+Async read path for the hottest GET endpoints.
+
+These views are plain Django coroutine views, so under asgi.py a slow query
+parks a coroutine instead of holding a request thread. Mongo reads go
+through one process-wide pymongo client driven from a bounded executor
+(the same model motor uses), sized by ``ASYNC_MONGO_POOL``: a request never
+waits on the executor without a pooled connection being available to it.
+``close_client`` shuts both down.
+
+Responses carry the same rows as the lean list output of the matching DRF
+actions, including ``fields=``/``exclude=``, but are bounded by ``limit``
+instead of being cursor paginated.
+"""
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from pymongo import MongoClient
+from rest_framework.exceptions import ValidationError
+from rest_framework.settings import api_settings
+
+from .models import Activity, Leaderboard, Workout
+from .pagination import KeysetPagination
+from .renderers import LeanJSONRenderer
+from .serializers import (
+    ActivitySerializer,
+    LeaderboardSerializer,
+    WorkoutSerializer,
+    LeanSerializer
+)
+from .views import parse_limit, split_fields
+
+_lock = threading.Lock()
+_client = None
+_executor = None
+
+
+def get_client():
+    """Return the shared client and executor, creating them on first use"""
+    global _client, _executor
+    with _lock:
+        if _client is None:
+            pool = settings.ASYNC_MONGO_POOL
+            _client = MongoClient(
+                **{**settings.DATABASES['default'].get('CLIENT', {}), **pool},
+                tz_aware=True,
+                tzinfo=timezone.utc,
+            )
+            _executor = ThreadPoolExecutor(
+                max_workers=pool['maxPoolSize'], thread_name_prefix='octofit-async-read'
+            )
+        return _client, _executor
+
+
+def close_client():
+    global _client, _executor
+    with _lock:
+        if _client is not None:
+            _executor.shutdown(wait=False)
+            _client.close()
+            _client = _executor = None
+
+
+async def find(model, query, projection, sort, limit):
+    """Run a ``find`` on the executor and return its documents"""
+    client, executor = get_client()
+    collection = client[settings.DATABASES['default']['NAME']][model._meta.db_table]
+
+    def run():
+        return list(collection.find(query, projection).sort(sort).limit(limit))
+
+    # Run in a copy of the current context so the request's query profile
+    # (profiling.py) sees the commands issued on the executor thread
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(executor, context.run, run)
+
+
+async def leaderboard(request):
+    """Get leaderboard entries in rank order, optionally for one team"""
+    query = {}
+    if request.GET.get('team_id'):
+        query['team_id'] = request.GET['team_id']
+    return await find_response(request, Leaderboard, LeaderboardSerializer, query, [('rank', 1)])
+
+
+async def activities_by_user(request):
+    """Get a user's most recent activities"""
+    user_id = request.GET.get('user_id')
+    if not user_id:
+        return error_response("user_id parameter is required")
+    return await find_response(
+        request, Activity, ActivitySerializer, {'user_id': user_id}, [('date', -1)]
+    )
+
+
+async def workouts(request):
+    """Get workouts, optionally filtered by difficulty and category"""
+    query = {
+        field: request.GET[field]
+        for field in ('difficulty', 'category')
+        if request.GET.get(field)
+    }
+    return await find_response(request, Workout, WorkoutSerializer, query, [('_id', -1)])
+
+
+async def find_response(request, model, serializer_class, query, sort):
+    """Run one projected ``find`` and render its rows like the lean list path"""
+    lean = LeanSerializer.for_serializer(serializer_class)
+    fields = split_fields(request.GET.get('fields'))
+    exclude = split_fields(request.GET.get('exclude'))
+    try:
+        limit = parse_limit(request.GET, 'limit', api_settings.PAGE_SIZE, KeysetPagination.max_page_size)
+    except ValidationError:
+        return error_response("limit must be an integer")
+    if fields or exclude:
+        try:
+            lean = lean.restrict(fields, exclude)
+        except ValueError as exc:
+            return error_response(str(exc))
+
+    projection = dict.fromkeys(lean.columns, 1)
+    projection.setdefault('_id', 0)
+    rows = [
+        lean.to_representation({column: document.get(column) for column in lean.columns})
+        for document in await find(model, query, projection, sort, limit)
+    ]
+    return HttpResponse(LeanJSONRenderer().render(rows), content_type='application/json')
+
+
+def error_response(message):
+    return JsonResponse({"error": message}, status=400)
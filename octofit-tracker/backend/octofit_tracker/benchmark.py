@@ -0,0 +1,149 @@
+"""
+API benchmark harness.
+
+``run_endpoint`` replays one endpoint through Django's test client and
+reports latency percentiles, Mongo round trips per request (taken from the
+``Server-Timing`` header written by the profiling middleware) and the peak
+Python memory allocated while serving one request. ``compare`` checks a run
+against stored baselines and lists every metric that regressed by more
+than the allowed fraction. ``ephemeral_mongod`` starts a throwaway mongod
+so runs do not depend on the state of a shared server. The
+``benchmark_api`` command seeds datasets of increasing size and drives
+these helpers.
+"""
+import contextlib
+import math
+import re
+import shutil
+import socket
+import subprocess
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+from django.core.cache import cache
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+from .ranking import ranking
+
+# (name, path); placeholders are filled from the seeded dataset
+ENDPOINTS = [
+    ('activities', '/api/activities/'),
+    ('activities by user', '/api/activities/by_user/?user_id={user_id}'),
+    ('activities by type', '/api/activities/by_type/?activity_type=Running'),
+    ('leaderboard', '/api/leaderboard/'),
+    ('leaderboard top users', '/api/leaderboard/top_users/'),
+    ('leaderboard by team', '/api/leaderboard/by_team/?team_id={team_id}'),
+    ('teams', '/api/teams/'),
+    ('users by team', '/api/users/by_team/?team_id={team_id}'),
+    ('workouts by difficulty', '/api/workouts/by_difficulty/?difficulty=Advanced'),
+]
+
+# Metrics compared against the baseline; round trips must not grow at all
+LATENCY_METRICS = ('p50_ms', 'p95_ms', 'p99_ms')
+MEMORY_METRICS = ('peak_kib',)
+
+_DB_TIMING = re.compile(r'db;dur=[\d.]+;desc="(\d+) round trips"')
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(samples)
+    # The smallest sample with at least ``fraction`` of the samples at or below it
+    return ordered[min(max(math.ceil(len(ordered) * fraction) - 1, 0), len(ordered) - 1)]
+
+
+def run_endpoint(client, path, iterations, warmup=5, cold_cache=True):
+    """
+    Request ``path`` repeatedly and summarize latency, round trips and memory.
+
+    With ``cold_cache`` the response cache and ranking index are cleared
+    before every request, so the numbers reflect the database path rather
+    than cache hits.
+    """
+    def request():
+        if cold_cache:
+            cache.clear()
+            ranking.reset()
+        started = perf_counter()
+        response = client.get(path)
+        elapsed = (perf_counter() - started) * 1000
+        if response.status_code != 200:
+            raise RuntimeError(f'GET {path} returned {response.status_code}')
+        match = _DB_TIMING.search(response.get('Server-Timing', ''))
+        return elapsed, int(match.group(1)) if match else None
+
+    for _ in range(warmup):
+        request()
+    latencies = []
+    round_trips = 0
+    for _ in range(iterations):
+        elapsed, round_trips = request()
+        latencies.append(elapsed)
+
+    tracemalloc.start()
+    try:
+        request()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'round_trips': round_trips,
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Return regressions of ``results`` against ``baseline``.
+
+    Both map ``"<size>/<endpoint>"`` to metrics. Latency and memory may grow
+    by ``threshold`` (a fraction) before counting as a regression; round
+    trips may not grow. Entries missing from the baseline are skipped.
+    """
+    regressions = []
+    for key, metrics in results.items():
+        expected = baseline.get(key)
+        if expected is None:
+            continue
+        for metric in LATENCY_METRICS + MEMORY_METRICS:
+            if metric in expected and metrics[metric] > expected[metric] * (1 + threshold):
+                regressions.append(f'{key}: {metric} {metrics[metric]} > baseline {expected[metric]}')
+        if (expected.get('round_trips') is not None and metrics['round_trips'] is not None
+                and metrics['round_trips'] > expected['round_trips']):
+            regressions.append(
+                f'{key}: round_trips {metrics["round_trips"]} > baseline {expected["round_trips"]}'
+            )
+    return regressions
+
+
+@contextlib.contextmanager
+def ephemeral_mongod(binary='mongod', timeout=30):
+    """Run a mongod on a free port with a temporary data directory; yield ``(host, port)``"""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    dbpath = tempfile.mkdtemp(prefix='octofit-bench-')
+    process = subprocess.Popen(
+        [binary, '--dbpath', dbpath, '--port', str(port), '--bind_ip', '127.0.0.1'],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        client = MongoClient('127.0.0.1', port, serverSelectionTimeoutMS=timeout * 1000)
+        try:
+            client.admin.command('ping')
+        except PyMongoError:
+            raise RuntimeError(f'{binary} did not start on port {port}')
+        finally:
+            client.close()
+        yield '127.0.0.1', port
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(dbpath, ignore_errors=True)
@@ -0,0 +1,125 @@
+"""
+Read-through response caching with versioned invalidation.
+
+Cached responses are grouped into namespaces. Each namespace has a version
+counter; it is part of every cache key and ETag, so bumping it with
+``invalidate`` makes every cached response in the namespace unreachable at
+once. Clients that send a matching ``If-None-Match`` get a 304 without the
+view being run.
+
+Versions live in the ``cache_versions`` collection rather than in the
+cache, so a write made by any process (API workers, the job worker,
+management commands) moves the version every process sees, and ETags are
+the same whichever process answers. Each process remembers a version for
+``CACHE_VERSION_TTL`` seconds, so a write made elsewhere is picked up
+within that delay; writes made in the same process are seen at once.
+"""
+import hashlib
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import CacheVersion, Leaderboard
+
+LEADERBOARD = 'leaderboard'
+CATALOG = 'catalog'
+
+_lock = threading.Lock()
+_versions = {}  # namespace -> (version, monotonic time it was read)
+
+
+def namespace_version(namespace):
+    """Return the current version of a cache namespace"""
+    entry = _versions.get(namespace)
+    if entry is not None and time.monotonic() - entry[1] < getattr(settings, 'CACHE_VERSION_TTL', 1.0):
+        return entry[0]
+    document = CacheVersion.objects.mongo_find_one({'namespace': namespace})
+    if document is None:
+        try:
+            CacheVersion.objects.mongo_insert_one({'namespace': namespace, 'version': _initial_version()})
+        except DuplicateKeyError:
+            pass  # another process created it first
+        document = CacheVersion.objects.mongo_find_one({'namespace': namespace})
+    return _remember(namespace, document['version'])
+
+
+def invalidate(namespace):
+    """Make every cached response in a namespace stale"""
+    document = CacheVersion.objects.mongo_find_one_and_update(
+        {'namespace': namespace},
+        {'$inc': {'version': 1}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if document is None:
+        # Create the version document, then bump it like any other
+        _versions.pop(namespace, None)
+        namespace_version(namespace)
+        return invalidate(namespace)
+    _remember(namespace, document['version'])
+
+
+def _remember(namespace, version):
+    with _lock:
+        current = _versions.get(namespace)
+        # Never step back to an older version read by a slower thread
+        if current is not None and current[0] > version:
+            version = current[0]
+        _versions[namespace] = (version, time.monotonic())
+    return version
+
+
+def _initial_version():
+    # Seeded from the clock so a version document lost to a dropped
+    # collection never restarts at a version that was already handed out
+    return time.time_ns() // 1000
+
+
+def request_digest(request):
+    """Hash the endpoint and its sorted query params"""
+    params = sorted(request.query_params.lists())
+    raw = f'{request.get_host()}{request.path}?{params}'
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def cached_response(namespace, timeout=DEFAULT_TIMEOUT):
+    """Cache successful GET responses of a view method and answer conditional requests"""
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            version = namespace_version(namespace)
+            digest = request_digest(request)
+            key = f'{namespace}:{version}:{digest}'
+            etag = f'"{digest}-{version}"'
+
+            if etag in _parse_etags(request.headers.get('If-None-Match', '')):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+            data = cache.get(key)
+            if data is None:
+                response = method(self, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                data = response.data
+                cache.set(key, data, timeout)
+            return Response(data, headers={'ETag': etag})
+        return wrapper
+    return decorator
+
+
+def _parse_etags(header):
+    return {tag.strip() for tag in header.split(',') if tag.strip()}
+
+
+@receiver([post_save, post_delete], sender=Leaderboard)
+def leaderboard_changed(sender, **kwargs):
+    invalidate(LEADERBOARD)
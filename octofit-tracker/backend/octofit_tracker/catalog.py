@@ -0,0 +1,103 @@
+"""
+In-memory workout catalog.
+
+Workouts are a small catalog that rarely changes, so reads are served
+from an immutable ``CatalogSnapshot``: every workout serialized once,
+newest first, with position indexes by difficulty and category and the
+positions sorted by duration for range lookups. Facet filters
+(``difficulty``, ``category``, ``min_duration``, ``max_duration``) are
+intersections of those indexes and never touch Mongo.
+
+Snapshots are versioned with the ``CATALOG`` cache namespace (see
+cache.py), whose version is kept in Mongo. Workout saves and deletes, from
+the API or the admin of any process, bump it; each process compares its
+snapshot's version with the current one on read (re-read from Mongo at
+most every ``CACHE_VERSION_TTL`` seconds) and swaps in a freshly loaded
+snapshot when they differ. Requests that already hold the old snapshot
+finish with it undisturbed.
+"""
+import threading
+from bisect import bisect_left, bisect_right
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import CATALOG, invalidate, namespace_version
+from .models import Workout
+from .serializers import LeanSerializer, WorkoutSerializer
+
+
+class CatalogSnapshot:
+    """Serialized workouts plus facet indexes; never mutated after construction"""
+
+    def __init__(self, rows, version=None):
+        self.version = version
+        # Newest first, matching the viewset's cursor ordering
+        self.rows = tuple(sorted(rows, key=lambda row: row['_id'], reverse=True))
+        self.by_id = {row['_id']: row for row in self.rows}
+        self.by_difficulty = self._index('difficulty')
+        self.by_category = self._index('category')
+        by_duration = sorted(range(len(self.rows)), key=lambda position: self.rows[position]['duration'])
+        self.durations = [self.rows[position]['duration'] for position in by_duration]
+        self.duration_positions = by_duration
+
+    def _index(self, field):
+        index = {}
+        for position, row in enumerate(self.rows):
+            index.setdefault(row[field], []).append(position)
+        return {value: frozenset(positions) for value, positions in index.items()}
+
+    def filter(self, difficulty=None, category=None, min_duration=None, max_duration=None):
+        """Rows matching every given facet, newest first"""
+        facets = []
+        if difficulty is not None:
+            facets.append(self.by_difficulty.get(difficulty, frozenset()))
+        if category is not None:
+            facets.append(self.by_category.get(category, frozenset()))
+        if min_duration is not None or max_duration is not None:
+            low = 0 if min_duration is None else bisect_left(self.durations, min_duration)
+            high = len(self.durations) if max_duration is None else bisect_right(self.durations, max_duration)
+            facets.append(frozenset(self.duration_positions[low:high]))
+        if not facets:
+            return list(self.rows)
+        positions = frozenset.intersection(*facets) if len(facets) > 1 else facets[0]
+        return [self.rows[position] for position in sorted(positions)]
+
+    def get(self, workout_id):
+        return self.by_id.get(workout_id)
+
+
+class Catalog:
+    """Holds the current snapshot and reloads it when the version moves"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def snapshot(self):
+        version = namespace_version(CATALOG)
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or self._snapshot.version != version:
+                self._snapshot = load_snapshot(version)
+            return self._snapshot
+
+    def reset(self):
+        with self._lock:
+            self._snapshot = None
+
+
+def load_snapshot(version=None):
+    """Read and serialize every workout in one query"""
+    lean = LeanSerializer.for_serializer(WorkoutSerializer)
+    return CatalogSnapshot(lean.serialize(lean.project(Workout.objects.all())), version)
+
+
+catalog = Catalog()
+
+
+@receiver([post_save, post_delete], sender=Workout)
+def workout_changed(sender, **kwargs):
+    invalidate(CATALOG)
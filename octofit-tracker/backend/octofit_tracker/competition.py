@@ -0,0 +1,76 @@
+"""
+Competition ranking shared by the user and team leaderboards.
+
+Both ``leaderboard`` and ``team_leaderboard`` rank on ``total_calories``
+with standard competition ranking: an entry's rank is one plus the number
+of entries with strictly more calories, and ties share a rank. When an
+entry's total moves from ``old`` to ``new`` the only other entries whose
+rank changes are the ones with a total in ``[min(old, new), max(old, new))``,
+so re-ranking touches that slice only.
+
+The helpers take the model and the field identifying an entry
+(``user_id`` or ``team_id``) and never touch the response cache.
+"""
+from pymongo import ReturnDocument, UpdateMany
+
+
+def competition_ranks(histogram):
+    """Map each total in a ``{total: entry count}`` histogram to its competition rank"""
+    ranks = {}
+    ahead = 0
+    for total in sorted(histogram, reverse=True):
+        ranks[total] = ahead + 1
+        ahead += histogram[total]
+    return ranks
+
+
+def rank_for(model, total_calories):
+    """Rank an entry with ``total_calories`` has among the entries of ``model``"""
+    return 1 + model.objects.mongo_count_documents({'total_calories': {'$gt': total_calories}})
+
+
+def increment(model, key_field, key, inc, projection):
+    """``$inc`` one entry's counters; return the entry as it was before, or ``None``"""
+    return model.objects.mongo_find_one_and_update(
+        {key_field: key},
+        {'$inc': inc, '$currentDate': {'updated_at': True}},
+        projection=projection,
+        return_document=ReturnDocument.BEFORE,
+    )
+
+
+def rerank_entry(model, key_field, key, old_total, new_total, fields=None):
+    """Shift the ranks of the slice an entry crossed and store its new rank (plus ``fields``)"""
+    if old_total != new_total:
+        low, high = sorted((old_total, new_total))
+        model.objects.mongo_update_many(
+            {
+                key_field: {'$ne': key},
+                'total_calories': {'$gte': low, '$lt': high},
+            },
+            {'$inc': {'rank': 1 if new_total > old_total else -1}},
+        )
+    model.objects.mongo_update_one(
+        {key_field: key},
+        {'$set': {'rank': rank_for(model, new_total), **(fields or {})}},
+    )
+
+
+def rerank_all(model):
+    """Recompute every rank of ``model`` from the stored totals; return the entry count"""
+    histogram = {
+        row['_id']: row['count']
+        for row in model.objects.mongo_aggregate([
+            {'$group': {'_id': {'$ifNull': ['$total_calories', 0]}, 'count': {'$sum': 1}}},
+        ])
+    }
+    updates = [
+        UpdateMany(
+            {'total_calories': total} if total else {'total_calories': {'$in': [0, None]}},
+            {'$set': {'rank': rank}},
+        )
+        for total, rank in competition_ranks(histogram).items()
+    ]
+    if updates:
+        model.objects.mongo_bulk_write(updates, ordered=False)
+    return sum(histogram.values())
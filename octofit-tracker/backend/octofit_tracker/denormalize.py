@@ -0,0 +1,145 @@
+"""
+Propagation of denormalized user and team fields.
+
+Leaderboard entries copy ``user_name``, ``team_id`` and ``team_name`` and
+team standings copy ``team_name`` so reads never join ``users`` or
+``teams``. Renames and team switches are pushed into those copies as they
+happen: each one is a single filtered ``update_many`` that only touches
+documents still holding the old value. ``sync_denormalized_names`` is the
+batched reconciliation for writes that bypass the ORM signals (raw Mongo
+writes, imports); it compares every entry against its sources and fixes
+the stale ones with bulk updates.
+"""
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from pymongo import UpdateOne
+
+from .cache import LEADERBOARD, invalidate
+from .jobs import task
+from .models import User, Team, Leaderboard, TeamLeaderboard
+from .signals import membership_changed
+from .teams import get_team
+
+BATCH_SIZE = 1000
+
+
+def rename_user(user_id, name):
+    """Push a user's name into their leaderboard entry"""
+    result = Leaderboard.objects.mongo_update_many(
+        {'user_id': user_id, 'user_name': {'$ne': name}},
+        {'$set': {'user_name': name}},
+    )
+    if result.modified_count:
+        invalidate(LEADERBOARD)
+
+
+def rename_team(team_id, name):
+    """Push a team's name into leaderboard entries and the team standing"""
+    modified = 0
+    for model in (Leaderboard, TeamLeaderboard):
+        modified += model.objects.mongo_update_many(
+            {'team_id': team_id, 'team_name': {'$ne': name}},
+            {'$set': {'team_name': name}},
+        ).modified_count
+    if modified:
+        invalidate(LEADERBOARD)
+
+
+def move_user_entry(user_id, new_team_id):
+    """Point a user's leaderboard entry at their new team"""
+    team = get_team(new_team_id) if new_team_id else None
+    result = Leaderboard.objects.mongo_update_many(
+        {'user_id': user_id},
+        {'$set': {'team_id': new_team_id, 'team_name': team.name if team else None}},
+    )
+    if result.modified_count:
+        invalidate(LEADERBOARD)
+
+
+@task('leaderboard.sync_names')
+def sync_denormalized_names(batch_size=BATCH_SIZE):
+    """
+    Reconcile every leaderboard entry and team standing with its sources.
+
+    Teams are loaded once; entries are streamed and their users fetched
+    one batch at a time, and stale documents are fixed with one
+    ``bulk_write`` per batch. Returns the number of documents updated.
+    """
+    team_names = {
+        str(team['_id']): team['name']
+        for team in Team.objects.mongo_find({}, {'name': 1})
+    }
+    updated = 0
+
+    standings = [
+        UpdateOne({'_id': standing['_id']}, {'$set': {'team_name': team_names[standing['team_id']]}})
+        for standing in TeamLeaderboard.objects.mongo_find({}, {'team_id': 1, 'team_name': 1})
+        if standing['team_id'] in team_names and standing.get('team_name') != team_names[standing['team_id']]
+    ]
+    if standings:
+        updated += TeamLeaderboard.objects.mongo_bulk_write(standings, ordered=False).modified_count
+
+    batch = []
+    entries = Leaderboard.objects.mongo_find(
+        {}, {'user_id': 1, 'user_name': 1, 'team_id': 1, 'team_name': 1}
+    ).batch_size(batch_size)
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            updated += _sync_entries(batch, team_names)
+            batch = []
+    if batch:
+        updated += _sync_entries(batch, team_names)
+
+    if updated:
+        invalidate(LEADERBOARD)
+    return updated
+
+
+def _sync_entries(entries, team_names):
+    object_ids = []
+    for entry in entries:
+        try:
+            object_ids.append(ObjectId(entry['user_id']))
+        except (InvalidId, TypeError):
+            continue
+    users = {
+        str(user['_id']): user
+        for user in User.objects.mongo_find({'_id': {'$in': object_ids}}, {'name': 1, 'team_id': 1})
+    }
+
+    updates = []
+    for entry in entries:
+        user = users.get(entry['user_id'])
+        if user is None:
+            continue
+        team_id = user.get('team_id')
+        expected = {
+            'user_name': user['name'],
+            'team_id': team_id,
+            'team_name': team_names.get(team_id),
+        }
+        if any(entry.get(field) != value for field, value in expected.items()):
+            updates.append(UpdateOne({'_id': entry['_id']}, {'$set': expected}))
+    if not updates:
+        return 0
+    return Leaderboard.objects.mongo_bulk_write(updates, ordered=False).modified_count
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, **kwargs):
+    if not created:
+        rename_user(str(instance._id), instance.name)
+
+
+@receiver(post_save, sender=Team)
+def team_saved(sender, instance, created, **kwargs):
+    if not created:
+        rename_team(str(instance._id), instance.name)
+
+
+@receiver(membership_changed)
+def membership_changed_receiver(sender, user_id, old_team_id, new_team_id, **kwargs):
+    move_user_entry(user_id, new_team_id)
@@ -0,0 +1,159 @@
+"""
+Streaming export of activities for analytics.
+
+Activities matching a user, type and/or date range are read with one
+``find`` in ``_id`` order and encoded one batch at a time, so memory use
+depends on the batch size and not on how many activities are exported.
+``export_chunks`` yields encoded bytes for an HTTP response or a file:
+
+- ``csv``: a header row, then one row per activity
+- ``arrow``: an Arrow IPC stream with one record batch per batch
+- ``parquet``: a Parquet file with one row group per batch
+
+Arrow and Parquet need pyarrow, which is optional; ``FORMATS`` lists what
+this installation supports. Rows are ordered by ``_id``, so an interrupted
+export is resumed by passing the last ``_id`` received as ``after``.
+"""
+import csv
+import io
+from datetime import timezone
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from .models import Activity
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # pyarrow is optional
+    pyarrow = None
+
+BATCH_SIZE = 5000
+
+COLUMNS = ('_id', 'user_id', 'activity_type', 'duration', 'calories', 'distance', 'date', 'notes')
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+}
+FORMATS = ('csv', 'arrow', 'parquet') if pyarrow is not None else ('csv',)
+
+
+def export_filter(user_id=None, activity_type=None, start=None, end=None, after=None):
+    """
+    Build the ``find`` filter of an export.
+
+    ``start`` is inclusive and ``end`` exclusive. ``after`` is the ``_id``
+    of the last activity already exported; raises ``ValueError`` if it is
+    not a valid ObjectId.
+    """
+    query = {}
+    if user_id:
+        query['user_id'] = user_id
+    if activity_type:
+        query['activity_type'] = activity_type
+    if start or end:
+        query['date'] = {}
+        if start:
+            query['date']['$gte'] = start
+        if end:
+            query['date']['$lt'] = end
+    if after:
+        try:
+            query['_id'] = {'$gt': ObjectId(after)}
+        except (InvalidId, TypeError):
+            raise ValueError(f'Invalid cursor: {after}')
+    return query
+
+
+def iter_batches(query, batch_size=BATCH_SIZE):
+    """Yield lists of at most ``batch_size`` activity documents in ``_id`` order"""
+    cursor = Activity.objects.mongo_find(query, {column: 1 for column in COLUMNS}).sort('_id', 1)
+    batch = []
+    for document in cursor.batch_size(batch_size):
+        batch.append(document)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def export_chunks(query, output='csv', batch_size=BATCH_SIZE, header=True):
+    """Yield the export of the activities matching ``query`` as encoded chunks"""
+    if output not in FORMATS:
+        raise ValueError(f'Unsupported format: {output}')
+    batches = iter_batches(query, batch_size)
+    if output == 'csv':
+        return _csv_chunks(batches, header)
+    return _arrow_chunks(batches, output)
+
+
+def _csv_value(column, value):
+    if value is None:
+        return ''
+    if column == 'date':
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    return value
+
+
+def _csv_chunks(batches, header):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(COLUMNS)
+    for batch in batches:
+        for document in batch:
+            row = [_csv_value(column, document.get(column)) for column in COLUMNS]
+            row[0] = str(row[0])
+            writer.writerow(row)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _arrow_schema():
+    return pyarrow.schema([
+        ('_id', pyarrow.string()),
+        ('user_id', pyarrow.string()),
+        ('activity_type', pyarrow.string()),
+        ('duration', pyarrow.int64()),
+        ('calories', pyarrow.int64()),
+        ('distance', pyarrow.float64()),
+        ('date', pyarrow.timestamp('us', tz='UTC')),
+        ('notes', pyarrow.string()),
+    ])
+
+
+def _arrow_chunks(batches, output):
+    schema = _arrow_schema()
+    sink = io.BytesIO()
+    if output == 'parquet':
+        writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    else:
+        writer = pyarrow.ipc.new_stream(sink, schema)
+    for batch in batches:
+        columns = {column: [document.get(column) for document in batch] for column in COLUMNS}
+        columns['_id'] = [str(value) for value in columns['_id']]
+        columns['date'] = [
+            value.replace(tzinfo=timezone.utc) if value is not None and value.tzinfo is None else value
+            for value in columns['date']
+        ]
+        writer.write_table(pyarrow.Table.from_pydict(columns, schema=schema))
+        yield _drain(sink)
+    writer.close()
+    yield _drain(sink)
+
+
+def _drain(sink):
+    data = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return data
@@ -0,0 +1,167 @@
+"""
+Mongo index declarations and the query shapes they must cover.
+
+Indexes are declared with ``Meta.indexes`` on the models and unique ones
+with ``UniqueConstraint`` in ``Meta.constraints``; partial indexes, which
+djongo cannot express in schema SQL, are declared in ``PARTIAL_INDEXES``.
+This module turns those declarations into pymongo key specs so they can be
+created and checked directly against Mongo, and lists the query shapes issued by the API views
+so the test suite can verify each one with an explain plan.
+"""
+from django.db.models import UniqueConstraint
+from pymongo import ASCENDING, DESCENDING
+
+from datetime import datetime, timezone
+
+from .models import (
+    User, Team, Activity, Leaderboard, TeamLeaderboard, Workout, ActivityRollup, ActivityProfile, Job,
+    CacheVersion,
+)
+
+INDEXED_MODELS = [
+    User, Team, Activity, Leaderboard, TeamLeaderboard, Workout, ActivityRollup, ActivityProfile, Job,
+    CacheVersion,
+]
+
+_SINCE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+# (description, model, filter, sort) for every hot query issued by the views
+QUERY_SHAPES = [
+    ('activity list', Activity, {}, [('date', DESCENDING), ('_id', DESCENDING)]),
+    ('activities by user', Activity, {'user_id': 'x'}, [('date', DESCENDING), ('_id', DESCENDING)]),
+    ('activities by type', Activity, {'activity_type': 'x'}, [('date', DESCENDING), ('_id', DESCENDING)]),
+    ('leaderboard list', Leaderboard, {}, [('rank', ASCENDING), ('_id', ASCENDING)]),
+    ('leaderboard by team', Leaderboard, {'team_id': 'x'}, [('rank', ASCENDING), ('_id', ASCENDING)]),
+    ('leaderboard entry', Leaderboard, {'user_id': 'x'}, None),
+    ('leaderboard rank slice', Leaderboard, {'total_calories': {'$gte': 0, '$lt': 100}}, None),
+    ('team leaderboard', TeamLeaderboard, {}, [('rank', ASCENDING), ('_id', ASCENDING)]),
+    ('team standing', TeamLeaderboard, {'team_id': 'x'}, None),
+    ('team rank slice', TeamLeaderboard, {'total_calories': {'$gte': 0, '$lt': 100}}, None),
+    ('users by team', User, {'team_id': 'x'}, [('_id', DESCENDING)]),
+    ('workouts by difficulty', Workout, {'difficulty': 'x'}, [('_id', DESCENDING)]),
+    ('workouts by category', Workout, {'category': 'x'}, [('_id', DESCENDING)]),
+    ('windowed leaderboard', ActivityRollup, {'period': 'week', 'period_start': {'$gte': _SINCE}}, None),
+    ('windowed team leaderboard', ActivityRollup,
+     {'period': 'week', 'team_id': 'x', 'period_start': {'$gte': _SINCE}}, None),
+    ('activity profile', ActivityProfile, {'user_id': 'x'}, None),
+    ('job claim', Job, {'status': 'pending', 'run_at': {'$lte': _SINCE}}, [('run_at', ASCENDING)]),
+    ('job dedup', Job, {'key': 'x', 'status': 'pending'}, None),
+    ('cache version', CacheVersion, {'namespace': 'x'}, None),
+    ('rollup upsert', ActivityRollup, {'user_id': 'x', 'period': 'day', 'period_start': _SINCE}, None),
+]
+
+# {model: {name: (key spec, create_index options)}}, created only through pymongo
+PARTIAL_INDEXES = {
+    Job: {
+        # Serves the enqueue dedup lookup and makes it safe under races
+        'jobs_pending_key_uniq': (
+            [('key', ASCENDING)],
+            {'unique': True, 'partialFilterExpression': {'status': 'pending'}},
+        ),
+    },
+}
+
+# Plan stages that mean a query shape is not served by an index
+UNINDEXED_STAGES = {'COLLSCAN', 'SORT'}
+
+
+def _key_spec(fields):
+    return [
+        (field.lstrip('-'), DESCENDING if field.startswith('-') else ASCENDING)
+        for field in fields
+    ]
+
+
+def _unique_constraints(model):
+    return [
+        constraint for constraint in model._meta.constraints
+        if isinstance(constraint, UniqueConstraint)
+    ]
+
+
+def declared_indexes(model):
+    """Return ``{name: key_spec}`` for the indexes declared on a model"""
+    declared = {index.name: _key_spec(index.fields) for index in model._meta.indexes}
+    for constraint in _unique_constraints(model):
+        declared[constraint.name] = _key_spec(constraint.fields)
+    for name, (keys, _options) in PARTIAL_INDEXES.get(model, {}).items():
+        declared[name] = keys
+    return declared
+
+
+def index_options(model, name):
+    """Return the ``create_index`` options of a declared index"""
+    if name in PARTIAL_INDEXES.get(model, {}):
+        return PARTIAL_INDEXES[model][name][1]
+    for constraint in _unique_constraints(model):
+        if constraint.name == name:
+            return {'unique': True}
+    return {}
+
+
+def create_declared_indexes(collection, model):
+    """Create the indexes declared on ``model`` on a pymongo collection, e.g. a shadow copy"""
+    for name, keys in declared_indexes(model).items():
+        collection.create_index(keys, name=name, **index_options(model, name))
+
+
+def existing_indexes(model):
+    """Return ``{name: key_spec}`` for the indexes present in Mongo"""
+    return {
+        name: [(field, int(direction)) for field, direction in info['key']]
+        for name, info in model.objects.mongo_index_information().items()
+    }
+
+
+def missing_indexes(model):
+    """Return the declared indexes whose key spec (and uniqueness) is not present in Mongo"""
+    present = [
+        ([(field, int(direction)) for field, direction in info['key']], bool(info.get('unique')))
+        for info in model.objects.mongo_index_information().values()
+    ]
+    return {
+        name: keys
+        for name, keys in declared_indexes(model).items()
+        if (keys, index_options(model, name).get('unique', False)) not in present
+    }
+
+
+def ensure_indexes(model):
+    """Create the declared indexes that are missing and return their names"""
+    missing = missing_indexes(model)
+    existing = existing_indexes(model)
+    for name, keys in missing.items():
+        if name in existing:
+            # Same name, other keys or uniqueness: an outdated declaration,
+            # or the bogus index djongo built from a conditional UniqueConstraint
+            model.objects.mongo_drop_index(name)
+        model.objects.mongo_create_index(keys, name=name, background=True, **index_options(model, name))
+    return sorted(missing)
+
+
+def plan_stages(model, query, sort=None):
+    """Return every stage name in the winning plan for a find"""
+    cursor = model.objects.mongo_find(query)
+    if sort:
+        cursor = cursor.sort(sort)
+    plan = cursor.explain()['queryPlanner']['winningPlan']
+
+    stages = []
+    pending = [plan]
+    while pending:
+        stage = pending.pop()
+        stages.append(stage['stage'])
+        if 'inputStage' in stage:
+            pending.append(stage['inputStage'])
+        pending.extend(stage.get('inputStages', []))
+    return stages
+
+
+def unindexed_shapes():
+    """Return ``(description, stages)`` for query shapes not served by an index"""
+    failures = []
+    for description, model, query, sort in QUERY_SHAPES:
+        stages = plan_stages(model, query, sort)
+        if UNINDEXED_STAGES.intersection(stages):
+            failures.append((description, stages))
+    return failures
@@ -0,0 +1,180 @@
+"""
+Streaming bulk ingestion of activities.
+
+Payloads are read incrementally from the request stream, either as NDJSON
+(one activity per line) or as a JSON array, validated record by record and
+written with batched ``insert_many`` calls. Updating the aggregates is left
+to a background job per batch (see jobs.py), which applies the batch as
+combined per-user deltas, so ingestion requests only pay for the inserts.
+"""
+import codecs
+import json
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from .jobs import enqueue, task
+from .models import Activity
+from .serializers import ActivitySerializer
+from .signals import send_activities_changed
+
+BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+# A decode error this close to the end of the buffer may be a token cut off
+# by the chunk boundary (``tru``, ``1e-``, ``\\u00``) rather than bad input
+TRUNCATED_TAIL = 16
+NUMBER_CHARS = set('0123456789+-.eE')
+
+ACTIVITY_FIELDS = [
+    field for field in ActivitySerializer.Meta.fields
+    if field not in ActivitySerializer.Meta.read_only_fields
+]
+
+
+class ParseError(str):
+    """Marks an NDJSON line that could not be decoded"""
+
+
+def iter_ndjson(stream):
+    """Yield ``(index, record)`` for each non-blank line of an NDJSON stream"""
+    index = 0
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            record = ParseError(str(exc))
+        yield index, record
+        index += 1
+
+
+def iter_json_array(stream, chunk_size=CHUNK_SIZE):
+    """
+    Yield ``(index, record)`` for each element of a JSON array without loading it whole.
+
+    Raises ``ValueError`` at the first element that cannot be decoded, without
+    reading the rest of the stream.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    position = 0
+    exhausted = False
+    started = False
+    index = 0
+
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+
+        if position == len(buffer):
+            if exhausted:
+                raise ValueError('unexpected end of JSON array')
+            buffer, exhausted = _read_more(stream, utf8, buffer[position:], chunk_size)
+            position = 0
+            continue
+
+        if not started:
+            if buffer[position] != '[':
+                raise ValueError('expected a JSON array')
+            started = True
+            position += 1
+            continue
+
+        if buffer[position] == ']':
+            return
+
+        try:
+            record, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as exc:
+            if exhausted or not _truncated(exc, len(buffer)):
+                raise
+            buffer, exhausted = _read_more(stream, utf8, buffer[position:], chunk_size)
+            position = 0
+            continue
+
+        if not exhausted and set(buffer[end:]) <= NUMBER_CHARS:
+            # A scalar may continue in the next chunk (``1`` of ``1e+300``); decode again with more data
+            buffer, exhausted = _read_more(stream, utf8, buffer[position:], chunk_size)
+            position = 0
+            continue
+
+        yield index, record
+        index += 1
+        position = end
+
+
+def ingest(records, batch_size=BATCH_SIZE):
+    """Validate and insert ``(index, record)`` pairs in batches; return a per-record report"""
+    created = 0
+    errors = []
+    batch = []
+
+    try:
+        for index, record in records:
+            if isinstance(record, ParseError):
+                errors.append({'index': index, 'errors': {'non_field_errors': [str(record)]}})
+                continue
+            serializer = ActivitySerializer(data=record)
+            if not serializer.is_valid():
+                errors.append({'index': index, 'errors': serializer.errors})
+                continue
+            batch.append((index, Activity(**serializer.validated_data)))
+            if len(batch) >= batch_size:
+                created += _write_batch(batch, errors)
+                batch = []
+    except ValueError as exc:
+        errors.append({'index': None, 'errors': {'non_field_errors': [f'Malformed payload: {exc}']}})
+
+    if batch:
+        created += _write_batch(batch, errors)
+    return {'created': created, 'errors': errors}
+
+
+def _truncated(error, length):
+    """Whether a decode error may only mean the element continues in the next chunk"""
+    return error.msg.startswith('Unterminated string') or length - error.pos <= TRUNCATED_TAIL
+
+
+def _read_more(stream, utf8, remainder, chunk_size):
+    chunk = stream.read(chunk_size)
+    if not chunk:
+        return remainder + utf8.decode(b'', final=True), True
+    return remainder + utf8.decode(chunk), False
+
+
+def _write_batch(batch, errors):
+    documents = [
+        {field: getattr(activity, field) for field in ACTIVITY_FIELDS}
+        for _, activity in batch
+    ]
+    failed = set()
+    try:
+        Activity.objects.mongo_insert_many(documents, ordered=False)
+    except BulkWriteError as exc:
+        for error in exc.details.get('writeErrors', []):
+            failed.add(error['index'])
+            errors.append({
+                'index': batch[error['index']][0],
+                'errors': {'non_field_errors': [error['errmsg']]},
+            })
+
+    inserted = [
+        str(document['_id'])
+        for position, document in enumerate(documents)
+        if position not in failed
+    ]
+    if inserted:
+        enqueue('ingest.apply_activities', activity_ids=inserted)
+    return len(inserted)
+
+
+# Deltas are not idempotent, so a failed batch is not retried (a retry after
+# a partial apply would count it twice); the rebuild jobs repair aggregates
+@task('ingest.apply_activities', max_attempts=1)
+def apply_ingested_activities(activity_ids):
+    """Fold one ingested batch into the leaderboard and other aggregates"""
+    activities = Activity.objects.filter(_id__in=[ObjectId(activity_id) for activity_id in activity_ids])
+    send_activities_changed(added=activities)
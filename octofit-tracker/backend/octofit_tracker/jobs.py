@@ -0,0 +1,269 @@
+"""
+In-process background jobs with a durable queue in Mongo.
+
+Expensive recomputations are registered as tasks with ``@task(name)`` and
+queued with ``enqueue(name, **kwargs)``. Each job is a document in the
+``jobs`` collection, so queued work survives restarts and any process can
+run it; there is no external broker.
+
+- Dedup: enqueueing upserts on ``(key, status='pending')``, where ``key``
+  digests the task name and arguments, so identical pending jobs collapse
+  into one. A unique partial index on ``key`` over pending jobs makes this
+  hold under concurrent enqueues too. A job that is already running does
+  not absorb new requests, since it may have read its inputs before they
+  changed.
+- Claiming: workers take jobs with one ``find_one_and_update`` that flips
+  them to ``running``. While a job runs, its worker refreshes ``locked_at``
+  every third of ``JOB_LOCK_TIMEOUT``; a running job whose lock is older
+  than that (its worker died) is claimed again if it has attempts left,
+  and marked ``failed`` otherwise.
+- Retries: a failed attempt is rescheduled after ``JOB_RETRY_BACKOFF *
+  2 ** (attempts - 1)`` seconds, capped at ``MAX_BACKOFF``, until
+  ``max_attempts`` is reached and the job is marked ``failed``.
+
+``JobWorker`` runs jobs on a thread pool. With ``JOBS_AUTOSTART`` the
+process-wide ``worker`` starts on the first ``enqueue``, so API requests
+only pay for the insert; ``manage.py run_jobs`` runs a dedicated worker.
+"""
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from .models import Job
+
+logger = logging.getLogger('octofit_tracker.jobs')
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+MAX_BACKOFF = 300
+
+TASKS = {}
+
+
+def task(name, max_attempts=5):
+    """Register a function as a background task under ``name``"""
+    def register(function):
+        TASKS[name] = (function, max_attempts)
+        return function
+    return register
+
+
+def job_key(name, kwargs):
+    payload = json.dumps([name, kwargs], sort_keys=True, default=str)
+    return hashlib.md5(payload.encode()).hexdigest()
+
+
+def enqueue(name, **kwargs):
+    """Queue a task unless an identical one is already pending; return the job document"""
+    if name not in TASKS:
+        raise ValueError(f'Unknown task: {name}')
+    now = timezone.now()
+    key = job_key(name, kwargs)
+    document = {
+        'name': name,
+        'args': kwargs,
+        'key': key,
+        'status': PENDING,
+        'attempts': 0,
+        'max_attempts': TASKS[name][1],
+        'run_at': now,
+        'locked_by': None,
+        'locked_at': None,
+        'last_error': None,
+        'created_at': now,
+        'finished_at': None,
+    }
+    try:
+        job = _upsert_pending(key, document)
+    except DuplicateKeyError:
+        # A concurrent enqueue inserted the same job first; if it has
+        # already been claimed since, retry the upsert once to queue a new one
+        job = Job.objects.mongo_find_one({'key': key, 'status': PENDING}) or _upsert_pending(key, document)
+    if getattr(settings, 'JOBS_AUTOSTART', True):
+        worker.start()
+    worker.wake()
+    return job
+
+
+def _upsert_pending(key, document):
+    return Job.objects.mongo_find_one_and_update(
+        {'key': key, 'status': PENDING},
+        {'$setOnInsert': document},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def claim(worker_id):
+    """Atomically take the next runnable job, or return ``None``"""
+    now = timezone.now()
+    stale = now - timedelta(seconds=getattr(settings, 'JOB_LOCK_TIMEOUT', 600))
+    # Abandoned jobs without attempts left must not run again: their
+    # effects may already be applied (ingest deltas are not idempotent)
+    Job.objects.mongo_update_many(
+        {'status': RUNNING, 'locked_at': {'$lt': stale}, '$expr': {'$gte': ['$attempts', '$max_attempts']}},
+        {'$set': {
+            'status': FAILED,
+            'last_error': 'Lock expired: worker stopped while running the last attempt',
+            'locked_by': None,
+            'locked_at': None,
+            'finished_at': now,
+        }},
+    )
+    return Job.objects.mongo_find_one_and_update(
+        {'$or': [
+            {'status': PENDING, 'run_at': {'$lte': now}},
+            {
+                'status': RUNNING,
+                'locked_at': {'$lt': stale},
+                '$expr': {'$lt': ['$attempts', '$max_attempts']},
+            },
+        ]},
+        {
+            '$set': {'status': RUNNING, 'locked_by': worker_id, 'locked_at': now},
+            '$inc': {'attempts': 1},
+        },
+        sort=[('run_at', 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+class Heartbeat:
+    """Keeps a running job's lock fresh from a background thread"""
+
+    def __init__(self, job, interval=None):
+        self.job = job
+        self.interval = interval or getattr(settings, 'JOB_LOCK_TIMEOUT', 600) / 3
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self.run, name='octofit-job-heartbeat', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                Job.objects.mongo_update_one(
+                    {'_id': self.job['_id'], 'status': RUNNING, 'locked_by': self.job['locked_by']},
+                    {'$set': {'locked_at': timezone.now()}},
+                )
+            except Exception:
+                logger.exception('Could not refresh the lock of job %s', self.job['_id'])
+
+
+def run_job(job):
+    """Run one claimed job and record its outcome"""
+    function, _ = TASKS.get(job['name'], (None, 0))
+    try:
+        if function is None:
+            raise LookupError(f'Unknown task: {job["name"]}')
+        with Heartbeat(job):
+            function(**job['args'])
+    except Exception as exc:
+        logger.exception('Job %s (%s) failed on attempt %d', job['_id'], job['name'], job['attempts'])
+        update = {'last_error': f'{type(exc).__name__}: {exc}', 'locked_by': None, 'locked_at': None}
+        if job['attempts'] >= job['max_attempts']:
+            update.update(status=FAILED, finished_at=timezone.now())
+        else:
+            backoff = getattr(settings, 'JOB_RETRY_BACKOFF', 2) * 2 ** (job['attempts'] - 1)
+            update.update(status=PENDING, run_at=timezone.now() + timedelta(seconds=min(backoff, MAX_BACKOFF)))
+        Job.objects.mongo_update_one({'_id': job['_id']}, {'$set': update})
+    else:
+        Job.objects.mongo_update_one(
+            {'_id': job['_id']},
+            {'$set': {'status': DONE, 'finished_at': timezone.now(), 'locked_by': None, 'locked_at': None}},
+        )
+
+
+def run_pending(worker_id='inline', limit=None):
+    """Run runnable jobs in the calling thread until none are left; return how many ran"""
+    count = 0
+    while limit is None or count < limit:
+        job = claim(worker_id)
+        if job is None:
+            break
+        run_job(job)
+        count += 1
+    return count
+
+
+class JobWorker:
+    """Polls the queue and runs jobs on a thread pool"""
+
+    def __init__(self, threads=None, poll_interval=None):
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}:{id(self):x}'
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self.run, name='octofit-jobs', daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self):
+        """Claim jobs while threads are free; sleep until woken or the poll interval passes"""
+        threads = self.threads or getattr(settings, 'JOB_WORKERS', 2)
+        poll_interval = self.poll_interval or getattr(settings, 'JOB_POLL_INTERVAL', 5)
+        free = threading.Semaphore(threads)
+
+        def execute(job):
+            try:
+                run_job(job)
+            finally:
+                close_old_connections()
+                free.release()
+                self._wakeup.set()
+
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='octofit-job') as pool:
+            while not self._stopping.is_set():
+                self._wakeup.clear()
+                while free.acquire(blocking=False):
+                    try:
+                        job = claim(self.worker_id)
+                    except Exception:
+                        logger.exception('Could not claim a job')
+                        job = None
+                    if job is None:
+                        free.release()
+                        break
+                    pool.submit(execute, job)
+                self._wakeup.wait(poll_interval)
+            close_old_connections()
+
+
+worker = JobWorker()
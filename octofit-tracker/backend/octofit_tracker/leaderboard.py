@@ -0,0 +1,120 @@
+"""
+Incremental leaderboard maintenance.
+
+Activity writes are folded into the ``leaderboard`` collection as per-user
+deltas, so totals never have to be recomputed from ``activities``.
+
+Ranks use standard competition ranking on ``total_calories`` and only
+the slice of entries a user's total crossed is re-ranked (see
+competition.py).
+"""
+from collections import defaultdict
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.dispatch import receiver
+from django.utils import timezone
+from pymongo.errors import DuplicateKeyError
+
+from .cache import LEADERBOARD, invalidate
+from .competition import increment, rank_for, rerank_all, rerank_entry
+from .jobs import task
+from .models import User, Team, Leaderboard
+from .ranking import ranking
+from .signals import activities_changed
+
+
+def activity_deltas(added=(), removed=()):
+    """Fold added and removed activities into per-user (calories, count) deltas"""
+    deltas = defaultdict(lambda: [0, 0])
+    for activity in added:
+        delta = deltas[str(activity.user_id)]
+        delta[0] += activity.calories or 0
+        delta[1] += 1
+    for activity in removed:
+        delta = deltas[str(activity.user_id)]
+        delta[0] -= activity.calories or 0
+        delta[1] -= 1
+    return {
+        user_id: tuple(delta)
+        for user_id, delta in deltas.items()
+        if delta[0] or delta[1]
+    }
+
+
+def apply_activity_changes(added=(), removed=()):
+    """Apply the effect of added/removed activities to the leaderboard"""
+    deltas = activity_deltas(added, removed)
+    for user_id, (calories, count) in deltas.items():
+        apply_delta(user_id, calories, count)
+    if deltas:
+        invalidate(LEADERBOARD)
+
+
+def apply_delta(user_id, calories, count):
+    """
+    Add a calories/activities delta to one user's entry and re-rank the affected slice.
+
+    Callers are responsible for invalidating cached leaderboard responses.
+    """
+    entry = _increment(user_id, calories, count)
+    if entry is None:
+        _create_entry(user_id)
+        entry = _increment(user_id, calories, count)
+
+    old_total = entry.get('total_calories') or 0
+    new_total = old_total + calories
+    rerank_entry(Leaderboard, 'user_id', user_id, old_total, new_total)
+    ranking.observe(user_id, new_total)
+
+
+@task('leaderboard.rerank')
+def rerank():
+    """Recompute every rank from the stored totals (leaderboard collection only)"""
+    entries = rerank_all(Leaderboard)
+    ranking.reset()
+    invalidate(LEADERBOARD)
+    return entries
+
+
+def _increment(user_id, calories, count):
+    return increment(
+        Leaderboard, 'user_id', user_id,
+        {'total_calories': calories, 'total_activities': count},
+        {'total_calories': 1},
+    )
+
+
+def _create_entry(user_id):
+    """Insert a zero entry for a user unless a concurrent write already did"""
+    user = _get_by_object_id(User, user_id)
+    team = _get_by_object_id(Team, user.team_id) if user and user.team_id else None
+    try:
+        Leaderboard.objects.mongo_update_one(
+            {'user_id': user_id},
+            {'$setOnInsert': {
+                'user_name': user.name if user else '',
+                'team_id': user.team_id if user else None,
+                'team_name': team.name if team else None,
+                'total_calories': 0,
+                'total_activities': 0,
+                'rank': rank_for(Leaderboard, 0),
+                'updated_at': timezone.now(),
+            }},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        pass  # lost the upsert race; the winner's entry is the one to increment
+
+
+def _get_by_object_id(model, value):
+    try:
+        object_id = ObjectId(value)
+    except (InvalidId, TypeError):
+        return None
+    return model.objects.filter(_id=object_id).first()
+
+
+@receiver(activities_changed)
+def activities_changed_receiver(sender, added=(), removed=(), **kwargs):
+    apply_activity_changes(added, removed)
@@ -0,0 +1,288 @@
+"""
+Live leaderboard push channel.
+
+Dashboards subscribe once instead of polling ``/api/leaderboard/``:
+
+- ``GET /api/stream/leaderboard/`` is a server-sent events stream
+- ``/ws/leaderboard/`` is the same stream over a WebSocket
+
+Both accept ``?team_id=`` to only receive that team's entries. They are
+plain ASGI handlers mounted in front of Django by ``live_leaderboard`` in
+asgi.py, so each open connection is a parked coroutine, not a thread.
+
+One ``LeaderboardHub`` per process does the reading. Every
+``LIVE_LEADERBOARD_TICK`` seconds it compares the ``LEADERBOARD`` cache
+namespace version (bumped by every leaderboard write, see cache.py) with
+the one it last saw; only when it moved does it read the top
+``LIVE_LEADERBOARD_LIMIT`` entries, diff them against its snapshot and
+publish one ``delta`` frame. Bursts of writes inside a tick therefore
+coalesce into a single frame, and the database is read once per tick no
+matter how many clients are connected. The version is kept in Mongo, so
+writes made by the WSGI workers, the job worker or management commands
+are picked up the same way as this process's own.
+
+Every subscriber starts with a ``snapshot`` frame and has a bounded queue
+of ``LIVE_LEADERBOARD_QUEUE`` frames. A consumer that falls that far
+behind has its backlog dropped and gets a fresh ``snapshot`` instead, so a
+slow client costs a bounded amount of memory and never delays the others.
+"""
+import asyncio
+import json
+import logging
+from urllib.parse import parse_qs
+
+from django.conf import settings
+
+from .async_views import find
+from .cache import LEADERBOARD, namespace_version
+from .models import Leaderboard
+
+logger = logging.getLogger('octofit_tracker.live')
+
+STREAM_PATH = '/api/stream/leaderboard/'
+WEBSOCKET_PATH = '/ws/leaderboard/'
+
+ENTRY_FIELDS = (
+    'user_id', 'user_name', 'team_id', 'team_name', 'total_calories', 'total_activities', 'rank'
+)
+
+
+def diff_entries(previous, current):
+    """
+    Compare two ``{user_id: entry}`` snapshots.
+
+    Returns ``(changed, removed)``: ``changed`` pairs every new or modified
+    entry with its previous version (``None`` if new), ``removed`` lists
+    the entries that are gone.
+    """
+    changed = [
+        (entry, previous.get(user_id))
+        for user_id, entry in current.items()
+        if previous.get(user_id) != entry
+    ]
+    removed = [entry for user_id, entry in previous.items() if user_id not in current]
+    return changed, removed
+
+
+class Subscription:
+    """One client's bounded frame queue and team filter"""
+
+    def __init__(self, team_id=None, queue_size=16):
+        self.team_id = team_id
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+    def wants(self, entry):
+        return entry is not None and (self.team_id is None or entry.get('team_id') == self.team_id)
+
+    def snapshot(self, version, entries):
+        return {
+            'type': 'snapshot',
+            'version': version,
+            'entries': sorted(
+                (entry for entry in entries.values() if self.wants(entry)),
+                key=lambda entry: entry['rank'],
+            ),
+        }
+
+    def delta(self, version, changed, removed):
+        """This subscriber's view of a change set, or ``None`` if nothing concerns it"""
+        frame_changed = [entry for entry, _ in changed if self.wants(entry)]
+        frame_removed = [entry['user_id'] for entry in removed if self.wants(entry)]
+        # Entries that moved out of the filtered team
+        frame_removed += [
+            entry['user_id'] for entry, old in changed
+            if self.wants(old) and not self.wants(entry)
+        ]
+        if not frame_changed and not frame_removed:
+            return None
+        return {
+            'type': 'delta',
+            'version': version,
+            'changed': sorted(frame_changed, key=lambda entry: entry['rank']),
+            'removed': frame_removed,
+        }
+
+    def push(self, frame, resync):
+        """Queue a frame; on overflow replace the backlog with ``resync()``"""
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(resync())
+
+
+class LeaderboardHub:
+    """Per-process poller that fans leaderboard changes out to subscribers"""
+
+    def __init__(self, tick=None, queue_size=None, limit=None):
+        self.tick = tick or getattr(settings, 'LIVE_LEADERBOARD_TICK', 1.0)
+        self.queue_size = queue_size or getattr(settings, 'LIVE_LEADERBOARD_QUEUE', 16)
+        self.limit = limit or getattr(settings, 'LIVE_LEADERBOARD_LIMIT', 1000)
+        self.subscribers = set()
+        self.entries = None
+        self.version = None
+        self._task = None
+        self._lock = None
+
+    async def current_version(self):
+        return await asyncio.to_thread(namespace_version, LEADERBOARD)
+
+    def idle(self):
+        """Whether no poller is running or about to stop"""
+        return self._task is None or self._task.done() or self._task.cancelled()
+
+    async def load(self):
+        """Read the top entries as ``{user_id: entry}``"""
+        rows = await find(
+            Leaderboard, {}, {'_id': 0, **{field: 1 for field in ENTRY_FIELDS}},
+            [('rank', 1)], self.limit,
+        )
+        return {row['user_id']: {field: row.get(field) for field in ENTRY_FIELDS} for row in rows}
+
+    async def poll(self):
+        """Reload and publish if the leaderboard changed; return whether it did"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            version = await self.current_version()
+            if version == self.version and self.entries is not None:
+                return False
+            entries = await self.load()
+            previous, self.entries, self.version = self.entries, entries, version
+            if previous is None:
+                return True
+            changed, removed = diff_entries(previous, entries)
+            if changed or removed:
+                for subscription in list(self.subscribers):
+                    frame = subscription.delta(version, changed, removed)
+                    if frame is not None:
+                        subscription.push(frame, lambda: subscription.snapshot(self.version, self.entries))
+            return True
+
+    async def subscribe(self, team_id=None):
+        """Register a subscriber, queue its initial snapshot and make sure the poller runs"""
+        if self.idle():
+            # Nobody kept the snapshot current while no one was subscribed
+            await self.poll()
+        subscription = Subscription(team_id, self.queue_size)
+        subscription.queue.put_nowait(subscription.snapshot(self.version, self.entries))
+        self.subscribers.add(subscription)
+        if self.idle():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscribers.discard(subscription)
+        if not self.subscribers and self._task is not None:
+            # A cancelled task is not done until the loop runs it again;
+            # forget it now so an immediate resubscribe starts a new one
+            self._task.cancel()
+            self._task = None
+
+    async def run(self):
+        """Poll once per tick while anyone is subscribed"""
+        while self.subscribers:
+            await asyncio.sleep(self.tick)
+            try:
+                await self.poll()
+            except Exception:
+                # Keep serving the last snapshot; the next tick retries
+                logger.exception('Live leaderboard poll failed')
+
+
+hub = LeaderboardHub()
+
+
+def encode(frame):
+    return json.dumps(frame, separators=(',', ':'))
+
+
+def live_leaderboard(application, hub=hub):
+    """Wrap an ASGI application, serving the live leaderboard paths in front of it"""
+    async def app(scope, receive, send):
+        path = scope.get('path')
+        if scope['type'] == 'http' and path == STREAM_PATH:
+            return await serve_events(scope, receive, send, hub)
+        if scope['type'] == 'websocket':
+            if path == WEBSOCKET_PATH:
+                return await serve_websocket(scope, receive, send, hub)
+            await receive()
+            return await send({'type': 'websocket.close', 'code': 4404})
+        return await application(scope, receive, send)
+    return app
+
+
+def _team_filter(scope):
+    values = parse_qs(scope.get('query_string', b'').decode()).get('team_id')
+    return values[0] if values else None
+
+
+async def _until_disconnect(receive, disconnect_type):
+    while (await receive())['type'] != disconnect_type:
+        pass
+
+
+async def _pump(subscription, send_frame, heartbeat):
+    """Send queued frames; call ``send_frame(None)`` after ``heartbeat`` idle seconds"""
+    while True:
+        try:
+            frame = await asyncio.wait_for(subscription.queue.get(), heartbeat)
+        except asyncio.TimeoutError:
+            frame = None
+        await send_frame(frame)
+
+
+async def _stream(subscription, receive, disconnect_type, send_frame, hub):
+    heartbeat = getattr(settings, 'LIVE_LEADERBOARD_HEARTBEAT', 15)
+    pump = asyncio.ensure_future(_pump(subscription, send_frame, heartbeat))
+    disconnect = asyncio.ensure_future(_until_disconnect(receive, disconnect_type))
+    try:
+        await asyncio.wait({pump, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        hub.unsubscribe(subscription)
+        for task in (pump, disconnect):
+            task.cancel()
+        if pump.done() and not pump.cancelled() and pump.exception() is not None:
+            raise pump.exception()
+
+
+async def serve_events(scope, receive, send, hub):
+    """Server-sent events: one ``event:``/``data:`` block per frame"""
+    if scope['method'] != 'GET':
+        await send({'type': 'http.response.start', 'status': 405, 'headers': [(b'allow', b'GET')]})
+        return await send({'type': 'http.response.body', 'body': b''})
+
+    subscription = await hub.subscribe(_team_filter(scope))
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ],
+    })
+
+    async def send_frame(frame):
+        if frame is None:
+            body = b': keepalive\n\n'
+        else:
+            body = f'event: {frame["type"]}\nid: {frame["version"]}\ndata: {encode(frame)}\n\n'.encode()
+        await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+
+    await _stream(subscription, receive, 'http.disconnect', send_frame, hub)
+
+
+async def serve_websocket(scope, receive, send, hub):
+    """WebSocket: one JSON text message per frame"""
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    subscription = await hub.subscribe(_team_filter(scope))
+    await send({'type': 'websocket.accept'})
+
+    async def send_frame(frame):
+        if frame is not None:
+            await send({'type': 'websocket.send', 'text': encode(frame)})
+
+    await _stream(subscription, receive, 'websocket.disconnect', send_frame, hub)
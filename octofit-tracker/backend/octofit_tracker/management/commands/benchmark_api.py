@@ -0,0 +1,109 @@
+import contextlib
+import json
+from io import StringIO
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from octofit_tracker.benchmark import ENDPOINTS, compare, ephemeral_mongod, run_endpoint
+from octofit_tracker.models import Leaderboard
+from octofit_tracker.ranking import ranking
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed datasets of increasing size into a throwaway database, benchmark the API '
+        'endpoints and fail if they regressed against the stored baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000,10000',
+                            help='Comma-separated user counts to benchmark')
+        parser.add_argument('--activities-per-user', type=int, default=20)
+        parser.add_argument('--teams', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--iterations', type=int, default=30, help='Timed requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=5, help='Untimed requests per endpoint')
+        parser.add_argument('--warm-cache', action='store_true',
+                            help='Keep response caches between requests instead of measuring cold reads')
+        parser.add_argument('--mongod', metavar='BINARY',
+                            help='Start an ephemeral mongod from this binary instead of using the configured server')
+        parser.add_argument('--baseline', default=str(Path(settings.BASE_DIR) / 'benchmarks' / 'baseline.json'),
+                            help='Baseline JSON file, keyed by "<size>/<endpoint>"')
+        parser.add_argument('--save-baseline', action='store_true',
+                            help='Store this run as the new baseline instead of comparing against it')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='Allowed latency/memory growth over the baseline, as a fraction')
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'QUERY_PROFILING', True):
+            raise CommandError('QUERY_PROFILING must be enabled to count DB round trips')
+        sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+
+        with contextlib.ExitStack() as stack:
+            if options['mongod']:
+                host, port = stack.enter_context(ephemeral_mongod(options['mongod']))
+                connection.close()
+                connection.settings_dict['CLIENT'] = {
+                    **connection.settings_dict.get('CLIENT', {}), 'host': host, 'port': port,
+                }
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            stack.callback(connection.creation.destroy_test_db, old_name, verbosity=0)
+            results = {}
+            for size in sizes:
+                results.update(self.benchmark_size(size, options))
+
+        baseline_path = Path(options['baseline'])
+        if options['save_baseline']:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps(results, indent=2, sort_keys=True) + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Baseline written to {baseline_path}'))
+            return
+        if not baseline_path.exists():
+            self.stdout.write(self.style.WARNING(f'No baseline at {baseline_path}; run with --save-baseline'))
+            return
+
+        regressions = compare(results, json.loads(baseline_path.read_text()), options['threshold'])
+        if regressions:
+            for regression in regressions:
+                self.stdout.write(self.style.ERROR(regression))
+            raise CommandError(f'{len(regressions)} benchmark regression(s) against {baseline_path}')
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
+
+    def benchmark_size(self, size, options):
+        self.stdout.write(f'Seeding {size} users...')
+        call_command(
+            'populate_db',
+            users=size,
+            teams=options['teams'],
+            activities_per_user=options['activities_per_user'],
+            seed=options['seed'],
+            stdout=StringIO(),
+        )
+        # Drop state left over from the previous dataset
+        cache.clear()
+        ranking.reset()
+        leader = Leaderboard.objects.order_by('rank').values('user_id', 'team_id').first()
+        params = {'user_id': leader['user_id'], 'team_id': leader['team_id']}
+
+        client = Client(HTTP_HOST='localhost')
+        self.stdout.write(
+            f'{"size":>7} {"endpoint":<24} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} '
+            f'{"trips":>6} {"peak KiB":>9}'
+        )
+        results = {}
+        for name, path in ENDPOINTS:
+            metrics = run_endpoint(
+                client, path.format(**params), options['iterations'],
+                warmup=options['warmup'], cold_cache=not options['warm_cache'],
+            )
+            results[f'{size}/{name}'] = metrics
+            self.stdout.write(
+                f'{size:>7} {name:<24} {metrics["p50_ms"]:>8.2f} {metrics["p95_ms"]:>8.2f} '
+                f'{metrics["p99_ms"]:>8.2f} {metrics["round_trips"]!s:>6} {metrics["peak_kib"]:>9.1f}'
+            )
+        return results
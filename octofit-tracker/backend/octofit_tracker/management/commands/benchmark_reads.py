@@ -0,0 +1,87 @@
+import statistics
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import URLError
+
+from django.core.management.base import BaseCommand, CommandError
+from octofit_tracker.models import Leaderboard
+
+# (name, path on the WSGI deployment, path on the ASGI deployment)
+ENDPOINTS = [
+    ('leaderboard', '/api/leaderboard/?page_size={limit}', '/api/async/leaderboard/?limit={limit}'),
+    (
+        'activities by user',
+        '/api/activities/by_user/?user_id={user_id}&page_size={limit}',
+        '/api/async/activities/by_user/?user_id={user_id}&limit={limit}',
+    ),
+    ('workouts', '/api/workouts/?page_size={limit}', '/api/async/workouts/?limit={limit}'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare throughput of the hot read endpoints on a WSGI deployment '
+        '(sync DRF views) and an ASGI deployment (async views)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wsgi-url', default='http://localhost:8000',
+                            help='Base URL of the server started from wsgi.py')
+        parser.add_argument('--asgi-url', default='http://localhost:8001',
+                            help='Base URL of the server started from asgi.py')
+        parser.add_argument('--requests', type=int, default=2000,
+                            help='Requests per endpoint and server')
+        parser.add_argument('--concurrency', type=int, default=50,
+                            help='Requests kept in flight')
+        parser.add_argument('--limit', type=int, default=50,
+                            help='Rows per response')
+        parser.add_argument('--user-id', help='User for the activities endpoint (default: rank 1)')
+
+    def handle(self, *args, **options):
+        user_id = options['user_id']
+        if not user_id:
+            leader = Leaderboard.objects.order_by('rank').values_list('user_id', flat=True).first()
+            if leader is None:
+                raise CommandError('The leaderboard is empty; run populate_db or pass --user-id')
+            user_id = leader
+        params = {'user_id': user_id, 'limit': options['limit']}
+
+        self.stdout.write(f'{"endpoint":<20} {"server":<6} {"req/s":>9} {"p50 ms":>8} {"p99 ms":>8} {"errors":>7}')
+        for name, wsgi_path, asgi_path in ENDPOINTS:
+            results = {}
+            for server, base_url, path in (('wsgi', options['wsgi_url'], wsgi_path),
+                                           ('asgi', options['asgi_url'], asgi_path)):
+                url = base_url.rstrip('/') + path.format(**params)
+                results[server] = self.run(url, options['requests'], options['concurrency'])
+                throughput, p50, p99, errors = results[server]
+                self.stdout.write(
+                    f'{name:<20} {server:<6} {throughput:>9.1f} {p50:>8.1f} {p99:>8.1f} {errors:>7}'
+                )
+            if results['wsgi'][0]:
+                speedup = results['asgi'][0] / results['wsgi'][0]
+                self.stdout.write(self.style.SUCCESS(f'{name}: asgi/wsgi throughput x{speedup:.2f}'))
+
+    def run(self, url, requests, concurrency):
+        """Fire ``requests`` GETs at ``url``; return (req/s, p50 ms, p99 ms, errors)"""
+        def fetch(_):
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(url, timeout=30) as response:
+                    response.read()
+                    ok = response.status == 200
+            except (URLError, OSError):
+                ok = False
+            return time.perf_counter() - started, ok
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = list(pool.map(fetch, range(requests)))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency * 1000 for latency, ok in samples if ok)
+        errors = len(samples) - len(latencies)
+        if not latencies:
+            return 0.0, 0.0, 0.0, errors
+        percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        return len(latencies) / elapsed, percentiles[49], percentiles[98], errors
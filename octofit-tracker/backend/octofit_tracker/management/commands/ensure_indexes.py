@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from octofit_tracker.indexes import (
+    INDEXED_MODELS,
+    declared_indexes,
+    ensure_indexes,
+    missing_indexes,
+    unindexed_shapes,
+)
+
+
+class Command(BaseCommand):
+    help = 'Create, verify and report the Mongo indexes declared on the models'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only verify indexes and query plans; fail if anything is missing',
+        )
+
+    def handle(self, *args, **options):
+        check_only = options['check']
+        problems = []
+
+        for model in INDEXED_MODELS:
+            collection = model._meta.db_table
+            declared = declared_indexes(model)
+            if check_only:
+                missing = sorted(missing_indexes(model))
+            else:
+                created = ensure_indexes(model)
+                for name in created:
+                    self.stdout.write(self.style.SUCCESS(f'{collection}: created {name}'))
+                missing = sorted(missing_indexes(model))
+
+            for name in declared:
+                state = 'MISSING' if name in missing else 'ok'
+                self.stdout.write(f'{collection}.{name}: {state}')
+            problems.extend(f'{collection}.{name}' for name in missing)
+
+        self.stdout.write('Checking query plans...')
+        for description, stages in unindexed_shapes():
+            self.stdout.write(self.style.WARNING(f'{description}: {" <- ".join(stages)}'))
+            problems.append(description)
+
+        if problems:
+            raise CommandError(f'Unindexed: {", ".join(problems)}')
+        self.stdout.write(self.style.SUCCESS('All declared indexes present and every query shape is indexed'))
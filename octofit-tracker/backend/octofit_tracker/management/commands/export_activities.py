@@ -0,0 +1,93 @@
+import os
+import re
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from octofit_tracker.export import BATCH_SIZE, FORMATS, export_chunks, export_filter
+from octofit_tracker.views import parse_since
+
+ROW_START = re.compile(rb'^([0-9a-f]{24}),', re.MULTILINE)
+TAIL_BYTES = 64 * 1024
+
+
+class Command(BaseCommand):
+    help = 'Stream activities to a CSV, Arrow or Parquet file for analytics'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to write, or - for standard output')
+        parser.add_argument('--format', choices=FORMATS, default='csv', dest='output',
+                            help='Output format (arrow and parquet need pyarrow)')
+        parser.add_argument('--user-id', help='Only export this user\'s activities')
+        parser.add_argument('--activity-type', help='Only export activities of this type')
+        parser.add_argument('--start', help='Only export activities on or after this ISO date or datetime')
+        parser.add_argument('--end', help='Only export activities before this ISO date or datetime')
+        parser.add_argument('--after', help='Only export activities with an _id greater than this one')
+        parser.add_argument('--resume', action='store_true',
+                            help='Append to an existing CSV file after the last _id it contains')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Activities read and encoded per batch')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        output = options['output']
+        filters = {
+            'user_id': options['user_id'],
+            'activity_type': options['activity_type'],
+            'after': options['after'],
+        }
+        for name in ('start', 'end'):
+            if options[name]:
+                filters[name] = parse_since(options[name])
+                if filters[name] is None:
+                    raise CommandError(f'--{name} must be an ISO 8601 date or datetime')
+
+        header = True
+        if options['resume']:
+            if output != 'csv' or path == '-':
+                raise CommandError('--resume only works when writing CSV to a file')
+            last_id = resume_point(path)
+            if last_id is not None:
+                filters['after'] = last_id
+                header = False
+
+        try:
+            query = export_filter(**filters)
+            chunks = export_chunks(query, output, options['batch_size'], header=header)
+        except ValueError as exc:
+            raise CommandError(exc)
+
+        stream = sys.stdout.buffer if path == '-' else open(path, 'wb' if header else 'ab')
+        written = 0
+        try:
+            for chunk in chunks:
+                stream.write(chunk)
+                written += len(chunk)
+        finally:
+            if path != '-':
+                stream.close()
+        if path != '-':
+            self.stderr.write(self.style.SUCCESS(f'Wrote {written} bytes to {path}'))
+
+
+def resume_point(path):
+    """
+    ``_id`` of the last complete row of a CSV export, or ``None`` if it has none.
+
+    A row cut off by an interrupted export is truncated away so appending
+    continues on a clean line.
+    """
+    if not os.path.exists(path):
+        return None
+    size = os.path.getsize(path)
+    offset = max(size - TAIL_BYTES, 0)
+    with open(path, 'rb+') as file:
+        file.seek(offset)
+        tail = file.read()
+        # Rows start with their ObjectId; notes may span lines, so match row starts
+        starts = list(ROW_START.finditer(tail))
+        if tail.endswith(b'\n') or not starts:
+            last = starts[-1] if starts else None
+        else:
+            file.truncate(offset + starts[-1].start())
+            last = starts[-2] if len(starts) > 1 else None
+    return last.group(1).decode() if last else None
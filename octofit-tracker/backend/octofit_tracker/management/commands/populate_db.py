@@ -1,23 +1,168 @@
-from django.core.management.base import BaseCommand
-from django.utils import timezone
+import multiprocessing
+import random
+import time
 from datetime import timedelta
-from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
+
+from bson import ObjectId
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from octofit_tracker.cache import CATALOG, LEADERBOARD, invalidate
+from octofit_tracker.models import (
+    User, Team, Activity, Leaderboard, TeamLeaderboard, Workout, ActivityRollup, ActivityProfile
+)
+from octofit_tracker.leaderboard import rerank
+from octofit_tracker.recommendations import rebuild_activity_profiles
+from octofit_tracker.rollups import rebuild_rollups
+from octofit_tracker.seeding import ACTIVITY_TYPES, insert_activities, seed_activity_shard
+from octofit_tracker.team_leaderboard import rebuild_team_leaderboard
+from octofit_tracker.teams import recount_members
+
+WORKOUTS = [
+    {
+        'name': 'Super Soldier Training',
+        'description': 'Captain America inspired full body workout',
+        'difficulty': 'Advanced',
+        'duration': 60,
+        'category': 'Strength',
+        'exercises': [
+            {'name': 'Push-ups', 'sets': 5, 'reps': 20},
+            {'name': 'Pull-ups', 'sets': 4, 'reps': 15},
+            {'name': 'Squats', 'sets': 4, 'reps': 20},
+            {'name': 'Planks', 'sets': 3, 'duration': '60s'}
+        ]
+    },
+    {
+        'name': 'Asgardian Power Routine',
+        'description': 'Thor\'s legendary strength training',
+        'difficulty': 'Advanced',
+        'duration': 75,
+        'category': 'Power',
+        'exercises': [
+            {'name': 'Deadlifts', 'sets': 5, 'reps': 8},
+            {'name': 'Hammer Curls', 'sets': 4, 'reps': 12},
+            {'name': 'Battle Ropes', 'sets': 3, 'duration': '45s'},
+            {'name': 'Box Jumps', 'sets': 4, 'reps': 15}
+        ]
+    },
+    {
+        'name': 'Speed Force Training',
+        'description': 'Flash inspired cardio and agility workout',
+        'difficulty': 'Intermediate',
+        'duration': 45,
+        'category': 'Cardio',
+        'exercises': [
+            {'name': 'Sprint Intervals', 'sets': 8, 'duration': '30s'},
+            {'name': 'Burpees', 'sets': 4, 'reps': 15},
+            {'name': 'Jump Rope', 'sets': 3, 'duration': '2min'},
+            {'name': 'Mountain Climbers', 'sets': 3, 'reps': 30}
+        ]
+    },
+    {
+        'name': 'Amazonian Warrior Workout',
+        'description': 'Wonder Woman\'s combat training routine',
+        'difficulty': 'Advanced',
+        'duration': 60,
+        'category': 'Combat',
+        'exercises': [
+            {'name': 'Sword Swings', 'sets': 4, 'reps': 20},
+            {'name': 'Shield Push-ups', 'sets': 4, 'reps': 15},
+            {'name': 'Lasso Spins', 'sets': 3, 'duration': '45s'},
+            {'name': 'High Kicks', 'sets': 4, 'reps': 20}
+        ]
+    },
+    {
+        'name': 'Dark Knight Conditioning',
+        'description': 'Batman\'s stealth and strength program',
+        'difficulty': 'Advanced',
+        'duration': 90,
+        'category': 'Mixed',
+        'exercises': [
+            {'name': 'Ninja Rolls', 'sets': 3, 'reps': 10},
+            {'name': 'Rope Climbing', 'sets': 4, 'reps': 5},
+            {'name': 'Batarang Throws', 'sets': 3, 'reps': 30},
+            {'name': 'Shadow Boxing', 'sets': 5, 'duration': '3min'}
+        ]
+    },
+    {
+        'name': 'Atlantean Swim Training',
+        'description': 'Aquaman\'s underwater fitness routine',
+        'difficulty': 'Intermediate',
+        'duration': 50,
+        'category': 'Swimming',
+        'exercises': [
+            {'name': 'Freestyle Laps', 'sets': 8, 'reps': 4},
+            {'name': 'Underwater Sprints', 'sets': 5, 'reps': 50},
+            {'name': 'Treading Water', 'sets': 3, 'duration': '5min'},
+            {'name': 'Dolphin Kicks', 'sets': 4, 'reps': 25}
+        ]
+    },
+    {
+        'name': 'Arc Reactor Endurance',
+        'description': 'Iron Man\'s high-tech cardio routine',
+        'difficulty': 'Intermediate',
+        'duration': 40,
+        'category': 'Endurance',
+        'exercises': [
+            {'name': 'Treadmill Intervals', 'sets': 6, 'duration': '5min'},
+            {'name': 'Cycling', 'sets': 1, 'duration': '20min'},
+            {'name': 'Rowing', 'sets': 3, 'duration': '5min'}
+        ]
+    },
+    {
+        'name': 'Hulk Smash Circuit',
+        'description': 'Bruce Banner\'s anger management through exercise',
+        'difficulty': 'Beginner',
+        'duration': 30,
+        'category': 'Circuit',
+        'exercises': [
+            {'name': 'Medicine Ball Slams', 'sets': 4, 'reps': 15},
+            {'name': 'Tire Flips', 'sets': 3, 'reps': 10},
+            {'name': 'Punching Bag', 'sets': 5, 'duration': '2min'},
+            {'name': 'Jump Squats', 'sets': 3, 'reps': 15}
+        ]
+    }
+]
 
 
 class Command(BaseCommand):
     help = 'Populate the octofit_db database with test data'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            help='Generate a synthetic dataset with this many users instead of the superhero data',
+        )
+        parser.add_argument('--teams', type=int, default=10, help='Number of synthetic teams')
+        parser.add_argument('--activities-per-user', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for reproducible datasets')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Worker processes used to generate and insert activities',
+        )
+        parser.add_argument('--batch-size', type=int, default=5000, help='Documents per insert_many')
+
     def handle(self, *args, **options):
+        if options['users']:
+            self.handle_scaled(options)
+        else:
+            self.handle_superheroes()
+
+    def clear_data(self):
         self.stdout.write('Clearing existing data...')
         
-        # Delete existing data using Django ORM
-        User.objects.all().delete()
-        Team.objects.all().delete()
-        Activity.objects.all().delete()
-        Leaderboard.objects.all().delete()
-        Workout.objects.all().delete()
+        # delete_many avoids loading every document through the ORM
+        for model in (User, Team, Activity, Leaderboard, TeamLeaderboard, Workout, ActivityRollup, ActivityProfile):
+            model.objects.mongo_delete_many({})
+        invalidate(CATALOG)
         
         self.stdout.write(self.style.SUCCESS('Existing data cleared!'))
+
+    def handle_superheroes(self):
+        self.clear_data()
         
         # Create Teams
         self.stdout.write('Creating teams...')
@@ -90,23 +235,21 @@ class Command(BaseCommand):
         marvel_users = [iron_man, captain_america, black_widow, hulk, thor]
         dc_users = [batman, superman, wonder_woman, flash, aquaman]
         all_users = marvel_users + dc_users
+        recount_members()
         
         self.stdout.write(self.style.SUCCESS(f'Created {len(all_users)} superhero users!'))
         
         # Create Activities
         self.stdout.write('Creating activities...')
-        activity_types = [
-            'Running', 'Cycling', 'Swimming', 'Weight Training', 
-            'Boxing', 'Yoga', 'CrossFit', 'HIIT'
-        ]
         
         activities_created = 0
+        totals = {}
         for user in all_users:
             # Create 5-8 activities per user
-            import random
             num_activities = random.randint(5, 8)
+            total_calories = 0
             for i in range(num_activities):
-                activity_type = random.choice(activity_types)
+                activity_type = random.choice(ACTIVITY_TYPES)
                 duration = random.randint(30, 120)
                 calories = duration * random.randint(8, 12)
                 distance = round(random.uniform(3, 15), 2) if activity_type in ['Running', 'Cycling', 'Swimming'] else None
@@ -121,16 +264,16 @@ class Command(BaseCommand):
                     notes=f'{user.name} completed {activity_type}'
                 )
                 activities_created += 1
+                total_calories += calories
+            totals[str(user._id)] = (total_calories, num_activities)
         
         self.stdout.write(self.style.SUCCESS(f'Created {activities_created} activities!'))
         
         # Create Leaderboard entries
         self.stdout.write('Creating leaderboard entries...')
-        for rank, user in enumerate(all_users, start=1):
-            # Calculate total calories and activities
-            user_activities = Activity.objects.filter(user_id=str(user._id))
-            total_calories = sum(a.calories for a in user_activities)
-            total_activities = user_activities.count()
+        for user in all_users:
+            # Totals were accumulated while creating the activities
+            total_calories, total_activities = totals[str(user._id)]
             
             team_name = team_marvel.name if user.team_id == str(team_marvel._id) else team_dc.name
             
@@ -140,130 +283,153 @@ class Command(BaseCommand):
                 team_id=user.team_id,
                 team_name=team_name,
                 total_calories=total_calories,
-                total_activities=total_activities,
-                rank=rank
+                total_activities=total_activities
             )
         
+        # Rank by total calories so incremental updates start from a consistent board
+        rerank()
+        rebuild_team_leaderboard()
+        
         self.stdout.write(self.style.SUCCESS(f'Created {len(all_users)} leaderboard entries!'))
         
         # Create Workouts
         self.stdout.write('Creating workout suggestions...')
-        workouts = [
-            {
-                'name': 'Super Soldier Training',
-                'description': 'Captain America inspired full body workout',
-                'difficulty': 'Advanced',
-                'duration': 60,
-                'category': 'Strength',
-                'exercises': [
-                    {'name': 'Push-ups', 'sets': 5, 'reps': 20},
-                    {'name': 'Pull-ups', 'sets': 4, 'reps': 15},
-                    {'name': 'Squats', 'sets': 4, 'reps': 20},
-                    {'name': 'Planks', 'sets': 3, 'duration': '60s'}
-                ]
-            },
-            {
-                'name': 'Asgardian Power Routine',
-                'description': 'Thor\'s legendary strength training',
-                'difficulty': 'Advanced',
-                'duration': 75,
-                'category': 'Power',
-                'exercises': [
-                    {'name': 'Deadlifts', 'sets': 5, 'reps': 8},
-                    {'name': 'Hammer Curls', 'sets': 4, 'reps': 12},
-                    {'name': 'Battle Ropes', 'sets': 3, 'duration': '45s'},
-                    {'name': 'Box Jumps', 'sets': 4, 'reps': 15}
-                ]
-            },
-            {
-                'name': 'Speed Force Training',
-                'description': 'Flash inspired cardio and agility workout',
-                'difficulty': 'Intermediate',
-                'duration': 45,
-                'category': 'Cardio',
-                'exercises': [
-                    {'name': 'Sprint Intervals', 'sets': 8, 'duration': '30s'},
-                    {'name': 'Burpees', 'sets': 4, 'reps': 15},
-                    {'name': 'Jump Rope', 'sets': 3, 'duration': '2min'},
-                    {'name': 'Mountain Climbers', 'sets': 3, 'reps': 30}
-                ]
-            },
-            {
-                'name': 'Amazonian Warrior Workout',
-                'description': 'Wonder Woman\'s combat training routine',
-                'difficulty': 'Advanced',
-                'duration': 60,
-                'category': 'Combat',
-                'exercises': [
-                    {'name': 'Sword Swings', 'sets': 4, 'reps': 20},
-                    {'name': 'Shield Push-ups', 'sets': 4, 'reps': 15},
-                    {'name': 'Lasso Spins', 'sets': 3, 'duration': '45s'},
-                    {'name': 'High Kicks', 'sets': 4, 'reps': 20}
-                ]
-            },
-            {
-                'name': 'Dark Knight Conditioning',
-                'description': 'Batman\'s stealth and strength program',
-                'difficulty': 'Advanced',
-                'duration': 90,
-                'category': 'Mixed',
-                'exercises': [
-                    {'name': 'Ninja Rolls', 'sets': 3, 'reps': 10},
-                    {'name': 'Rope Climbing', 'sets': 4, 'reps': 5},
-                    {'name': 'Batarang Throws', 'sets': 3, 'reps': 30},
-                    {'name': 'Shadow Boxing', 'sets': 5, 'duration': '3min'}
-                ]
-            },
-            {
-                'name': 'Atlantean Swim Training',
-                'description': 'Aquaman\'s underwater fitness routine',
-                'difficulty': 'Intermediate',
-                'duration': 50,
-                'category': 'Swimming',
-                'exercises': [
-                    {'name': 'Freestyle Laps', 'sets': 8, 'reps': 4},
-                    {'name': 'Underwater Sprints', 'sets': 5, 'reps': 50},
-                    {'name': 'Treading Water', 'sets': 3, 'duration': '5min'},
-                    {'name': 'Dolphin Kicks', 'sets': 4, 'reps': 25}
-                ]
-            },
-            {
-                'name': 'Arc Reactor Endurance',
-                'description': 'Iron Man\'s high-tech cardio routine',
-                'difficulty': 'Intermediate',
-                'duration': 40,
-                'category': 'Endurance',
-                'exercises': [
-                    {'name': 'Treadmill Intervals', 'sets': 6, 'duration': '5min'},
-                    {'name': 'Cycling', 'sets': 1, 'duration': '20min'},
-                    {'name': 'Rowing', 'sets': 3, 'duration': '5min'}
-                ]
-            },
-            {
-                'name': 'Hulk Smash Circuit',
-                'description': 'Bruce Banner\'s anger management through exercise',
-                'difficulty': 'Beginner',
-                'duration': 30,
-                'category': 'Circuit',
-                'exercises': [
-                    {'name': 'Medicine Ball Slams', 'sets': 4, 'reps': 15},
-                    {'name': 'Tire Flips', 'sets': 3, 'reps': 10},
-                    {'name': 'Punching Bag', 'sets': 5, 'duration': '2min'},
-                    {'name': 'Jump Squats', 'sets': 3, 'reps': 15}
-                ]
-            }
-        ]
         
-        for workout_data in workouts:
+        for workout_data in WORKOUTS:
             Workout.objects.create(**workout_data)
         
-        self.stdout.write(self.style.SUCCESS(f'Created {len(workouts)} workout programs!'))
+        self.stdout.write(self.style.SUCCESS(f'Created {len(WORKOUTS)} workout programs!'))
         
-        # Summary
+        self.stdout.write('Building activity rollups...')
+        rebuild_rollups()
+
+        self.stdout.write('Building activity profiles...')
+        rebuild_activity_profiles()
+        
+        self.write_summary()
+
+    def handle_scaled(self, options):
+        num_users = options['users']
+        num_teams = max(1, min(options['teams'], num_users))
+        per_user = options['activities_per_user']
+        workers = options['workers']
+        batch_size = options['batch_size']
+        seed = options['seed']
+        if per_user < 0 or workers < 1 or batch_size < 1:
+            raise CommandError('--activities-per-user, --workers and --batch-size must be positive')
+
+        started = time.monotonic()
+        self.clear_data()
+        now = timezone.now()
+
+        # Create Teams, with member counts known up front from the round-robin assignment
+        self.stdout.write(f'Creating {num_teams} teams...')
+        teams = [
+            {
+                '_id': ObjectId(),
+                'name': f'Team {index + 1}',
+                'description': f'Synthetic team {index + 1}',
+                'member_count': num_users // num_teams + (1 if index < num_users % num_teams else 0),
+                'created_at': now,
+            }
+            for index in range(num_teams)
+        ]
+        Team.objects.mongo_insert_many(teams)
+
+        # Create Users
+        self.stdout.write(f'Creating {num_users} users...')
+        users = []
+        batch = []
+        for index in range(num_users):
+            team = teams[index % num_teams]
+            user = {
+                '_id': ObjectId(),
+                'name': f'User {index + 1}',
+                'email': f'user{index + 1}@octofit.test',
+                'team_id': str(team['_id']),
+                'created_at': now,
+            }
+            users.append((index, str(user['_id']), user['name'], team))
+            batch.append(user)
+            if len(batch) >= batch_size:
+                User.objects.mongo_insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            User.objects.mongo_insert_many(batch, ordered=False)
+
+        # Create Activities, fanned out over worker processes by user shard
+        self.stdout.write(f'Creating {num_users * per_user} activities with {workers} worker(s)...')
+        shards = [
+            [(index, user_id, name) for index, user_id, name, _ in users[start::workers]]
+            for start in range(workers)
+        ]
+        totals = {}
+        if workers == 1:
+            totals.update(insert_activities(
+                Activity.objects.mongo_insert_many, shards[0], per_user, seed, now, batch_size
+            ))
+        else:
+            client_kwargs = dict(connection.settings_dict['CLIENT'])
+            db_name = connection.settings_dict['NAME']
+            tasks = [
+                (client_kwargs, db_name, shard, per_user, seed, now, batch_size)
+                for shard in shards
+            ]
+            # spawn: workers must not inherit the parent's MongoClient sockets
+            with multiprocessing.get_context('spawn').Pool(workers) as pool:
+                for shard_totals in pool.imap_unordered(seed_activity_shard, tasks):
+                    totals.update(shard_totals)
+
+        # Create Leaderboard entries from the in-memory totals, ranked in the same pass
+        self.stdout.write('Creating leaderboard entries...')
+        ordered = sorted(users, key=lambda user: totals[user[1]][0], reverse=True)
+        batch = []
+        rank = 0
+        previous_total = None
+        for position, (_, user_id, name, team) in enumerate(ordered, start=1):
+            total_calories, total_activities = totals[user_id]
+            if total_calories != previous_total:
+                rank = position
+                previous_total = total_calories
+            batch.append({
+                'user_id': user_id,
+                'user_name': name,
+                'team_id': str(team['_id']),
+                'team_name': team['name'],
+                'total_calories': total_calories,
+                'total_activities': total_activities,
+                'rank': rank,
+                'updated_at': now,
+            })
+            if len(batch) >= batch_size:
+                Leaderboard.objects.mongo_insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            Leaderboard.objects.mongo_insert_many(batch, ordered=False)
+        invalidate(LEADERBOARD)
+
+        self.stdout.write('Creating team standings...')
+        rebuild_team_leaderboard()
+
+        self.stdout.write('Creating workout suggestions...')
+        Workout.objects.mongo_insert_many([dict(workout) for workout in WORKOUTS])
+        invalidate(CATALOG)
+
+        self.stdout.write('Building activity rollups...')
+        rebuild_rollups(batch_size=batch_size)
+
+        self.stdout.write('Building activity profiles...')
+        rebuild_activity_profiles(batch_size=batch_size)
+
+        self.write_summary()
+        self.stdout.write(f'Seeded in {time.monotonic() - started:.1f}s')
+
+    def write_summary(self):
         self.stdout.write(self.style.SUCCESS('\n=== Database Population Complete ==='))
-        self.stdout.write(f'Teams: {Team.objects.count()}')
-        self.stdout.write(f'Users: {User.objects.count()}')
-        self.stdout.write(f'Activities: {Activity.objects.count()}')
-        self.stdout.write(f'Leaderboard Entries: {Leaderboard.objects.count()}')
-        self.stdout.write(f'Workouts: {Workout.objects.count()}')
+        self.stdout.write(f'Teams: {Team.objects.mongo_estimated_document_count()}')
+        self.stdout.write(f'Users: {User.objects.mongo_estimated_document_count()}')
+        self.stdout.write(f'Activities: {Activity.objects.mongo_estimated_document_count()}')
+        self.stdout.write(f'Leaderboard Entries: {Leaderboard.objects.mongo_estimated_document_count()}')
+        self.stdout.write(f'Team Standings: {TeamLeaderboard.objects.mongo_estimated_document_count()}')
+        self.stdout.write(f'Workouts: {Workout.objects.mongo_estimated_document_count()}')
         self.stdout.write(self.style.SUCCESS('====================================='))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.rebuild import BATCH_SIZE, rebuild_leaderboard
+from octofit_tracker.team_leaderboard import rebuild_team_leaderboard
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the leaderboard from the activities collection in one streaming pass '
+        'and swap it in atomically'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int,
+                            help='Worker processes (default: CPU count; 1 runs in this process)')
+        parser.add_argument('--shards', type=int,
+                            help='User-id shards to split the work into (default: 4 per process)')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Entries written per batch')
+        parser.add_argument('--skip-teams', action='store_true',
+                            help='Do not rebuild team standings from the new totals')
+
+    def handle(self, *args, **options):
+        result = rebuild_leaderboard(
+            processes=options['processes'],
+            shards=options['shards'],
+            batch_size=options['batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {result["entries"]} leaderboard entries over {result["shards"]} shard(s)'
+        ))
+        if result['orphaned_activities']:
+            self.stdout.write(self.style.WARNING(
+                f'Skipped {result["orphaned_activities"]} activities of unknown users'
+            ))
+        if not options['skip_teams']:
+            teams = rebuild_team_leaderboard()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {teams} team standings'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.teams import recount_members
+
+
+class Command(BaseCommand):
+    help = 'Recompute every team\'s member_count from the users collection'
+
+    def handle(self, *args, **options):
+        teams = recount_members()
+        self.stdout.write(self.style.SUCCESS(f'Recounted members of {teams} team(s)'))
@@ -0,0 +1,29 @@
+import signal
+
+from django.core.management.base import BaseCommand
+from octofit_tracker.jobs import JobWorker, run_pending
+
+
+class Command(BaseCommand):
+    help = 'Run a background job worker against the Mongo job queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, help='Worker threads (default: JOB_WORKERS)')
+        parser.add_argument('--poll-interval', type=float, help='Seconds between queue polls')
+        parser.add_argument('--once', action='store_true',
+                            help='Run the jobs that are due in this process, then exit')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            count = run_pending(worker_id='run_jobs --once')
+            self.stdout.write(self.style.SUCCESS(f'Ran {count} job(s)'))
+            return
+
+        worker = JobWorker(threads=options['threads'], poll_interval=options['poll_interval'])
+        signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+        self.stdout.write(f'Job worker {worker.worker_id} started')
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write('Job worker stopped')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.denormalize import BATCH_SIZE, sync_denormalized_names
+
+
+class Command(BaseCommand):
+    help = 'Reconcile denormalized user and team names on the leaderboards with their sources'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Leaderboard entries compared per bulk update')
+
+    def handle(self, *args, **options):
+        updated = sync_denormalized_names(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} stale document(s)'))
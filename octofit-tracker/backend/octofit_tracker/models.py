@@ -8,8 +8,13 @@ class User(models.Model):
     team_id = models.CharField(max_length=100, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = models.DjongoManager()
+
     class Meta:
         db_table = 'users'
+        indexes = [
+            models.Index(fields=['team_id', '_id'], name='users_team_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -19,8 +24,11 @@ class Team(models.Model):
     _id = models.ObjectIdField()
     name = models.CharField(max_length=100)
     description = models.TextField(null=True, blank=True)
+    member_count = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = models.DjongoManager()
+
     class Meta:
         db_table = 'teams'
 
@@ -38,8 +46,18 @@ class Activity(models.Model):
     date = models.DateTimeField()
     notes = models.TextField(null=True, blank=True)
 
+    objects = models.DjongoManager()
+
     class Meta:
         db_table = 'activities'
+        # Ascending keys also serve the ``-date, -_id`` sorts: Mongo walks
+        # the index backwards after the equality prefix. ``_id`` is the
+        # cursor pagination tie-breaker (see pagination.py).
+        indexes = [
+            models.Index(fields=['date', '_id'], name='activities_date_id_idx'),
+            models.Index(fields=['user_id', 'date', '_id'], name='activities_user_date_id_idx'),
+            models.Index(fields=['activity_type', 'date', '_id'], name='activities_type_date_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.activity_type} - {self.duration} mins"
@@ -56,13 +74,96 @@ class Leaderboard(models.Model):
     rank = models.IntegerField(default=0)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = models.DjongoManager()
+
     class Meta:
         db_table = 'leaderboard'
+        indexes = [
+            models.Index(fields=['rank', '_id'], name='leaderboard_rank_id_idx'),
+            models.Index(fields=['team_id', 'rank', '_id'], name='leaderboard_team_rank_id_idx'),
+            models.Index(fields=['total_calories'], name='leaderboard_calories_idx'),
+        ]
+        constraints = [
+            # One entry per user, so concurrent first activities upsert the same entry
+            models.UniqueConstraint(fields=['user_id'], name='leaderboard_user_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user_name} - Rank {self.rank}"
 
 
+class TeamLeaderboard(models.Model):
+    _id = models.ObjectIdField()
+    team_id = models.CharField(max_length=100)
+    team_name = models.CharField(max_length=100)
+    member_count = models.IntegerField(default=0)
+    total_calories = models.IntegerField(default=0)
+    total_activities = models.IntegerField(default=0)
+    average_calories = models.FloatField(default=0)  # per member
+    rank = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = models.DjongoManager()
+
+    class Meta:
+        db_table = 'team_leaderboard'
+        indexes = [
+            models.Index(fields=['rank', '_id'], name='team_leaderboard_rank_id_idx'),
+            models.Index(fields=['team_id'], name='team_leaderboard_team_idx'),
+            models.Index(fields=['total_calories'], name='team_leaderboard_calories_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.team_name} - Rank {self.rank}"
+
+
+class ActivityRollup(models.Model):
+    _id = models.ObjectIdField()
+    user_id = models.CharField(max_length=100)
+    team_id = models.CharField(max_length=100, null=True, blank=True)
+    period = models.CharField(max_length=10)  # day, week or month
+    period_start = models.DateTimeField()  # UTC start of the bucket
+    total_calories = models.IntegerField(default=0)
+    total_duration = models.IntegerField(default=0)  # in minutes
+    total_distance = models.FloatField(default=0)  # in km
+    total_activities = models.IntegerField(default=0)
+
+    objects = models.DjongoManager()
+
+    class Meta:
+        db_table = 'activity_rollups'
+        indexes = [
+            models.Index(fields=['period', 'period_start', 'user_id'], name='rollups_period_idx'),
+            models.Index(fields=['period', 'team_id', 'period_start'], name='rollups_team_period_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} - {self.period} {self.period_start:%Y-%m-%d}"
+
+
+class ActivityProfile(models.Model):
+    _id = models.ObjectIdField()
+    user_id = models.CharField(max_length=100)
+    # Recency-weighted sums over the user's activities, see recommendations.py
+    ref = models.DateTimeField(null=True, blank=True)  # date weighing 1 in the sums
+    mix = models.JSONField(default=dict)  # activity type -> weight
+    weight = models.FloatField(default=0)
+    minutes = models.FloatField(default=0)
+    calories = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = models.DjongoManager()
+
+    class Meta:
+        db_table = 'activity_profiles'
+        indexes = [
+            models.Index(fields=['user_id'], name='profiles_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"Activity profile of {self.user_id}"
+
+
 class Workout(models.Model):
     _id = models.ObjectIdField()
     name = models.CharField(max_length=100)
@@ -72,8 +173,60 @@ class Workout(models.Model):
     category = models.CharField(max_length=50)
     exercises = models.JSONField()  # list of exercises
 
+    objects = models.DjongoManager()
+
     class Meta:
         db_table = 'workouts'
+        indexes = [
+            models.Index(fields=['difficulty', '_id'], name='workouts_difficulty_idx'),
+            models.Index(fields=['category', '_id'], name='workouts_category_idx'),
+        ]
 
     def __str__(self):
         return self.name
+
+
+class Job(models.Model):
+    _id = models.ObjectIdField()
+    name = models.CharField(max_length=100)  # registered task name, see jobs.py
+    args = models.JSONField(default=dict)
+    key = models.CharField(max_length=32)  # digest of name and args, for dedup
+    status = models.CharField(max_length=10, default='pending')  # pending, running, done or failed
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_at = models.DateTimeField()  # earliest time the job may run
+    locked_by = models.CharField(max_length=100, null=True, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    objects = models.DjongoManager()
+
+    class Meta:
+        db_table = 'jobs'
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='jobs_status_run_at_idx'),
+        ]
+        # The unique partial index on pending keys is declared in indexes.py,
+        # since djongo cannot translate a conditional UniqueConstraint
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
+
+
+class CacheVersion(models.Model):
+    _id = models.ObjectIdField()
+    namespace = models.CharField(max_length=50)  # cache namespace, see cache.py
+    version = models.BigIntegerField()
+
+    objects = models.DjongoManager()
+
+    class Meta:
+        db_table = 'cache_versions'
+        constraints = [
+            models.UniqueConstraint(fields=['namespace'], name='cache_versions_namespace_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.namespace} v{self.version}"
@@ -0,0 +1,170 @@
+"""
+Keyset (cursor) pagination for the API.
+
+Pages are addressed by an opaque cursor holding the ``(value, _id)`` of the
+last row seen, where ``value`` is the ordering field. Every page is fetched
+with a range filter on those two keys, ``field < value or (field == value
+and _id < id)``, served by an index on ``(field, _id)``, instead of skipping
+over earlier rows. Deep pages and large blocks of equal values (e.g. every
+user tied at zero calories) cost the same as the first page.
+"""
+from base64 import b64decode, b64encode
+from urllib import parse
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination whose ordering is declared per viewset.
+
+    Viewsets set ``cursor_ordering`` to the field their hot queries sort on
+    (``-date`` for activities, ``rank`` for the leaderboard); ``_id`` is
+    appended in the same direction to break ties. ObjectIds grow
+    monotonically, so ``-_id`` is a stable newest-first default.
+
+    Orderings on a field that is rewritten in place, like ``rank``, stay
+    consistent within a page, but rows whose value moves past the cursor
+    between two requests can be skipped or seen twice.
+    """
+    ordering = '-_id'
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'cursor_ordering', self.ordering)
+        if isinstance(ordering, str):
+            return (ordering,)
+        return tuple(ordering)
+
+    def _keys(self):
+        field = self.ordering[0].lstrip('-')
+        return field, self.ordering[0].startswith('-')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        field, descending = self._keys()
+
+        cursor = self.decode_cursor(request)
+        reverse = cursor.reverse if cursor else False
+        # Walking backwards flips the sort and the comparison
+        backwards = descending != reverse
+        sign = '-' if backwards else ''
+        if field == '_id':
+            queryset = queryset.order_by(f'{sign}_id')
+        else:
+            queryset = queryset.order_by(f'{sign}{field}', f'{sign}_id')
+
+        if cursor is not None:
+            value, object_id = cursor.position
+            lookup = 'lt' if backwards else 'gt'
+            if field == '_id':
+                queryset = queryset.filter(**{f'_id__{lookup}': object_id})
+            else:
+                queryset = queryset.filter(
+                    Q(**{f'{field}__{lookup}': value})
+                    | Q(**{field: value, f'_id__{lookup}': object_id})
+                )
+
+        rows = list(queryset[:self.page_size + 1])
+        has_following = len(rows) > self.page_size
+        page = rows[:self.page_size]
+        if reverse:
+            page.reverse()
+            has_previous, has_next = has_following, True
+        else:
+            has_previous, has_next = cursor is not None, has_following
+        self.set_links(page, field, has_next, has_previous)
+        return page
+
+    def paginate_rows(self, rows, request, view=None):
+        """
+        Paginate an in-memory list already sorted by the view's ordering.
+
+        Cursors are the same as for querysets, so clients can page through
+        either kind of list alike. Positions are compared as strings, which
+        orders ObjectIds correctly.
+        """
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, None, view)
+        field, descending = self._keys()
+
+        cursor = self.decode_cursor(request)
+        reverse = cursor.reverse if cursor else False
+
+        def key(row):
+            return str(row[field]), str(row['_id'])
+
+        def before(row):
+            return key(row) > position if descending else key(row) < position
+
+        if cursor is None:
+            candidates = rows
+        else:
+            position = tuple(str(part) for part in cursor.position)
+            if reverse:
+                candidates = [row for row in rows if before(row)]
+            else:
+                candidates = [row for row in rows if not before(row) and key(row) != position]
+
+        if reverse:
+            page = candidates[-self.page_size:]
+            has_previous, has_next = len(candidates) > self.page_size, True
+        else:
+            page = candidates[:self.page_size]
+            has_previous, has_next = cursor is not None, len(candidates) > self.page_size
+        self.set_links(page, field, has_next, has_previous)
+        return page
+
+    def set_links(self, page, field, has_next, has_previous):
+        def position(row):
+            if not isinstance(row, dict):
+                row = {field: getattr(row, field), '_id': row._id}
+            return str(row[field]), str(row['_id'])
+
+        self.row_links = (
+            self.encode_cursor(Cursor(0, False, position(page[-1]))) if has_next and page else None,
+            self.encode_cursor(Cursor(0, True, position(page[0]))) if has_previous and page else None,
+        )
+
+    def encode_cursor(self, cursor):
+        tokens = {}
+        if cursor.reverse:
+            tokens['r'] = '1'
+        if cursor.position is not None:
+            tokens['p'], tokens['i'] = cursor.position
+        querystring = parse.urlencode(tokens)
+        encoded = b64encode(querystring.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            tokens = parse.parse_qs(b64decode(encoded.encode('ascii')).decode('ascii'), keep_blank_values=True)
+            reverse = bool(int(tokens.get('r', ['0'])[0]))
+            position = (tokens['p'][0], ObjectId(tokens['i'][0]))
+        except (TypeError, ValueError, KeyError, InvalidId, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        return Cursor(offset=0, reverse=reverse, position=position)
+
+    def get_next_link(self):
+        return self.row_links[0]
+
+    def get_previous_link(self):
+        return self.row_links[1]
@@ -0,0 +1,128 @@
+"""
+Connection pool metrics from pymongo's monitoring events.
+
+``PoolMetrics`` is registered globally when the app is ready, so it observes
+every client the process creates (djongo's and the async read path's). Per
+server address it tracks open and in-use connections, the number of
+threads waiting for a checkout, checkout failures, and checkout latency,
+measured from ``ConnectionCheckOutStartedEvent`` to the matching
+``ConnectionCheckedOutEvent`` on the same thread.
+"""
+import threading
+import time
+from collections import deque
+
+from pymongo import monitoring
+
+LATENCY_SAMPLES = 1024
+
+
+class _PoolStats:
+    __slots__ = ('open', 'in_use', 'waiting', 'checkouts', 'failures', 'latencies', 'max_latency')
+
+    def __init__(self):
+        self.open = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.failures = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.max_latency = 0.0
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._started = threading.local()
+
+    def snapshot(self):
+        """Return current metrics keyed by ``host:port``"""
+        with self._lock:
+            return {
+                f'{host}:{port}': {
+                    'open_connections': stats.open,
+                    'in_use_connections': stats.in_use,
+                    'wait_queue_depth': stats.waiting,
+                    'checkouts': stats.checkouts,
+                    'checkout_failures': stats.failures,
+                    'checkout_ms': _latency_summary(stats),
+                }
+                for (host, port), stats in self._pools.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._pools.clear()
+
+    def _stats(self, address):
+        stats = self._pools.get(address)
+        if stats is None:
+            stats = self._pools[address] = _PoolStats()
+        return stats
+
+    def pool_created(self, event):
+        with self._lock:
+            self._stats(event.address)
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        with self._lock:
+            self._pools.pop(event.address, None)
+
+    def connection_created(self, event):
+        with self._lock:
+            self._stats(event.address).open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            stats = self._stats(event.address)
+            stats.open = max(stats.open - 1, 0)
+
+    def connection_check_out_started(self, event):
+        self._started.value = time.perf_counter()
+        with self._lock:
+            self._stats(event.address).waiting += 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            stats = self._stats(event.address)
+            stats.waiting = max(stats.waiting - 1, 0)
+            stats.failures += 1
+
+    def connection_checked_out(self, event):
+        started = getattr(self._started, 'value', None)
+        latency = (time.perf_counter() - started) * 1000 if started is not None else None
+        with self._lock:
+            stats = self._stats(event.address)
+            stats.waiting = max(stats.waiting - 1, 0)
+            stats.in_use += 1
+            stats.checkouts += 1
+            if latency is not None:
+                stats.latencies.append(latency)
+                stats.max_latency = max(stats.max_latency, latency)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            stats = self._stats(event.address)
+            stats.in_use = max(stats.in_use - 1, 0)
+
+
+def _latency_summary(stats):
+    """p50/p99 over the most recent checkouts and the all-time maximum"""
+    samples = sorted(stats.latencies)
+    if not samples:
+        return {'p50': None, 'p99': None, 'max': None}
+    return {
+        'p50': round(samples[len(samples) // 2], 3),
+        'p99': round(samples[min(int(len(samples) * 0.99), len(samples) - 1)], 3),
+        'max': round(stats.max_latency, 3),
+    }
+
+
+pool_metrics = PoolMetrics()
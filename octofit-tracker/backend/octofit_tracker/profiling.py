@@ -0,0 +1,192 @@
+"""
+Per-request query profiling.
+
+``QueryProfilingMiddleware`` opens a ``RequestProfile`` for every request and
+``CommandProfiler``, a pymongo command listener registered when the app is
+ready, attributes each Mongo command (the commands djongo translated the
+ORM's SQL into, as well as direct ``mongo_*`` calls) to the profile of the
+request that issued it. The profile travels in a context variable, so it
+follows the request into ``sync_to_async`` threads and the async read
+path's executor.
+
+Each response gets a ``Server-Timing`` header splitting the request into
+``db`` (summed command durations), ``render`` (DRF response rendering),
+``serialize`` (the rest of the view, i.e. serialization and Python work)
+and ``total``. Commands slower than ``SLOW_QUERY_THRESHOLD_MS`` and
+requests issuing more than ``SLOW_REQUEST_ROUND_TRIPS`` commands (a
+typical N+1 signature) are logged to ``octofit_tracker.slow_queries``;
+every profile is logged at DEBUG level to ``octofit_tracker.profiling``.
+"""
+import asyncio
+import contextvars
+import logging
+from time import perf_counter
+
+from bson import json_util
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from pymongo import monitoring
+
+logger = logging.getLogger('octofit_tracker.profiling')
+slow_query_logger = logging.getLogger('octofit_tracker.slow_queries')
+
+current_profile = contextvars.ContextVar('octofit_query_profile', default=None)
+
+# Command keys holding document payloads; only their length is kept
+PAYLOAD_KEYS = ('documents', 'updates', 'deletes')
+MAX_LOGGED_COMMAND = 1000
+
+
+class RequestProfile:
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.started = perf_counter()
+        self.commands = []
+        self.render_started = None
+        self.render_ms = 0.0
+        self.response_size = None
+        self._pending = {}
+
+    @property
+    def round_trips(self):
+        return len(self.commands)
+
+    @property
+    def db_ms(self):
+        return sum(command['duration_ms'] or 0 for command in self.commands)
+
+    def command_started(self, event):
+        command = {
+            'command': event.command_name,
+            'collection': event.command.get(event.command_name),
+            'spec': summarize_command(event.command),
+            'duration_ms': None,
+        }
+        self.commands.append(command)
+        self._pending[event.request_id] = command
+
+    def command_finished(self, event, failed=False):
+        command = self._pending.pop(event.request_id, None)
+        if command is None:
+            return
+        command['duration_ms'] = event.duration_micros / 1000
+        command['failed'] = failed
+
+
+class CommandProfiler(monitoring.CommandListener):
+    """Attributes Mongo commands to the current request profile"""
+
+    def started(self, event):
+        profile = current_profile.get()
+        if profile is not None:
+            profile.command_started(event)
+
+    def succeeded(self, event):
+        profile = current_profile.get()
+        if profile is not None:
+            profile.command_finished(event)
+
+    def failed(self, event):
+        profile = current_profile.get()
+        if profile is not None:
+            profile.command_finished(event, failed=True)
+
+
+command_profiler = CommandProfiler()
+
+
+def summarize_command(command):
+    """The command document with bulk payloads replaced by their length"""
+    return {
+        key: f'<{len(value)} items>' if key in PAYLOAD_KEYS else value
+        for key, value in command.items()
+        if key != 'lsid'
+    }
+
+
+class QueryProfilingMiddleware:
+    """
+    Records DB round trips, Mongo commands, timings and response size per
+    request and reports them in ``Server-Timing``; see the module docstring.
+    Disabled when ``QUERY_PROFILING`` is false.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_PROFILING', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Mark the instance as a coroutine function for Django's handler
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        profile = RequestProfile(request.method, request.path)
+        token = current_profile.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.finish(profile, response)
+
+    async def __acall__(self, request):
+        profile = RequestProfile(request.method, request.path)
+        token = current_profile.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.finish(profile, response)
+
+    def process_template_response(self, request, response):
+        profile = current_profile.get()
+        if profile is not None:
+            profile.render_started = perf_counter()
+
+            def rendered(response):
+                profile.render_ms = (perf_counter() - profile.render_started) * 1000
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def finish(self, profile, response):
+        total_ms = (perf_counter() - profile.started) * 1000
+        db_ms = profile.db_ms
+        serialize_ms = max(total_ms - db_ms - profile.render_ms, 0.0)
+        profile.response_size = None if response.streaming else len(response.content)
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={db_ms:.2f};desc="{profile.round_trips} round trips"',
+            f'serialize;dur={serialize_ms:.2f}',
+            f'render;dur={profile.render_ms:.2f}',
+            f'total;dur={total_ms:.2f}',
+        ])
+
+        threshold = getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', 100)
+        for command in profile.commands:
+            if command['duration_ms'] is not None and command['duration_ms'] >= threshold:
+                slow_query_logger.warning(
+                    '%s %s: %s on %s took %.1fms: %s',
+                    profile.method, profile.path, command['command'], command['collection'],
+                    command['duration_ms'], json_util.dumps(command['spec'])[:MAX_LOGGED_COMMAND],
+                )
+        max_round_trips = getattr(settings, 'SLOW_REQUEST_ROUND_TRIPS', 20)
+        if profile.round_trips > max_round_trips:
+            slow_query_logger.warning(
+                '%s %s issued %d DB round trips (%s)',
+                profile.method, profile.path, profile.round_trips,
+                ', '.join(f'{command["command"]} {command["collection"]}' for command in profile.commands[:10]),
+            )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                '%s %s: %d round trips, db %.1fms, serialize %.1fms, render %.1fms, '
+                'total %.1fms, %s bytes; commands: %s',
+                profile.method, profile.path, profile.round_trips, db_ms, serialize_ms,
+                profile.render_ms, total_ms, profile.response_size, json_util.dumps(profile.commands)[:MAX_LOGGED_COMMAND],
+            )
+        return response
@@ -0,0 +1,213 @@
+"""
+In-process order-statistics index over leaderboard totals.
+
+``RankIndex`` is an indexable skiplist ordered by ``(-total_calories,
+user_id)``: every node stores how many entries each of its links skips, so
+"top N", "rank of user X" and "users around X" are answered in O(log n)
+without sorting the leaderboard collection.
+
+The process-wide index is built from Mongo the first time it is used and
+kept in sync by the leaderboard engine, which reports every new total, and
+by Leaderboard model signals for ORM writes such as the admin. A rebuild is
+forced after ``RANKING_INDEX_TTL`` seconds so writes made by other worker
+processes are picked up.
+"""
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Leaderboard
+
+MAX_LEVELS = 24  # comfortably covers ~16M entries
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+
+class RankIndex:
+    """Indexable skiplist of ``user_id -> total_calories``, highest total first"""
+
+    def __init__(self, entries=()):
+        self._tail = _Node(None, 0)
+        self._head = _Node(None, MAX_LEVELS)
+        self._head.next = [self._tail] * MAX_LEVELS
+        self._totals = {}
+        for user_id, total in entries:
+            self.update(user_id, total)
+
+    def __len__(self):
+        return len(self._totals)
+
+    def __contains__(self, user_id):
+        return user_id in self._totals
+
+    def total(self, user_id):
+        return self._totals[user_id]
+
+    def update(self, user_id, total):
+        """Insert a user or move them to a new total"""
+        previous = self._totals.get(user_id)
+        if previous == total:
+            return
+        if previous is not None:
+            self._remove((-previous, user_id))
+        self._insert((-total, user_id))
+        self._totals[user_id] = total
+
+    def remove(self, user_id):
+        previous = self._totals.pop(user_id)
+        self._remove((-previous, user_id))
+
+    def position(self, user_id):
+        """0-based position of a user in the ordering"""
+        return self._count_below((-self._totals[user_id], user_id))
+
+    def rank(self, user_id):
+        """Competition rank: one plus the number of users with a strictly higher total"""
+        return 1 + self._count_below((-self._totals[user_id], ''))
+
+    def slice(self, start, stop):
+        """``(user_id, total)`` pairs for positions ``start <= p < stop``"""
+        start = max(start, 0)
+        stop = min(stop, len(self))
+        if start >= stop:
+            return []
+        node = self._node_at(start)
+        result = []
+        for _ in range(stop - start):
+            result.append((node.key[1], -node.key[0]))
+            node = node.next[0]
+        return result
+
+    def top(self, n):
+        return self.slice(0, n)
+
+    def around(self, user_id, radius):
+        position = self.position(user_id)
+        return self.slice(position - radius, position + radius + 1)
+
+    def _insert(self, key):
+        chain = [None] * MAX_LEVELS
+        steps_at_level = [0] * MAX_LEVELS
+        node = self._head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level] is not self._tail and node.next[level].key <= key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        levels = 1
+        while levels < MAX_LEVELS and random.random() < 0.5:
+            levels += 1
+        new_node = _Node(key, levels)
+        steps = 0
+        for level in range(levels):
+            previous = chain[level]
+            new_node.next[level] = previous.next[level]
+            previous.next[level] = new_node
+            new_node.width[level] = previous.width[level] - steps
+            previous.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, MAX_LEVELS):
+            chain[level].width[level] += 1
+
+    def _remove(self, key):
+        chain = [None] * MAX_LEVELS
+        node = self._head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level] is not self._tail and node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target is self._tail or target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            previous = chain[level]
+            previous.width[level] += target.width[level] - 1
+            previous.next[level] = target.next[level]
+        for level in range(len(target.next), MAX_LEVELS):
+            chain[level].width[level] -= 1
+
+    def _count_below(self, key):
+        count = 0
+        node = self._head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level] is not self._tail and node.next[level].key < key:
+                count += node.width[level]
+                node = node.next[level]
+        return count
+
+    def _node_at(self, position):
+        remaining = position + 1
+        node = self._head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level] is not self._tail and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node
+
+
+class LeaderboardRanking:
+    """Thread-safe, lazily built ``RankIndex`` over the leaderboard collection"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._index = None
+        self._built_at = 0
+
+    def rebuild(self):
+        entries = Leaderboard.objects.mongo_find({}, {'_id': 0, 'user_id': 1, 'total_calories': 1})
+        index = RankIndex(
+            (entry['user_id'], entry.get('total_calories') or 0) for entry in entries
+        )
+        with self._lock:
+            self._index = index
+            self._built_at = time.monotonic()
+
+    def reset(self):
+        """Drop the index; the next read rebuilds it from Mongo"""
+        with self._lock:
+            self._index = None
+
+    def observe(self, user_id, total):
+        """Record a user's new total if the index has been built"""
+        with self._lock:
+            if self._index is not None:
+                self._index.update(user_id, total)
+
+    def discard(self, user_id):
+        with self._lock:
+            if self._index is not None and user_id in self._index:
+                self._index.remove(user_id)
+
+    def read(self, reader):
+        """Run ``reader(index)`` against an up-to-date index"""
+        with self._lock:
+            ttl = getattr(settings, 'RANKING_INDEX_TTL', 300)
+            if self._index is None or time.monotonic() - self._built_at > ttl:
+                self.rebuild()
+            return reader(self._index)
+
+
+ranking = LeaderboardRanking()
+
+
+@receiver(post_save, sender=Leaderboard)
+def leaderboard_entry_saved(sender, instance, **kwargs):
+    ranking.observe(instance.user_id, instance.total_calories or 0)
+
+
+@receiver(post_delete, sender=Leaderboard)
+def leaderboard_entry_deleted(sender, instance, **kwargs):
+    ranking.discard(instance.user_id)
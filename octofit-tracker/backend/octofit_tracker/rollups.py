@@ -0,0 +1,190 @@
+"""
+Pre-aggregated activity rollups for time-windowed leaderboards.
+
+Every activity write adds its calories, duration, distance and count to one
+``ActivityRollup`` document per user and per day, ISO week and month
+bucket. Windowed leaderboards then group a handful of rollup documents per
+user instead of scanning raw activities. Buckets are UTC and weeks start on
+Monday. A bucket keeps the team the user belonged to when its first
+activity was recorded (their current team after ``rebuild_rollups``), and
+windowed totals report the team of the user's latest bucket.
+"""
+from collections import defaultdict
+from datetime import timedelta, timezone as dt_timezone
+
+from django.dispatch import receiver
+from django.utils import timezone
+from pymongo import UpdateOne
+
+from .cache import LEADERBOARD, invalidate
+from .jobs import task
+from .models import User, Activity, ActivityRollup
+from .rebuild import replace_collection
+from .signals import activities_changed
+from .teams import team_ids_for
+
+PERIODS = ('day', 'week', 'month')
+
+# Mongo expressions computing the same bucket starts as period_start()
+PERIOD_EXPRESSIONS = {
+    'day': {'$dateFromParts': {
+        'year': {'$year': '$date'},
+        'month': {'$month': '$date'},
+        'day': {'$dayOfMonth': '$date'},
+    }},
+    'week': {'$dateFromParts': {
+        'isoWeekYear': {'$isoWeekYear': '$date'},
+        'isoWeek': {'$isoWeek': '$date'},
+    }},
+    'month': {'$dateFromParts': {
+        'year': {'$year': '$date'},
+        'month': {'$month': '$date'},
+    }},
+}
+
+
+def period_start(date, period):
+    """Return the UTC start of the day/week/month bucket containing ``date``"""
+    if timezone.is_naive(date):
+        date = date.replace(tzinfo=dt_timezone.utc)
+    else:
+        date = date.astimezone(dt_timezone.utc)
+    day = date.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def rollup_deltas(added=(), removed=()):
+    """Fold activities into ``{(user_id, period, period_start): [calories, duration, distance, count]}``"""
+    deltas = defaultdict(lambda: [0, 0, 0.0, 0])
+    for sign, activities in ((1, added), (-1, removed)):
+        for activity in activities:
+            for period in PERIODS:
+                key = (str(activity.user_id), period, period_start(activity.date, period))
+                delta = deltas[key]
+                delta[0] += sign * (activity.calories or 0)
+                delta[1] += sign * (activity.duration or 0)
+                delta[2] += sign * (activity.distance or 0)
+                delta[3] += sign
+    return deltas
+
+
+def apply_activity_changes(added=(), removed=()):
+    """Apply added/removed activities to the rollups with one bulk write"""
+    deltas = rollup_deltas(added, removed)
+    if not deltas:
+        return
+    teams = team_ids_for({user_id for user_id, _, _ in deltas})
+    updates = [
+        UpdateOne(
+            {'user_id': user_id, 'period': period, 'period_start': start},
+            {
+                '$inc': {
+                    'total_calories': calories,
+                    'total_duration': duration,
+                    'total_distance': distance,
+                    'total_activities': count,
+                },
+                '$setOnInsert': {'team_id': teams.get(user_id)},
+            },
+            upsert=True,
+        )
+        for (user_id, period, start), (calories, duration, distance, count) in deltas.items()
+    ]
+    ActivityRollup.objects.mongo_bulk_write(updates, ordered=False)
+    invalidate(LEADERBOARD)
+
+
+def windowed_totals(period, since=None, team_id=None, limit=50):
+    """
+    Rank users by calories over rollup buckets of ``period``.
+
+    Without ``since`` only the current bucket is used; with it, every bucket
+    from the one containing ``since`` onwards is summed.
+    """
+    start = period_start(since or timezone.now(), period)
+    match = {'period': period, 'period_start': {'$gte': start}}
+    if team_id:
+        match['team_id'] = team_id
+    rows = ActivityRollup.objects.mongo_aggregate([
+        {'$match': match},
+        # Orders buckets so $last picks the team of the latest one
+        {'$sort': {'period_start': 1}},
+        {'$group': {
+            '_id': '$user_id',
+            'team_id': {'$last': '$team_id'},
+            'total_calories': {'$sum': '$total_calories'},
+            'total_duration': {'$sum': '$total_duration'},
+            'total_distance': {'$sum': '$total_distance'},
+            'total_activities': {'$sum': '$total_activities'},
+        }},
+        {'$match': {'total_activities': {'$gt': 0}}},
+        {'$sort': {'total_calories': -1, '_id': 1}},
+        {'$limit': limit},
+    ])
+
+    results = []
+    rank = 0
+    previous_total = None
+    for position, row in enumerate(rows, start=1):
+        if row['total_calories'] != previous_total:
+            rank = position
+            previous_total = row['total_calories']
+        results.append({
+            'user_id': row['_id'],
+            'team_id': row['team_id'],
+            'total_calories': row['total_calories'],
+            'total_duration': row['total_duration'],
+            'total_distance': round(row['total_distance'], 2),
+            'total_activities': row['total_activities'],
+            'rank': rank,
+        })
+    return start, results
+
+
+@task('rollups.rebuild')
+def rebuild_rollups(batch_size=5000):
+    """
+    Recompute every rollup from the activities collection with server-side grouping.
+
+    The rollups are swapped in with ``replace_collection``, so windowed
+    leaderboards keep serving the old ones until the rebuild is done.
+    """
+    written = replace_collection(ActivityRollup, _rebuilt_rollups(batch_size), batch_size)
+    invalidate(LEADERBOARD)
+    return written
+
+
+def _rebuilt_rollups(batch_size):
+    teams = {
+        str(user['_id']): user.get('team_id')
+        for user in User.objects.mongo_find({}, {'team_id': 1})
+    }
+    for period, expression in PERIOD_EXPRESSIONS.items():
+        rows = Activity.objects.mongo_aggregate([
+            {'$group': {
+                '_id': {'user_id': '$user_id', 'period_start': expression},
+                'total_calories': {'$sum': '$calories'},
+                'total_duration': {'$sum': '$duration'},
+                'total_distance': {'$sum': {'$ifNull': ['$distance', 0]}},
+                'total_activities': {'$sum': 1},
+            }},
+        ], allowDiskUse=True, batchSize=batch_size)
+
+        for row in rows:
+            key = row.pop('_id')
+            row.update(
+                user_id=key['user_id'],
+                team_id=teams.get(key['user_id']),
+                period=period,
+                period_start=key['period_start'],
+            )
+            yield row
+
+
+@receiver(activities_changed)
+def activities_changed_receiver(sender, added=(), removed=(), **kwargs):
+    apply_activity_changes(added, removed)
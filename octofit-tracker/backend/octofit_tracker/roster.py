@@ -0,0 +1,331 @@
+"""
+Batch user upserts and team reassignment.
+
+Roster syncs send thousands of users at once. Each item either targets an
+existing user by ``_id`` or is matched on ``email`` and created if no user
+has that email. Items are handled in chunks of ``BATCH_SIZE``. Each chunk
+costs one query for the users it names, one for the teams it references
+and one ``bulk_write``; only fields that actually change are written.
+
+Nothing is sent through ``membership_changed``, because per-user receivers
+would undo the batching. The effects of the whole chunk are folded into
+the denormalized copies in one pass instead:
+
+- team member counters get one ``$inc`` per team
+- leaderboard entries of moved or renamed users get one update each, in a
+  single ``bulk_write``
+- team standings get one combined delta per team
+
+With ``ordered`` the first failing item stops the run and the remaining
+items are reported as ``skipped``. Otherwise every valid item is written.
+"""
+from collections import defaultdict
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.utils import timezone
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from rest_framework import serializers
+
+from .cache import LEADERBOARD, invalidate
+from .models import User, Team, Leaderboard
+from .team_leaderboard import apply_team_delta
+
+BATCH_SIZE = 1000
+
+CREATED = 'created'
+UPDATED = 'updated'
+UNCHANGED = 'unchanged'
+ERROR = 'error'
+SKIPPED = 'skipped'
+
+
+class UserBatchItemSerializer(serializers.Serializer):
+    """
+    Shape of one batch item.
+
+    Email uniqueness and team existence are checked per chunk against
+    preloaded users and teams rather than with a query per item.
+    """
+    _id = serializers.CharField(required=False)
+    name = serializers.CharField(max_length=100, required=False)
+    email = serializers.EmailField(max_length=254, required=False)
+    team_id = serializers.CharField(max_length=100, required=False, allow_null=True)
+
+    def validate__id(self, value):
+        try:
+            return ObjectId(value)
+        except (InvalidId, TypeError):
+            raise serializers.ValidationError('Not a valid id.')
+
+    def validate(self, attrs):
+        if '_id' not in attrs and 'email' not in attrs:
+            raise serializers.ValidationError('Either _id or email is required.')
+        if attrs.get('team_id') == '':
+            attrs['team_id'] = None
+        return attrs
+
+
+def apply_user_batch(items, ordered=False, batch_size=BATCH_SIZE):
+    """Upsert users from a list of items; return counts and a result per item"""
+    results = []
+    stopped = False
+    for start in range(0, len(items), batch_size):
+        if stopped:
+            results.extend(_skipped(start, len(items)))
+            break
+        chunk_results = _apply_chunk(items[start:start + batch_size], start, ordered)
+        results.extend(chunk_results)
+        stopped = ordered and any(result['status'] in (ERROR, SKIPPED) for result in chunk_results)
+
+    counts = defaultdict(int)
+    for result in results:
+        counts[result['status']] += 1
+    return {
+        'ordered': ordered,
+        'created': counts[CREATED],
+        'updated': counts[UPDATED],
+        'unchanged': counts[UNCHANGED],
+        'errors': counts[ERROR],
+        'skipped': counts[SKIPPED],
+        'results': results,
+    }
+
+
+def _skipped(start, stop):
+    return [{'index': index, 'status': SKIPPED} for index in range(start, stop)]
+
+
+def _apply_chunk(items, offset, ordered):
+    results = [None] * len(items)
+    validated = []
+    for position, item in enumerate(items):
+        serializer = UserBatchItemSerializer(data=item)
+        if serializer.is_valid():
+            validated.append((position, serializer.validated_data))
+        else:
+            results[position] = {'index': offset + position, 'status': ERROR, 'errors': serializer.errors}
+            if ordered:
+                break
+
+    existing = _load_users(validated)
+    teams = _load_teams(validated)
+
+    # Plan the writes; ``operations[i]`` belongs to ``planned[i]``
+    operations = []
+    planned = []
+    taken = {}  # email -> _id, as it will be once earlier items are applied
+    for user in existing.values():
+        taken[user['email']] = user['_id']
+    seen = {}
+    for position, data in validated:
+        plan, error = _plan(data, existing, teams, taken, seen, offset + position)
+        if error:
+            results[position] = {'index': offset + position, 'status': ERROR, 'errors': error}
+            if ordered:
+                break
+            continue
+        if plan['operation'] is None:
+            results[position] = {'index': offset + position, 'status': UNCHANGED, '_id': str(plan['_id'])}
+            continue
+        operations.append(plan['operation'])
+        planned.append((position, plan))
+
+    failed = set()
+    upserted = set()
+    executed = len(operations)
+    if operations:
+        try:
+            upserted = set(User.objects.mongo_bulk_write(operations, ordered=ordered).upserted_ids)
+        except BulkWriteError as exc:
+            upserted = {upsert['index'] for upsert in exc.details.get('upserted', [])}
+            for error in exc.details.get('writeErrors', []):
+                failed.add(error['index'])
+                position = planned[error['index']][0]
+                results[position] = {
+                    'index': offset + position,
+                    'status': ERROR,
+                    'errors': {'non_field_errors': [error['errmsg']]},
+                }
+            if ordered and failed:
+                executed = min(failed)
+
+    applied = []
+    for index, (position, plan) in enumerate(planned):
+        if index in failed:
+            continue
+        if index >= executed:
+            results[position] = {'index': offset + position, 'status': SKIPPED}
+            continue
+        if plan['status'] == CREATED and index not in upserted:
+            # A concurrent write created a user with this email first, so the
+            # $setOnInsert upsert matched it and wrote nothing
+            results[position] = {
+                'index': offset + position,
+                'status': ERROR,
+                'errors': {'email': ['A user with this email already exists.']},
+            }
+            continue
+        results[position] = {'index': offset + position, 'status': plan['status'], '_id': str(plan['_id'])}
+        applied.append(plan)
+
+    for position, result in enumerate(results):
+        if result is None:
+            results[position] = {'index': offset + position, 'status': SKIPPED}
+
+    _propagate(applied, teams)
+    return results
+
+
+def _plan(data, existing, teams, taken, seen, index):
+    """Turn one validated item into a write, or return ``(None, errors)``"""
+    if '_id' in data:
+        user = existing.get(data['_id'])
+        if user is None:
+            return None, {'_id': ['User not found.']}
+    else:
+        user = existing.get(taken.get(data['email']))
+
+    key = user['_id'] if user else data['email']
+    if key in seen:
+        return None, {'non_field_errors': [f'Same user as item {seen[key]}.']}
+    seen[key] = index
+
+    team_id = data.get('team_id', user.get('team_id') if user else None)
+    if data.get('team_id') is not None and team_id not in teams:
+        return None, {'team_id': ['Team not found.']}
+    email = data.get('email')
+    owner = taken.get(email)
+    if user is not None and owner is not None and owner != user['_id']:
+        return None, {'email': ['A user with this email already exists.']}
+
+    if user is None:
+        if not data.get('name'):
+            return None, {'name': ['This field is required to create a user.']}
+        object_id = ObjectId()
+        document = {
+            '_id': object_id,
+            'name': data['name'],
+            'email': email,
+            'team_id': team_id,
+            'created_at': timezone.now(),
+        }
+        taken[email] = object_id
+        return {
+            'status': CREATED,
+            '_id': object_id,
+            'operation': UpdateOne({'email': email}, {'$setOnInsert': document}, upsert=True),
+            'old_team_id': None,
+            'new_team_id': team_id,
+            'name': None,
+        }, None
+
+    changes = {
+        field: value for field, value in data.items()
+        if field != '_id' and user.get(field) != value
+    }
+    if 'email' in changes:
+        taken.pop(user['email'], None)
+        taken[changes['email']] = user['_id']
+    return {
+        'status': UPDATED if changes else UNCHANGED,
+        '_id': user['_id'],
+        'operation': UpdateOne({'_id': user['_id']}, {'$set': changes}) if changes else None,
+        'old_team_id': user.get('team_id'),
+        'new_team_id': team_id,
+        'name': changes.get('name'),
+    }, None
+
+
+def _load_users(validated):
+    """``{_id: user}`` for every user an item names by id or email, in one query"""
+    ids = [data['_id'] for _, data in validated if '_id' in data]
+    emails = [data['email'] for _, data in validated if 'email' in data]
+    if not ids and not emails:
+        return {}
+    return {
+        user['_id']: user
+        for user in User.objects.mongo_find(
+            {'$or': [{'_id': {'$in': ids}}, {'email': {'$in': emails}}]},
+            {'name': 1, 'email': 1, 'team_id': 1},
+        )
+    }
+
+
+def _load_teams(validated):
+    """``{team_id: name}`` for every team the items reference, in one query"""
+    object_ids = set()
+    for _, data in validated:
+        try:
+            object_ids.add(ObjectId(data.get('team_id')))
+        except (InvalidId, TypeError):
+            continue
+    if not object_ids:
+        return {}
+    return {
+        str(team['_id']): team['name']
+        for team in Team.objects.mongo_find({'_id': {'$in': list(object_ids)}}, {'name': 1})
+    }
+
+
+def _propagate(applied, teams):
+    """Fold the applied changes into member counters, leaderboard entries and team standings"""
+    moved = [plan for plan in applied if plan['old_team_id'] != plan['new_team_id']]
+    renamed = [plan for plan in applied if plan['name'] is not None]
+    if not moved and not renamed:
+        return
+
+    members = defaultdict(int)
+    for plan in moved:
+        if plan['old_team_id']:
+            members[plan['old_team_id']] -= 1
+        if plan['new_team_id']:
+            members[plan['new_team_id']] += 1
+    counter_updates = []
+    for team_id, delta in members.items():
+        try:
+            object_id = ObjectId(team_id)
+        except (InvalidId, TypeError):
+            continue
+        if delta:
+            counter_updates.append(UpdateOne({'_id': object_id}, {'$inc': {'member_count': delta}}))
+    if counter_updates:
+        Team.objects.mongo_bulk_write(counter_updates, ordered=False)
+
+    entries = defaultdict(dict)
+    for plan in moved:
+        entries[str(plan['_id'])].update(
+            team_id=plan['new_team_id'], team_name=teams.get(plan['new_team_id'])
+        )
+    for plan in renamed:
+        entries[str(plan['_id'])]['user_name'] = plan['name']
+    entry_updates = [
+        UpdateOne({'user_id': user_id}, {'$set': fields})
+        for user_id, fields in entries.items()
+    ]
+    Leaderboard.objects.mongo_bulk_write(entry_updates, ordered=False)
+
+    # Carry moved users' totals between team standings, one delta per team
+    totals = {
+        entry['user_id']: entry
+        for entry in Leaderboard.objects.mongo_find(
+            {'user_id': {'$in': [str(plan['_id']) for plan in moved]}},
+            {'user_id': 1, 'total_calories': 1, 'total_activities': 1},
+        )
+    }
+    standings = defaultdict(lambda: [0, 0, 0])
+    for plan in moved:
+        entry = totals.get(str(plan['_id']), {})
+        calories = entry.get('total_calories') or 0
+        activities = entry.get('total_activities') or 0
+        for team_id, sign in ((plan['old_team_id'], -1), (plan['new_team_id'], 1)):
+            if team_id:
+                standing = standings[team_id]
+                standing[0] += sign * calories
+                standing[1] += sign * activities
+                standing[2] += sign
+    for team_id, (calories, activities, count) in standings.items():
+        if calories or activities or count:
+            apply_team_delta(team_id, calories=calories, activities=activities, members=count)
+    invalidate(LEADERBOARD)
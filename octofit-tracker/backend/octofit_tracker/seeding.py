@@ -0,0 +1,71 @@
+"""
+Synthetic activity generation for production-scale test datasets.
+
+This module deliberately avoids importing Django so that ``populate_db``
+can fan activity generation out to worker processes, each inserting its
+shard of users with its own pymongo client. Every user's activities come
+from a generator seeded with ``(seed, user index)``, so a dataset is
+identical no matter how many workers produced it.
+"""
+import random
+from datetime import timedelta
+
+from pymongo import MongoClient
+
+ACTIVITY_TYPES = [
+    'Running', 'Cycling', 'Swimming', 'Weight Training',
+    'Boxing', 'Yoga', 'CrossFit', 'HIIT'
+]
+DISTANCE_TYPES = {'Running', 'Cycling', 'Swimming'}
+
+
+def generate_activities(user_id, user_name, count, rng, now):
+    """Yield ``count`` random activity documents for one user"""
+    for _ in range(count):
+        activity_type = rng.choice(ACTIVITY_TYPES)
+        duration = rng.randint(30, 120)
+        yield {
+            'user_id': user_id,
+            'activity_type': activity_type,
+            'duration': duration,
+            'calories': duration * rng.randint(8, 12),
+            'distance': round(rng.uniform(3, 15), 2) if activity_type in DISTANCE_TYPES else None,
+            'date': now - timedelta(days=rng.randint(0, 364), seconds=rng.randint(0, 86399)),
+            'notes': f'{user_name} completed {activity_type}',
+        }
+
+
+def insert_activities(insert_many, users, per_user, seed, now, batch_size):
+    """
+    Generate and insert activities for ``users`` in batches.
+
+    ``users`` is a sequence of ``(index, user_id, user_name)``. Returns
+    ``{user_id: (total_calories, total_activities)}`` computed while the
+    documents are generated, so no aggregation query is needed afterwards.
+    """
+    totals = {}
+    batch = []
+    for index, user_id, user_name in users:
+        rng = random.Random(f'{seed}:{index}')
+        calories = 0
+        for activity in generate_activities(user_id, user_name, per_user, rng, now):
+            calories += activity['calories']
+            batch.append(activity)
+            if len(batch) >= batch_size:
+                insert_many(batch, ordered=False)
+                batch = []
+        totals[user_id] = (calories, per_user)
+    if batch:
+        insert_many(batch, ordered=False)
+    return totals
+
+
+def seed_activity_shard(task):
+    """Worker entry point: insert one shard of users' activities with a private client"""
+    client_kwargs, db_name, users, per_user, seed, now, batch_size = task
+    client = MongoClient(**client_kwargs)
+    try:
+        collection = client[db_name]['activities']
+        return insert_activities(collection.insert_many, users, per_user, seed, now, batch_size)
+    finally:
+        client.close()
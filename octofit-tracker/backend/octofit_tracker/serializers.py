@@ -1,5 +1,10 @@
+from datetime import timedelta
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from django.utils.encoding import is_protected_type
 from rest_framework import serializers
-from .models import User, Team, Activity, Leaderboard, Workout
+from .models import User, Team, Activity, Leaderboard, TeamLeaderboard, Workout, Job
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -10,16 +15,11 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 class TeamSerializer(serializers.ModelSerializer):
-    member_count = serializers.SerializerMethodField()
-    
     class Meta:
         model = Team
         fields = ['_id', 'name', 'description', 'created_at', 'member_count']
-        read_only_fields = ['_id', 'created_at']
-    
-    def get_member_count(self, obj):
-        # Count users that belong to this team
-        return User.objects.filter(team_id=str(obj._id)).count()
+        # member_count is maintained by octofit_tracker.teams on membership changes
+        read_only_fields = ['_id', 'created_at', 'member_count']
 
 
 class ActivitySerializer(serializers.ModelSerializer):
@@ -28,6 +28,12 @@ class ActivitySerializer(serializers.ModelSerializer):
         fields = ['_id', 'user_id', 'activity_type', 'duration', 'calories', 'distance', 'date', 'notes']
         read_only_fields = ['_id']
 
+    def validate_date(self, value):
+        # A day of slack covers client clocks and time zones
+        if value > timezone.now() + timedelta(days=1):
+            raise serializers.ValidationError('Activity date cannot be in the future.')
+        return value
+
 
 class LeaderboardSerializer(serializers.ModelSerializer):
     class Meta:
@@ -36,8 +42,117 @@ class LeaderboardSerializer(serializers.ModelSerializer):
         read_only_fields = ['_id', 'updated_at']
 
 
+class TeamLeaderboardSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TeamLeaderboard
+        fields = [
+            '_id', 'team_id', 'team_name', 'member_count', 'total_calories',
+            'total_activities', 'average_calories', 'rank', 'updated_at'
+        ]
+        read_only_fields = fields
+
+
 class WorkoutSerializer(serializers.ModelSerializer):
     class Meta:
         model = Workout
         fields = ['_id', 'name', 'description', 'difficulty', 'duration', 'category', 'exercises']
         read_only_fields = ['_id']
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = [
+            '_id', 'name', 'args', 'status', 'attempts', 'max_attempts', 'run_at',
+            'last_error', 'created_at', 'finished_at'
+        ]
+        read_only_fields = fields
+
+
+class LeanSerializer:
+    """
+    Read-only fast path producing the same output as a ModelSerializer.
+
+    Rows are fetched with a ``.values()`` projection and converted with one
+    precomputed function per field, skipping model instantiation and DRF's
+    per-field ``get_attribute``/``to_representation`` dispatch. Only plain
+    model-backed fields are supported.
+
+    ``restrict`` narrows the output to a sparse fieldset; the projection
+    shrinks with it, so unrequested fields are never read from Mongo.
+    """
+    _cache = {}
+
+    def __init__(self, serializer_class):
+        fields = serializer_class().fields
+        self.columns = []
+        self.converters = []
+        for name, field in fields.items():
+            if isinstance(field, serializers.ModelField):
+                column = field.model_field.attname
+            elif field.source and field.source != '*' and '.' not in field.source:
+                column = field.source
+            else:
+                raise ImproperlyConfigured(
+                    f'{serializer_class.__name__}.{name} cannot be served by LeanSerializer'
+                )
+            self.columns.append(column)
+            self.converters.append((name, column, self._converter(field)))
+
+    @classmethod
+    def for_serializer(cls, serializer_class):
+        if serializer_class not in cls._cache:
+            cls._cache[serializer_class] = cls(serializer_class)
+        return cls._cache[serializer_class]
+
+    @property
+    def field_names(self):
+        return [name for name, _, _ in self.converters]
+
+    def restrict(self, fields=None, exclude=None, required=()):
+        """
+        Return a serializer emitting only ``fields`` minus ``exclude``.
+
+        ``required`` columns are still fetched (e.g. the cursor ordering
+        field) but are only emitted if they were selected.
+        """
+        unknown = (set(fields or ()) | set(exclude or ())) - set(self.field_names)
+        if unknown:
+            raise ValueError(f'Unknown fields: {", ".join(sorted(unknown))}')
+        restricted = object.__new__(LeanSerializer)
+        restricted.converters = [
+            converter for converter in self.converters
+            if (not fields or converter[0] in fields) and converter[0] not in (exclude or ())
+        ]
+        restricted.columns = [column for _, column, _ in restricted.converters]
+        restricted.columns += [
+            column for column in required
+            if column in self.columns and column not in restricted.columns
+        ]
+        return restricted
+
+    def project(self, queryset):
+        """Restrict a queryset to the serialized columns, yielding dicts"""
+        return queryset.values(*self.columns)
+
+    def to_representation(self, row):
+        return {
+            name: None if row[column] is None else convert(row[column])
+            for name, column, convert in self.converters
+        }
+
+    def serialize(self, rows):
+        return [self.to_representation(row) for row in rows]
+
+    @staticmethod
+    def _converter(field):
+        if isinstance(field, serializers.ModelField):
+            # Mirrors ModelField.to_representation / Field.value_to_string
+            return lambda value: value if is_protected_type(value) else str(value)
+        if isinstance(field, serializers.CharField):
+            return str
+        if isinstance(field, serializers.IntegerField):
+            return int
+        if isinstance(field, serializers.FloatField):
+            return float
+        return field.to_representation
@@ -55,6 +55,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'octofit_tracker.profiling.QueryProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -95,13 +96,76 @@ DATABASES = {
         'NAME': 'octofit_db',
         'ENFORCE_SCHEMA': False,
         'CLIENT': {
-            'host': 'localhost',
-            'port': 27017,
+            'host': os.getenv('MONGO_HOST', 'localhost'),
+            'port': int(os.getenv('MONGO_PORT', '27017')),
+            # Connection pool tuning; pool activity is reported by
+            # /api/health/db (see pool_metrics.py)
+            'maxPoolSize': int(os.getenv('MONGO_MAX_POOL_SIZE', '100')),
+            'minPoolSize': int(os.getenv('MONGO_MIN_POOL_SIZE', '0')),
+            'waitQueueTimeoutMS': int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '2000')),
+            'serverSelectionTimeoutMS': int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+            'connectTimeoutMS': int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', '5000')),
+            # 0 disables the socket timeout (pymongo's default)
+            'socketTimeoutMS': int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', '0')) or None,
         }
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# Leaderboard responses are cached here, see cache.py. Namespace versions are
+# kept in Mongo, so every process invalidates together; a shared backend (e.g.
+# Redis) only saves each process from rendering the same response again.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'octofit-tracker',
+    }
+}
+
+
+# Seconds a process reuses a cache namespace version (cache.py) before
+# re-reading it, i.e. how long writes from other processes may go unseen
+CACHE_VERSION_TTL = float(os.getenv('CACHE_VERSION_TTL', '1'))
+
+# Seconds before the in-process ranking index (ranking.py) is rebuilt from
+# Mongo to pick up leaderboard writes made by other processes
+RANKING_INDEX_TTL = int(os.getenv('RANKING_INDEX_TTL', '300'))
+
+# Live leaderboard stream (live.py): seconds per change-detection tick,
+# entries tracked, frames buffered per client before it is resynced, and
+# seconds between SSE keepalive comments
+LIVE_LEADERBOARD_TICK = float(os.getenv('LIVE_LEADERBOARD_TICK', '1'))
+LIVE_LEADERBOARD_LIMIT = int(os.getenv('LIVE_LEADERBOARD_LIMIT', '1000'))
+LIVE_LEADERBOARD_QUEUE = int(os.getenv('LIVE_LEADERBOARD_QUEUE', '16'))
+LIVE_LEADERBOARD_HEARTBEAT = float(os.getenv('LIVE_LEADERBOARD_HEARTBEAT', '15'))
+
+# Background jobs (jobs.py): worker threads per process, whether the worker
+# starts in-process on the first enqueue, queue poll interval, seconds before
+# a running job is considered abandoned, and the base retry backoff
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+JOBS_AUTOSTART = os.getenv('JOBS_AUTOSTART', '1') == '1'
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '5'))
+JOB_LOCK_TIMEOUT = int(os.getenv('JOB_LOCK_TIMEOUT', '600'))
+JOB_RETRY_BACKOFF = float(os.getenv('JOB_RETRY_BACKOFF', '2'))
+
+# Per-request query profiling (profiling.py): Server-Timing headers plus a
+# slow-query log for commands above the threshold and for requests issuing
+# more round trips than SLOW_REQUEST_ROUND_TRIPS
+QUERY_PROFILING = os.getenv('QUERY_PROFILING', '1') == '1'
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', '100'))
+SLOW_REQUEST_ROUND_TRIPS = int(os.getenv('SLOW_REQUEST_ROUND_TRIPS', '20'))
+
+# Connection pool (and matching executor size) of the Mongo client behind
+# the async read path, see async_views.py
+ASYNC_MONGO_POOL = {
+    'maxPoolSize': int(os.getenv('ASYNC_MONGO_MAX_POOL_SIZE', '100')),
+    'minPoolSize': int(os.getenv('ASYNC_MONGO_MIN_POOL_SIZE', '0')),
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -143,6 +207,19 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Django REST framework
+# Every list route and list-style @action is cursor paginated, see pagination.py.
+# LeanJSONRenderer uses orjson when it is installed (optional).
+
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'octofit_tracker.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
+    'DEFAULT_RENDERER_CLASSES': [
+        'octofit_tracker.renderers.LeanJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_METHODS = [
@@ -0,0 +1,27 @@
+"""
+Application signals.
+
+``activities_changed`` is sent after activities are created, updated or
+deleted, with the affected ``Activity`` instances as ``added`` and
+``removed`` (an update is a removal of the old values plus an addition of
+the new ones). Aggregates derived from activities subscribe to it instead
+of being called from every write path.
+
+``membership_changed`` is sent when a user joins, leaves or switches teams,
+with ``None`` standing for "no team".
+"""
+from django.dispatch import Signal
+
+activities_changed = Signal()
+membership_changed = Signal()
+
+
+def send_activities_changed(added=(), removed=()):
+    activities_changed.send(sender=None, added=list(added), removed=list(removed))
+
+
+def send_membership_changed(user_id, old_team_id, new_team_id):
+    if old_team_id != new_team_id:
+        membership_changed.send(
+            sender=None, user_id=user_id, old_team_id=old_team_id, new_team_id=new_team_id
+        )
@@ -0,0 +1,86 @@
+"""
+Activity statistics computed inside Mongo.
+
+Totals, averages and the per-type breakdown are produced by a single
+aggregation pipeline (``$match`` then ``$facet``), so only a few hundred
+bytes of results leave the database regardless of how many activities
+match.
+"""
+from datetime import timezone
+
+from .models import User, Activity
+
+
+def activity_stats(user_id=None, team_id=None, activity_type=None, start=None, end=None):
+    """Return totals, averages and a per-type breakdown for the matching activities"""
+    match = {}
+    if user_id:
+        match['user_id'] = user_id
+    if team_id:
+        members = User.objects.mongo_find({'team_id': team_id}, {'_id': 1})
+        member_ids = [str(member['_id']) for member in members]
+        if user_id:
+            match['user_id'] = user_id if user_id in member_ids else {'$in': []}
+        else:
+            match['user_id'] = {'$in': member_ids}
+    if activity_type:
+        match['activity_type'] = activity_type
+    if start or end:
+        match['date'] = {}
+        if start:
+            match['date']['$gte'] = start
+        if end:
+            match['date']['$lt'] = end
+
+    sums = {
+        'count': {'$sum': 1},
+        'total_calories': {'$sum': '$calories'},
+        'total_duration': {'$sum': '$duration'},
+        'total_distance': {'$sum': {'$ifNull': ['$distance', 0]}},
+    }
+    result = next(Activity.objects.mongo_aggregate([
+        {'$match': match},
+        {'$facet': {
+            'totals': [{'$group': {
+                '_id': None,
+                **sums,
+                'avg_calories': {'$avg': '$calories'},
+                'avg_duration': {'$avg': '$duration'},
+                'first_date': {'$min': '$date'},
+                'last_date': {'$max': '$date'},
+            }}],
+            'by_type': [
+                {'$group': {'_id': '$activity_type', **sums}},
+                {'$sort': {'total_calories': -1, '_id': 1}},
+            ],
+        }},
+    ]))
+
+    totals = result['totals'][0] if result['totals'] else {}
+    return {
+        'count': totals.get('count', 0),
+        'total_calories': totals.get('total_calories', 0),
+        'total_duration': totals.get('total_duration', 0),
+        'total_distance': round(totals.get('total_distance', 0), 2),
+        'avg_calories': round(totals.get('avg_calories') or 0, 1),
+        'avg_duration': round(totals.get('avg_duration') or 0, 1),
+        'first_date': _as_utc(totals.get('first_date')),
+        'last_date': _as_utc(totals.get('last_date')),
+        'by_type': [
+            {
+                'activity_type': row['_id'],
+                'count': row['count'],
+                'total_calories': row['total_calories'],
+                'total_duration': row['total_duration'],
+                'total_distance': round(row['total_distance'], 2),
+            }
+            for row in result['by_type']
+        ],
+    }
+
+
+def _as_utc(value):
+    # pymongo returns naive datetimes that are already UTC
+    if value is None or value.tzinfo is not None:
+        return value
+    return value.replace(tzinfo=timezone.utc)
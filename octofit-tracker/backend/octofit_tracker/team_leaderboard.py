@@ -0,0 +1,177 @@
+"""
+Incremental team standings.
+
+``TeamLeaderboard`` holds one document per team with its member count, the
+calorie and activity totals of its current members, calories per member
+and a competition rank on total calories. Activity changes are folded in as
+per-team deltas, and a user switching teams carries their leaderboard
+totals from the old team to the new one, so standings are never computed
+by iterating users. As for users, only the slice of teams between a
+team's old and new total is re-ranked (see competition.py).
+"""
+from collections import Counter, defaultdict
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import LEADERBOARD, invalidate
+from .competition import competition_ranks, increment, rank_for, rerank_entry
+from .jobs import task
+from .leaderboard import activity_deltas
+from .models import Team, Leaderboard, TeamLeaderboard
+from .rebuild import replace_collection
+from .signals import activities_changed, membership_changed
+from .teams import get_team, team_ids_for
+
+
+def apply_activity_changes(added=(), removed=()):
+    """Apply the effect of added/removed activities to the team standings"""
+    deltas = activity_deltas(added, removed)
+    teams = team_ids_for(deltas)
+    team_deltas = defaultdict(lambda: [0, 0])
+    for user_id, (calories, count) in deltas.items():
+        team_id = teams.get(user_id)
+        if team_id:
+            team_deltas[team_id][0] += calories
+            team_deltas[team_id][1] += count
+    for team_id, (calories, count) in team_deltas.items():
+        apply_team_delta(team_id, calories=calories, activities=count)
+    if team_deltas:
+        invalidate(LEADERBOARD)
+
+
+def move_member_totals(user_id, old_team_id, new_team_id):
+    """Carry a user's leaderboard totals and membership from one team to another"""
+    if old_team_id == new_team_id:
+        return
+    entry = Leaderboard.objects.mongo_find_one(
+        {'user_id': user_id}, {'total_calories': 1, 'total_activities': 1}
+    ) or {}
+    calories = entry.get('total_calories') or 0
+    activities = entry.get('total_activities') or 0
+    if old_team_id:
+        apply_team_delta(old_team_id, calories=-calories, activities=-activities, members=-1)
+    if new_team_id:
+        apply_team_delta(new_team_id, calories=calories, activities=activities, members=1)
+    invalidate(LEADERBOARD)
+
+
+def apply_team_delta(team_id, calories=0, activities=0, members=0):
+    """Add calories/activities/member deltas to one team's standing; leaves the cache to the caller"""
+    entry = _increment(team_id, calories, activities, members)
+    if entry is None:
+        if _create_entry(team_id) is None:
+            return
+        entry = _increment(team_id, calories, activities, members)
+
+    old_total = entry.get('total_calories') or 0
+    new_total = old_total + calories
+    member_count = (entry.get('member_count') or 0) + members
+    rerank_entry(
+        TeamLeaderboard, 'team_id', team_id, old_total, new_total,
+        fields={'average_calories': _average(new_total, member_count)},
+    )
+
+
+def remove_team(team_id):
+    """Drop a team's standing and close the gap it leaves in the ranks"""
+    entry = TeamLeaderboard.objects.mongo_find_one_and_delete({'team_id': team_id})
+    if entry is None:
+        return
+    TeamLeaderboard.objects.mongo_update_many(
+        {'total_calories': {'$lt': entry.get('total_calories') or 0}},
+        {'$inc': {'rank': -1}},
+    )
+    invalidate(LEADERBOARD)
+
+
+@task('team_leaderboard.rebuild')
+def rebuild_team_leaderboard():
+    """
+    Recompute every team's standing from the user leaderboard.
+
+    Totals come from one ``$group`` over ``leaderboard``, member counts from
+    ``Team.member_count``; the standings are swapped in with
+    ``replace_collection``, so readers never see them empty.
+    """
+    totals = {
+        row['_id']: row
+        for row in Leaderboard.objects.mongo_aggregate([
+            {'$match': {'team_id': {'$ne': None}}},
+            {'$group': {
+                '_id': '$team_id',
+                'total_calories': {'$sum': '$total_calories'},
+                'total_activities': {'$sum': '$total_activities'},
+            }},
+        ])
+    }
+    standings = []
+    for team in Team.objects.mongo_find({}, {'name': 1, 'member_count': 1}):
+        team_id = str(team['_id'])
+        row = totals.get(team_id, {})
+        member_count = team.get('member_count') or 0
+        standings.append({
+            'team_id': team_id,
+            'team_name': team['name'],
+            'member_count': member_count,
+            'total_calories': row.get('total_calories', 0),
+            'total_activities': row.get('total_activities', 0),
+            'average_calories': _average(row.get('total_calories', 0), member_count),
+        })
+    ranks = competition_ranks(Counter(standing['total_calories'] for standing in standings))
+    for standing in standings:
+        standing['rank'] = ranks[standing['total_calories']]
+    standings.sort(key=lambda standing: standing['rank'])
+
+    replace_collection(TeamLeaderboard, standings)
+    invalidate(LEADERBOARD)
+    return len(standings)
+
+
+def _increment(team_id, calories, activities, members):
+    return increment(
+        TeamLeaderboard, 'team_id', team_id,
+        {'total_calories': calories, 'total_activities': activities, 'member_count': members},
+        {'total_calories': 1, 'member_count': 1},
+    )
+
+
+def _average(total_calories, member_count):
+    return round(total_calories / member_count, 2) if member_count > 0 else 0.0
+
+
+def _create_entry(team_id, team=None):
+    team = team or get_team(team_id)
+    if team is None:
+        return None
+    return TeamLeaderboard.objects.create(
+        team_id=team_id,
+        team_name=team.name,
+        member_count=0,
+        total_calories=0,
+        total_activities=0,
+        average_calories=0.0,
+        rank=rank_for(TeamLeaderboard, 0),
+    )
+
+
+@receiver(activities_changed)
+def activities_changed_receiver(sender, added=(), removed=(), **kwargs):
+    apply_activity_changes(added, removed)
+
+
+@receiver(membership_changed)
+def membership_changed_receiver(sender, user_id, old_team_id, new_team_id, **kwargs):
+    move_member_totals(user_id, old_team_id, new_team_id)
+
+
+@receiver(post_save, sender=Team)
+def team_saved(sender, instance, created, **kwargs):
+    if created:
+        _create_entry(str(instance._id), instance)
+        invalidate(LEADERBOARD)
+
+
+@receiver(post_delete, sender=Team)
+def team_deleted(sender, instance, **kwargs):
+    remove_team(str(instance._id))
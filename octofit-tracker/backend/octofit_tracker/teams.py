@@ -0,0 +1,86 @@
+"""
+Team membership bookkeeping.
+
+``Team.member_count`` is a denormalized counter kept current whenever a user
+joins, leaves or switches teams, so team listings can report member counts
+without counting the ``users`` collection once per team. Teams stored before
+the counter existed are backfilled with ``recount_members`` (``manage.py
+recount_members`` or the ``teams.recount_members`` job).
+"""
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.dispatch import receiver
+from pymongo import UpdateOne
+
+from .jobs import task
+from .models import User, Team
+from .signals import membership_changed
+
+
+def move_member(old_team_id, new_team_id):
+    """Record a user leaving ``old_team_id`` and joining ``new_team_id``"""
+    if old_team_id == new_team_id:
+        return
+    if old_team_id:
+        adjust_member_count(old_team_id, -1)
+    if new_team_id:
+        adjust_member_count(new_team_id, 1)
+
+
+def adjust_member_count(team_id, delta):
+    """Add ``delta`` to a team's member counter"""
+    try:
+        object_id = ObjectId(team_id)
+    except (InvalidId, TypeError):
+        return
+    Team.objects.mongo_update_one({'_id': object_id}, {'$inc': {'member_count': delta}})
+
+
+@task('teams.recount_members')
+def recount_members():
+    """Recompute every team's member counter with one grouped aggregation"""
+    counts = {
+        row['_id']: row['count']
+        for row in User.objects.mongo_aggregate([
+            {'$match': {'team_id': {'$ne': None}}},
+            {'$group': {'_id': '$team_id', 'count': {'$sum': 1}}},
+        ])
+    }
+    updates = [
+        UpdateOne(
+            {'_id': team['_id']},
+            {'$set': {'member_count': counts.get(str(team['_id']), 0)}}
+        )
+        for team in Team.objects.mongo_find({}, {'_id': 1})
+    ]
+    if updates:
+        Team.objects.mongo_bulk_write(updates, ordered=False)
+    return len(updates)
+
+
+def get_team(team_id):
+    """Return the team for a string id, or ``None``"""
+    try:
+        object_id = ObjectId(team_id)
+    except (InvalidId, TypeError):
+        return None
+    return Team.objects.filter(_id=object_id).first()
+
+
+def team_ids_for(user_ids):
+    """Return ``{user_id: team_id}`` for the given users in one query"""
+    object_ids = []
+    for user_id in user_ids:
+        try:
+            object_ids.append(ObjectId(user_id))
+        except (InvalidId, TypeError):
+            continue
+    return {
+        str(user['_id']): user.get('team_id')
+        for user in User.objects.mongo_find({'_id': {'$in': object_ids}}, {'team_id': 1})
+    }
+
+
+@receiver(membership_changed)
+def membership_changed_receiver(sender, user_id, old_team_id, new_team_id, **kwargs):
+    move_member(old_team_id, new_team_id)
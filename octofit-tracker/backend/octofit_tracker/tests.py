@@ -1,9 +1,61 @@
-from django.test import TestCase
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from django.urls import reverse
-from .models import User, Team, Activity, Leaderboard, Workout
-from datetime import datetime, timezone
+from .models import (
+    User, Team, Activity, Leaderboard, TeamLeaderboard, Workout, ActivityRollup, ActivityProfile, Job,
+    CacheVersion,
+)
+from .pool_metrics import PoolMetrics
+from .profiling import QueryProfilingMiddleware, command_profiler
+from .benchmark import compare, percentile
+from .cache import CATALOG, LEADERBOARD
+from .catalog import CatalogSnapshot
+from .denormalize import sync_denormalized_names
+from .export import _csv_chunks, export_filter
+from .indexes import INDEXED_MODELS, ensure_indexes, missing_indexes, unindexed_shapes
+from .ingest import iter_json_array
+from .jobs import TASKS, Heartbeat, enqueue, run_pending, task
+from .leaderboard import apply_delta, rerank
+from .management.commands.export_activities import resume_point
+from .live import LeaderboardHub, diff_entries, live_leaderboard
+from .ranking import RankIndex, ranking
+from .competition import competition_ranks
+from .rebuild import rebuild_leaderboard
+from .recommendations import WorkoutMatrix, activity_weight, apply_activity_changes, user_features
+from .rollups import period_start, rebuild_rollups
+from . import roster
+from .roster import UserBatchItemSerializer, apply_user_batch
+from .team_leaderboard import rebuild_team_leaderboard
+from .renderers import LeanJSONRenderer
+from .serializers import (
+    UserSerializer,
+    TeamSerializer,
+    ActivitySerializer,
+    LeaderboardSerializer,
+    WorkoutSerializer,
+    LeanSerializer
+)
+from datetime import datetime, timedelta, timezone
+from io import BytesIO, StringIO
+import asyncio
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from unittest import mock
+from bson import ObjectId
+from pymongo import monitoring
+from pymongo.errors import DuplicateKeyError
+from rest_framework.renderers import JSONRenderer
 
 
 class UserModelTest(TestCase):
@@ -124,6 +176,56 @@ class TeamAPITest(APITestCase):
         response = self.client.post(url, data)
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def test_member_count_follows_membership_changes(self):
+        """Test that member_count is kept current as users join and leave"""
+        other_team = Team.objects.create(name="Other Team")
+        url = reverse('user-list')
+        response = self.client.post(url, {
+            'name': 'Member',
+            'email': 'member@example.com',
+            'team_id': str(self.team._id)
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.team.refresh_from_db()
+        self.assertEqual(self.team.member_count, 1)
+
+        url = reverse('user-detail', args=[response.data['_id']])
+        self.client.patch(url, {'team_id': str(other_team._id)})
+        self.team.refresh_from_db()
+        other_team.refresh_from_db()
+        self.assertEqual(self.team.member_count, 0)
+        self.assertEqual(other_team.member_count, 1)
+
+        self.client.delete(url)
+        other_team.refresh_from_db()
+        self.assertEqual(other_team.member_count, 0)
+
+    def test_recount_backfills_missing_counters(self):
+        """Test that recount_members fills member_count on teams stored without it"""
+        User.objects.create(name="Member", email="member@example.com", team_id=str(self.team._id))
+        Team.objects.mongo_update_one({'_id': self.team._id}, {'$unset': {'member_count': ''}})
+        call_command('recount_members', stdout=StringIO())
+        response = self.client.get(reverse('team-detail', args=[self.team._id]))
+        self.assertEqual(response.data['member_count'], 1)
+
+    def test_team_list_query_count_is_constant(self):
+        """Test that listing teams does not issue a query per team"""
+        url = reverse('team-list')
+        with CaptureQueriesContext(connection) as few_teams:
+            self.client.get(url)
+
+        for i in range(10):
+            team = Team.objects.create(name=f"Team {i}")
+            User.objects.create(
+                name=f"User {i}",
+                email=f"user{i}@example.com",
+                team_id=str(team._id)
+            )
+        with CaptureQueriesContext(connection) as many_teams:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(many_teams), len(few_teams))
+
 
 class ActivityAPITest(APITestCase):
     """Test cases for Activity API endpoints"""
@@ -156,6 +258,208 @@ class ActivityAPITest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
+class ActivityStatsTest(APITestCase):
+    """Test cases for the activity statistics endpoint"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.team = Team.objects.create(name="Test Team")
+        self.user = User.objects.create(
+            name="Test User",
+            email="test@example.com",
+            team_id=str(self.team._id)
+        )
+        now = datetime.now(timezone.utc)
+        for activity_type, calories, distance, days_ago in [
+            ("Running", 300, 5.0, 1),
+            ("Running", 500, 8.0, 2),
+            ("Yoga", 100, None, 40),
+        ]:
+            Activity.objects.create(
+                user_id=str(self.user._id),
+                activity_type=activity_type,
+                duration=30,
+                calories=calories,
+                distance=distance,
+                date=now - timedelta(days=days_ago)
+            )
+        self.url = reverse('activity-stats')
+
+    def test_user_stats(self):
+        """Test totals, averages and per-type breakdown for a user"""
+        response = self.client.get(self.url, {'user_id': str(self.user._id)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(response.data['total_calories'], 900)
+        self.assertEqual(response.data['total_distance'], 13.0)
+        self.assertEqual(response.data['avg_calories'], 300.0)
+        by_type = {row['activity_type']: row for row in response.data['by_type']}
+        self.assertEqual(by_type['Running']['count'], 2)
+        self.assertEqual(by_type['Yoga']['total_calories'], 100)
+
+    def test_team_stats_with_date_range(self):
+        """Test team scoping combined with a date range"""
+        start = (datetime.now(timezone.utc) - timedelta(days=7)).date().isoformat()
+        response = self.client.get(self.url, {'team_id': str(self.team._id), 'start': start})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual([row['activity_type'] for row in response.data['by_type']], ['Running'])
+
+    def test_requires_a_filter(self):
+        """Test that an unscoped request is rejected"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(JOBS_AUTOSTART=False)
+class BulkIngestTest(APITestCase):
+    """Test cases for streaming bulk activity ingestion"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(
+            name="Test User",
+            email="test@example.com"
+        )
+        self.url = reverse('activity-bulk')
+
+    def activity(self, calories):
+        return {
+            'user_id': str(self.user._id),
+            'activity_type': 'Cycling',
+            'duration': 45,
+            'calories': calories,
+            'date': datetime.now(timezone.utc).isoformat()
+        }
+
+    def test_ndjson_reports_per_record_errors(self):
+        """Test that valid lines are inserted and invalid ones reported by index"""
+        lines = [
+            json.dumps(self.activity(100)),
+            json.dumps(self.activity(200)),
+            'not json',
+            json.dumps({'user_id': str(self.user._id)}),
+            json.dumps(self.activity(300)),
+        ]
+        response = self.client.post(
+            self.url, '\n'.join(lines), content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual([error['index'] for error in response.data['errors']], [2, 3])
+        self.assertEqual(Activity.objects.count(), 3)
+
+        run_pending()
+        entry = Leaderboard.objects.get(user_id=str(self.user._id))
+        self.assertEqual(entry.total_calories, 600)
+        self.assertEqual(entry.total_activities, 3)
+
+    def test_json_array(self):
+        """Test ingesting a JSON array of activities"""
+        payload = [self.activity(50) for _ in range(10)]
+        response = self.client.post(
+            self.url, json.dumps(payload), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {'created': 10, 'errors': []})
+        self.assertEqual(Activity.objects.count(), 10)
+
+    def test_json_array_is_read_in_chunks(self):
+        """Test that array elements split across read chunks are decoded"""
+        payload = [self.activity(calories) for calories in range(5)]
+        stream = BytesIO(json.dumps(payload).encode())
+        records = [record for _, record in iter_json_array(stream, chunk_size=7)]
+        self.assertEqual(records, payload)
+
+    def test_json_array_numbers_split_across_chunks(self):
+        """Test that a number cut at a chunk boundary is decoded whole"""
+        payload = [1e300, -1.5e-10, 12345]
+        for chunk_size in range(1, 8):
+            stream = BytesIO(json.dumps(payload).encode())
+            self.assertEqual([record for _, record in iter_json_array(stream, chunk_size)], payload)
+
+    def test_malformed_element_stops_reading(self):
+        """Test that a bad array element fails without buffering the rest of the body"""
+        stream = BytesIO(b'[{"calories": 1}, {"calories": tru e}, ' + b'{"calories": 1}, ' * 10000 + b'{}]')
+        with self.assertRaises(ValueError):
+            list(iter_json_array(stream, chunk_size=64))
+        self.assertLess(stream.tell(), 1024)
+
+    def test_empty_body(self):
+        """Test that an empty body is handled by both parsers instead of erroring"""
+        response = self.client.post(self.url, '', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.url, '', content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {'created': 0, 'errors': []})
+
+
+class CursorPaginationTest(APITestCase):
+    """Test cases for cursor pagination on list routes and actions"""
+
+    def setUp(self):
+        self.client = APIClient()
+        now = datetime.now(timezone.utc)
+        for day in range(5):
+            Activity.objects.create(
+                user_id="123",
+                activity_type="Running",
+                duration=30,
+                calories=300,
+                date=now - timedelta(days=day)
+            )
+
+    def collect_pages(self, url, params):
+        results = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            results.extend(response.data['results'])
+            if not response.data['next']:
+                return results
+            response = self.client.get(response.data['next'])
+
+    def test_list_pages_follow_date_order(self):
+        """Test that walking the cursor returns every activity newest first"""
+        results = self.collect_pages(reverse('activity-list'), {'page_size': 2})
+        self.assertEqual(len(results), 5)
+        self.assertEqual(len({row['_id'] for row in results}), 5)
+        dates = [row['date'] for row in results]
+        self.assertEqual(dates, sorted(dates, reverse=True))
+
+    def test_actions_are_paginated(self):
+        """Test that custom actions return cursor pages"""
+        url = reverse('activity-by-user')
+        results = self.collect_pages(url, {'user_id': '123', 'page_size': 2})
+        self.assertEqual(len(results), 5)
+
+    def test_ties_are_paged_by_id(self):
+        """Test that rows sharing the ordering value are neither skipped nor repeated"""
+        tied = datetime(2024, 6, 1, tzinfo=timezone.utc)
+        for _ in range(5):
+            Activity.objects.create(
+                user_id="123", activity_type="Running", duration=30, calories=300, date=tied
+            )
+        results = self.collect_pages(reverse('activity-list'), {'page_size': 2})
+        self.assertEqual(len(results), 10)
+        self.assertEqual(len({row['_id'] for row in results}), 10)
+
+    def test_previous_link_returns_the_same_page(self):
+        """Test that following next then previous lands on the first page again"""
+        first = self.client.get(reverse('activity-list'), {'page_size': 2})
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(
+            [row['_id'] for row in back.data['results']],
+            [row['_id'] for row in first.data['results']]
+        )
+
+    def test_malformed_cursor_is_not_found(self):
+        """Test that a cursor that does not decode is a 404"""
+        response = self.client.get(reverse('activity-list'), {'cursor': 'bm9wZQ=='})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
 class LeaderboardAPITest(APITestCase):
     """Test cases for Leaderboard API endpoints"""
 
@@ -207,3 +511,1450 @@ class WorkoutAPITest(APITestCase):
         url = reverse('workout-by-difficulty')
         response = self.client.get(url, {'difficulty': 'beginner'})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class LeaderboardEngineTest(APITestCase):
+    """Test cases for incremental leaderboard maintenance"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.team = Team.objects.create(name="Test Team")
+        self.alice = User.objects.create(
+            name="Alice",
+            email="alice@example.com",
+            team_id=str(self.team._id)
+        )
+        self.bob = User.objects.create(
+            name="Bob",
+            email="bob@example.com",
+            team_id=str(self.team._id)
+        )
+
+    def post_activity(self, user, calories):
+        url = reverse('activity-list')
+        data = {
+            'user_id': str(user._id),
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories': calories,
+            'date': datetime.now(timezone.utc).isoformat()
+        }
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['_id']
+
+    def entry(self, user):
+        return Leaderboard.objects.get(user_id=str(user._id))
+
+    def test_create_activity_creates_entry(self):
+        """Test that the first activity creates a denormalized leaderboard entry"""
+        self.post_activity(self.alice, 500)
+        entry = self.entry(self.alice)
+        self.assertEqual(entry.user_name, "Alice")
+        self.assertEqual(entry.team_name, "Test Team")
+        self.assertEqual(entry.total_calories, 500)
+        self.assertEqual(entry.total_activities, 1)
+        self.assertEqual(entry.rank, 1)
+
+    def test_ranks_follow_updates_and_deletes(self):
+        """Test that activity updates and deletes re-rank the affected entries"""
+        alice_activity = self.post_activity(self.alice, 500)
+        bob_activity = self.post_activity(self.bob, 800)
+        self.assertEqual(self.entry(self.bob).rank, 1)
+        self.assertEqual(self.entry(self.alice).rank, 2)
+
+        url = reverse('activity-detail', args=[bob_activity])
+        response = self.client.patch(url, {'calories': 100})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.entry(self.bob).total_calories, 100)
+        self.assertEqual(self.entry(self.alice).rank, 1)
+        self.assertEqual(self.entry(self.bob).rank, 2)
+
+        url = reverse('activity-detail', args=[alice_activity])
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        alice = self.entry(self.alice)
+        self.assertEqual(alice.total_calories, 0)
+        self.assertEqual(alice.total_activities, 0)
+        self.assertEqual(alice.rank, 2)
+        self.assertEqual(self.entry(self.bob).rank, 1)
+
+    def test_concurrent_first_activities_share_one_entry(self):
+        """Test that racing first deltas for a user upsert a single entry"""
+        ensure_indexes(Leaderboard)
+        user_id = str(self.alice._id)
+        threads = [threading.Thread(target=apply_delta, args=(user_id, 100, 1)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(Leaderboard.objects.mongo_count_documents({'user_id': user_id}), 1)
+        self.assertEqual(self.entry(self.alice).total_calories, 400)
+
+    def test_rerank_recomputes_every_rank(self):
+        """Test that a full rerank restores competition ranks from the stored totals"""
+        self.post_activity(self.alice, 500)
+        self.post_activity(self.bob, 500)
+        Leaderboard.objects.mongo_update_many({}, {'$set': {'rank': 99}})
+        self.assertEqual(rerank(), 2)
+        self.assertEqual((self.entry(self.alice).rank, self.entry(self.bob).rank), (1, 1))
+
+
+class IndexPlanTest(TestCase):
+    """Test cases for declared Mongo indexes and view query plans"""
+
+    def setUp(self):
+        for model in INDEXED_MODELS:
+            ensure_indexes(model)
+
+    def test_declared_indexes_exist(self):
+        """Test that every declared index is present after ensure_indexes"""
+        for model in INDEXED_MODELS:
+            self.assertEqual(missing_indexes(model), {})
+
+    def test_view_query_shapes_are_indexed(self):
+        """Test that no view query shape needs a collection scan or in-memory sort"""
+        self.assertEqual(unindexed_shapes(), [])
+
+    def test_check_command_passes(self):
+        """Test that ensure_indexes --check succeeds once indexes exist"""
+        call_command('ensure_indexes', '--check', stdout=StringIO())
+
+    def test_index_with_stale_keys_is_replaced(self):
+        """Test that a declared name bound to other keys is rebuilt as a partial unique index"""
+        Job.objects.mongo_drop_index('jobs_pending_key_uniq')
+        Job.objects.mongo_create_index(
+            [('WHERE "status" = pending', 1)], name='jobs_pending_key_uniq', unique=True,
+        )
+        self.assertEqual(ensure_indexes(Job), ['jobs_pending_key_uniq'])
+        info = Job.objects.mongo_index_information()['jobs_pending_key_uniq']
+        self.assertEqual(info['key'], [('key', 1)])
+        self.assertEqual(info['partialFilterExpression'], {'status': 'pending'})
+
+
+class PopulateScaledTest(TestCase):
+    """Test cases for the scaled populate_db mode"""
+
+    def populate(self, **options):
+        call_command(
+            'populate_db', users=20, teams=3, activities_per_user=4, seed=7,
+            batch_size=7, stdout=StringIO(), **options
+        )
+
+    def test_scaled_dataset(self):
+        """Test that the scaled mode seeds consistent collections and aggregates"""
+        self.populate()
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Activity.objects.count(), 80)
+        self.assertEqual(Leaderboard.objects.count(), 20)
+        self.assertEqual(sum(team.member_count for team in Team.objects.all()), 20)
+
+        entries = list(Leaderboard.objects.order_by('rank'))
+        self.assertEqual(entries[0].rank, 1)
+        totals = [entry.total_calories for entry in entries]
+        self.assertEqual(totals, sorted(totals, reverse=True))
+        for entry in entries[:3]:
+            calories = sum(a.calories for a in Activity.objects.filter(user_id=entry.user_id))
+            self.assertEqual(entry.total_calories, calories)
+
+    def test_workers_produce_the_same_totals(self):
+        """Test that fanning out to worker processes does not change the dataset"""
+        self.populate()
+        single = sorted(Leaderboard.objects.values_list('user_name', 'total_calories'))
+        self.populate(workers=2)
+        self.assertEqual(sorted(Leaderboard.objects.values_list('user_name', 'total_calories')), single)
+
+
+class LeaderboardCacheTest(APITestCase):
+    """Test cases for cached leaderboard responses"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create(
+            name="Test User",
+            email="test@example.com"
+        )
+        Leaderboard.objects.create(
+            user_id=str(self.user._id),
+            user_name="Test User",
+            total_calories=1000,
+            total_activities=10,
+            rank=1
+        )
+        self.url = reverse('leaderboard-list')
+
+    def test_repeated_reads_are_served_from_cache(self):
+        """Test that a repeated request does not query the database"""
+        first = self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(self.url)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_if_none_match_returns_304(self):
+        """Test that a matching ETag yields 304 Not Modified"""
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_activity_write_invalidates(self):
+        """Test that an activity write changes the cached leaderboard"""
+        etag = self.client.get(self.url)['ETag']
+        self.client.post(reverse('activity-list'), {
+            'user_id': str(self.user._id),
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories': 250,
+            'date': datetime.now(timezone.utc).isoformat()
+        })
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['results'][0]['total_calories'], 1250)
+
+    @override_settings(CACHE_VERSION_TTL=0)
+    def test_version_bumped_by_another_process_invalidates(self):
+        """Test that a version moved directly in Mongo stops 304s and cache hits"""
+        etag = self.client.get(self.url)['ETag']
+        Leaderboard.objects.mongo_update_one({'user_id': str(self.user._id)}, {'$set': {'total_calories': 2000}})
+        CacheVersion.objects.mongo_update_one({'namespace': LEADERBOARD}, {'$inc': {'version': 1}})
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['total_calories'], 2000)
+
+
+class RankIndexTest(SimpleTestCase):
+    """Test cases for the order-statistics ranking index"""
+
+    def test_matches_sorted_order(self):
+        """Test ranks, slices and neighbours against a brute-force sort"""
+        rng = random.Random(42)
+        index = RankIndex()
+        totals = {}
+        for _ in range(2000):
+            user_id = f"user{rng.randint(0, 100)}"
+            if user_id in totals and rng.random() < 0.1:
+                index.remove(user_id)
+                del totals[user_id]
+            else:
+                totals[user_id] = rng.randint(0, 40)
+                index.update(user_id, totals[user_id])
+
+        expected = sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+        self.assertEqual(index.top(len(totals)), expected)
+        for position, (user_id, total) in enumerate(expected):
+            higher = sum(1 for other in totals.values() if other > total)
+            self.assertEqual(index.rank(user_id), higher + 1)
+            self.assertEqual(index.around(user_id, 2), expected[max(position - 2, 0):position + 3])
+
+
+class RankingAPITest(APITestCase):
+    """Test cases for leaderboard endpoints served by the ranking index"""
+
+    def setUp(self):
+        cache.clear()
+        ranking.reset()
+        self.client = APIClient()
+        for i, calories in enumerate([500, 900, 700, 700, 100]):
+            Leaderboard.objects.create(
+                user_id=f"user{i}",
+                user_name=f"User {i}",
+                total_calories=calories,
+                total_activities=1
+            )
+
+    def test_top_users(self):
+        """Test that top_users is ordered by calories with shared ranks for ties"""
+        response = self.client.get(reverse('leaderboard-top-users'), {'limit': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['total_calories'] for row in response.data], [900, 700, 700])
+        self.assertEqual([row['rank'] for row in response.data], [1, 2, 2])
+
+    def test_rank_of_user(self):
+        """Test looking up a single user's rank"""
+        response = self.client.get(reverse('leaderboard-rank'), {'user_id': 'user0'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['rank'], 4)
+        self.assertEqual(response.data['total_users'], 5)
+
+        response = self.client.get(reverse('leaderboard-rank'), {'user_id': 'missing'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_users_around(self):
+        """Test fetching the users ranked next to a user"""
+        response = self.client.get(reverse('leaderboard-around'), {'user_id': 'user0', 'radius': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['total_calories'] for row in response.data], [700, 500, 100])
+
+    def test_limit_and_radius_are_validated(self):
+        """Test that non-integer limits are 400s and negative ones are clamped to 1"""
+        url = reverse('leaderboard-top-users')
+        self.assertEqual(self.client.get(url, {'limit': 'abc'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(self.client.get(url, {'limit': -3}).data), 1)
+
+        url = reverse('leaderboard-around')
+        response = self.client.get(url, {'user_id': 'user0', 'radius': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(url, {'user_id': 'user0', 'radius': -2})
+        self.assertEqual([row['total_calories'] for row in response.data], [700, 500, 100])
+
+
+class PeriodStartTest(SimpleTestCase):
+    """Test cases for rollup bucket boundaries"""
+
+    def test_bucket_starts(self):
+        """Test day, ISO week and month bucket starts in UTC"""
+        date = datetime(2024, 5, 16, 23, 30, tzinfo=timezone(timedelta(hours=-2)))
+        self.assertEqual(period_start(date, 'day'), datetime(2024, 5, 17, tzinfo=timezone.utc))
+        self.assertEqual(period_start(date, 'week'), datetime(2024, 5, 13, tzinfo=timezone.utc))
+        self.assertEqual(period_start(date, 'month'), datetime(2024, 5, 1, tzinfo=timezone.utc))
+
+
+class WindowedLeaderboardTest(APITestCase):
+    """Test cases for time-windowed leaderboards served from rollups"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.team = Team.objects.create(name="Test Team")
+        self.users = [
+            User.objects.create(name=name, email=f"{name}@example.com", team_id=str(self.team._id))
+            for name in ("alice", "bob")
+        ]
+        now = datetime.now(timezone.utc)
+        self.post_activity(self.users[0], 300, now)
+        self.post_activity(self.users[1], 200, now)
+        self.post_activity(self.users[1], 900, now - timedelta(days=60))
+
+    def post_activity(self, user, calories, date):
+        response = self.client.post(reverse('activity-list'), {
+            'user_id': str(user._id),
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories': calories,
+            'distance': 5.0,
+            'date': date.isoformat()
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_rollups_are_maintained(self):
+        """Test that each activity lands in a day, week and month rollup"""
+        self.assertEqual(
+            ActivityRollup.objects.filter(user_id=str(self.users[1]._id), period='month').count(), 2
+        )
+
+    def test_current_week(self):
+        """Test that window=week only counts the current week"""
+        response = self.client.get(reverse('leaderboard-list'), {'window': 'week'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = response.data['results']
+        self.assertEqual([row['total_calories'] for row in rows], [300, 200])
+        self.assertEqual([row['rank'] for row in rows], [1, 2])
+        self.assertEqual(rows[0]['total_distance'], 5.0)
+
+    def test_since(self):
+        """Test that since sums every bucket from that date onwards"""
+        since = (datetime.now(timezone.utc) - timedelta(days=90)).date().isoformat()
+        response = self.client.get(
+            reverse('leaderboard-by-team'),
+            {'window': 'month', 'since': since, 'team_id': str(self.team._id)}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['total_calories'], 1100)
+
+    def test_team_comes_from_latest_bucket(self):
+        """Test that a window spanning a team switch reports the team of the latest bucket"""
+        start = datetime.now(timezone.utc) - timedelta(days=45)
+        ActivityRollup.objects.mongo_update_many(
+            {'user_id': str(self.users[1]._id), 'period': 'month', 'period_start': {'$lt': start}},
+            {'$set': {'team_id': 'previous-team'}},
+        )
+        since = (datetime.now(timezone.utc) - timedelta(days=90)).date().isoformat()
+        response = self.client.get(reverse('leaderboard-list'), {'window': 'month', 'since': since})
+        self.assertEqual(response.data['results'][0]['team_id'], str(self.team._id))
+
+    def test_rebuild_swaps_in_same_rollups(self):
+        """Test that rebuild_rollups reproduces the incremental rollups through a shadow collection"""
+        fields = ('user_id', 'period', 'period_start', 'total_calories', 'total_activities')
+        incremental = sorted(ActivityRollup.objects.values_list(*fields))
+        rebuild_rollups()
+        self.assertEqual(sorted(ActivityRollup.objects.values_list(*fields)), incremental)
+        self.assertEqual(missing_indexes(ActivityRollup), {})
+
+    def test_invalid_window(self):
+        """Test that an unknown window is rejected"""
+        response = self.client.get(reverse('leaderboard-list'), {'window': 'year'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_limit_is_validated(self):
+        """Test that a non-integer limit is a 400 and a negative one is clamped to 1"""
+        url = reverse('leaderboard-list')
+        response = self.client.get(url, {'window': 'week', 'limit': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(url, {'window': 'week', 'limit': -1})
+        self.assertEqual([row['total_calories'] for row in response.data['results']], [300])
+
+
+class LeanSerializerParityTest(SimpleTestCase):
+    """Test cases comparing the lean serializer with the ModelSerializers"""
+
+    def instances(self):
+        now = datetime(2024, 5, 16, 8, 30, 15, 123000, tzinfo=timezone.utc)
+        return [
+            (UserSerializer, User(_id=ObjectId(), name="Ünïcode", email="u@example.com", created_at=now)),
+            (TeamSerializer, Team(_id=ObjectId(), name="Team", member_count=3, created_at=now)),
+            (ActivitySerializer, Activity(
+                _id=ObjectId(), user_id="1", activity_type="Yoga", duration=30,
+                calories=120, distance=None, date=now, notes="Calm"
+            )),
+            (LeaderboardSerializer, Leaderboard(
+                _id=ObjectId(), user_id="1", user_name="A", total_calories=10,
+                total_activities=1, rank=1, updated_at=now.replace(tzinfo=None)
+            )),
+            (WorkoutSerializer, Workout(
+                _id=ObjectId(), name="W", description="D", difficulty="Beginner",
+                duration=20, category="Core", exercises=[{'name': 'Plank', 'sets': 3}]
+            )),
+        ]
+
+    def test_matches_model_serializers(self):
+        """Test that lean output equals ModelSerializer output field for field"""
+        for serializer_class, instance in self.instances():
+            lean = LeanSerializer.for_serializer(serializer_class)
+            row = {column: getattr(instance, column) for column in lean.columns}
+            self.assertEqual(lean.to_representation(row), serializer_class(instance).data)
+
+    def test_renderer_matches_json_renderer(self):
+        """Test that the lean renderer produces the same JSON document"""
+        data = [serializer_class(instance).data for serializer_class, instance in self.instances()]
+        self.assertEqual(
+            json.loads(LeanJSONRenderer().render(data)),
+            json.loads(JSONRenderer().render(data))
+        )
+
+
+class LeanListParityTest(APITestCase):
+    """Test cases comparing lean list responses with ModelSerializer output"""
+
+    def test_querysets_match(self):
+        """Test the lean path against ModelSerializer over stored documents"""
+        team = Team.objects.create(name="Team", description="Desc")
+        user = User.objects.create(name="User", email="user@example.com", team_id=str(team._id))
+        Activity.objects.create(
+            user_id=str(user._id), activity_type="Running", duration=30,
+            calories=300, distance=5.5, date=datetime.now(timezone.utc), notes="Note"
+        )
+        Leaderboard.objects.create(user_id=str(user._id), user_name="User", total_calories=300)
+        Workout.objects.create(
+            name="W", description="D", difficulty="Beginner", duration=20,
+            category="Core", exercises=[{'name': 'Plank'}]
+        )
+        for serializer_class in (UserSerializer, TeamSerializer, ActivitySerializer,
+                                 LeaderboardSerializer, WorkoutSerializer):
+            queryset = serializer_class.Meta.model.objects.all()
+            lean = LeanSerializer.for_serializer(serializer_class)
+            self.assertEqual(
+                lean.serialize(lean.project(queryset)),
+                serializer_class(queryset, many=True).data
+            )
+
+
+class SparseFieldsetTest(SimpleTestCase):
+    """Test cases for narrowing the lean serializer to a sparse fieldset"""
+
+    def test_restrict_projects_selected_columns(self):
+        """Test that only selected and required columns are fetched"""
+        lean = LeanSerializer.for_serializer(LeaderboardSerializer).restrict(
+            ['user_name', 'total_calories', 'rank'], required=('user_id',)
+        )
+        self.assertEqual(lean.columns, ['user_name', 'total_calories', 'rank', 'user_id'])
+        row = {'user_id': '1', 'user_name': 'A', 'total_calories': 10, 'rank': 1}
+        self.assertEqual(lean.to_representation(row), {'user_name': 'A', 'total_calories': 10, 'rank': 1})
+
+    def test_exclude(self):
+        """Test that excluded fields are neither fetched nor emitted"""
+        lean = LeanSerializer.for_serializer(ActivitySerializer).restrict(exclude=['notes'])
+        self.assertNotIn('notes', lean.columns)
+        self.assertNotIn('notes', lean.field_names)
+
+    def test_unknown_field(self):
+        """Test that unknown field names are rejected"""
+        with self.assertRaises(ValueError):
+            LeanSerializer.for_serializer(UserSerializer).restrict(['password'])
+
+
+class SparseFieldsetAPITest(APITestCase):
+    """Test cases for the fields/exclude query params"""
+
+    def setUp(self):
+        self.activities = [
+            Activity.objects.create(
+                user_id="1", activity_type="Running", duration=30, calories=300 + i,
+                date=datetime.now(timezone.utc) - timedelta(days=i), notes="Note"
+            )
+            for i in range(3)
+        ]
+
+    def test_list_fields(self):
+        """Test that list responses only carry the requested fields across pages"""
+        response = self.client.get('/api/activities/', {'fields': '_id,calories', 'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for row in response.data['results']:
+            self.assertEqual(set(row), {'_id', 'calories'})
+        next_page = self.client.get(response.data['next'])
+        self.assertEqual([row['calories'] for row in next_page.data['results']], [302])
+
+    def test_retrieve_exclude(self):
+        """Test that retrieve honours exclude"""
+        activity = self.activities[0]
+        response = self.client.get(f'/api/activities/{activity._id}/', {'exclude': 'notes,distance'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('notes', response.data)
+        self.assertEqual(response.data['calories'], 300)
+
+    def test_unknown_field(self):
+        """Test that unknown field names return 400"""
+        response = self.client.get('/api/activities/', {'fields': 'calories,secret'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncReadPathTest(TestCase):
+    """Test cases for the async read endpoints"""
+
+    def setUp(self):
+        for i in range(3):
+            Workout.objects.create(
+                name=f"W{i}", description="D", difficulty="Beginner" if i else "Advanced",
+                duration=20 + i, category="Core", exercises=[{'name': 'Plank'}]
+            )
+
+    async def test_workouts_match_sync_list(self):
+        """Test that async workouts return the same rows as the DRF list"""
+        response = await self.async_client.get('/api/async/workouts/')
+        self.assertEqual(response.status_code, 200)
+        expected = await sync_to_async(lambda: self.client.get('/api/workouts/').json()['results'])()
+        self.assertEqual(response.json(), expected)
+
+    async def test_filters_and_fields(self):
+        """Test difficulty filtering with a sparse fieldset"""
+        response = await self.async_client.get(
+            '/api/async/workouts/', {'difficulty': 'Beginner', 'fields': 'name,duration'}
+        )
+        self.assertEqual(response.json(), [{'name': 'W2', 'duration': 22}, {'name': 'W1', 'duration': 21}])
+
+    async def test_user_id_required(self):
+        """Test that activities by user requires user_id"""
+        response = await self.async_client.get('/api/async/activities/by_user/')
+        self.assertEqual(response.status_code, 400)
+
+    async def test_limit_is_clamped_to_at_least_one(self):
+        """Test that a zero or negative limit returns one row instead of every row"""
+        for limit in ('0', '-2'):
+            response = await self.async_client.get('/api/async/workouts/', {'limit': limit})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()), 1)
+
+        response = await self.async_client.get('/api/async/workouts/', {'limit': 'all'})
+        self.assertEqual(response.status_code, 400)
+
+
+class PoolMetricsTest(SimpleTestCase):
+    """Test cases for connection pool metrics from monitoring events"""
+
+    def test_checkout_lifecycle(self):
+        """Test in-use, wait queue and latency accounting"""
+        metrics = PoolMetrics()
+        address = ('localhost', 27017)
+        metrics.pool_created(monitoring.PoolCreatedEvent(address, {}))
+        metrics.connection_created(monitoring.ConnectionCreatedEvent(address, 1))
+        metrics.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(address))
+        self.assertEqual(metrics.snapshot()['localhost:27017']['wait_queue_depth'], 1)
+
+        metrics.connection_checked_out(monitoring.ConnectionCheckedOutEvent(address, 1))
+        pool = metrics.snapshot()['localhost:27017']
+        self.assertEqual((pool['wait_queue_depth'], pool['in_use_connections']), (0, 1))
+        self.assertIsNotNone(pool['checkout_ms']['p99'])
+
+        metrics.connection_checked_in(monitoring.ConnectionCheckedInEvent(address, 1))
+        metrics.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(address))
+        metrics.connection_check_out_failed(monitoring.ConnectionCheckOutFailedEvent(address, 'timeout'))
+        pool = metrics.snapshot()['localhost:27017']
+        self.assertEqual(
+            (pool['in_use_connections'], pool['open_connections'], pool['checkouts'], pool['checkout_failures']),
+            (0, 1, 1, 1)
+        )
+
+
+class DatabaseHealthTest(APITestCase):
+    """Test cases for the database health endpoint"""
+
+    def test_health(self):
+        """Test that the endpoint pings Mongo and reports the pool"""
+        response = self.client.get('/api/health/db')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'ok')
+        self.assertIn('maxPoolSize', response.data['pool_settings'])
+        self.assertTrue(response.data['pools'])
+
+
+class QueryProfilingTest(SimpleTestCase):
+    """Test cases for the query profiling middleware"""
+
+    def issue_command(self, request_id, duration_micros):
+        command = {'find': 'teams', 'filter': {}}
+        command_profiler.started(monitoring.CommandStartedEvent(
+            command, 'octofit_db', request_id, ('localhost', 27017), request_id
+        ))
+        command_profiler.succeeded(monitoring.CommandSucceededEvent(
+            timedelta(microseconds=duration_micros), {'ok': 1}, 'find', request_id,
+            ('localhost', 27017), request_id
+        ))
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=50, SLOW_REQUEST_ROUND_TRIPS=20)
+    def test_server_timing_and_slow_query_log(self):
+        """Test that commands are attributed to the request and slow ones logged"""
+        def view(request):
+            self.issue_command(1, 2000)
+            self.issue_command(2, 80000)
+            return HttpResponse(b'{}')
+
+        middleware = QueryProfilingMiddleware(view)
+        with self.assertLogs('octofit_tracker.slow_queries', level='WARNING') as logs:
+            response = middleware(RequestFactory().get('/api/teams/'))
+        self.assertIn('db;dur=82.00;desc="2 round trips"', response['Server-Timing'])
+        self.assertIn('total;dur=', response['Server-Timing'])
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('find on teams took 80.0ms', logs.output[0])
+
+    def test_commands_outside_requests_are_ignored(self):
+        """Test that the listener is a no-op without an active profile"""
+        self.issue_command(3, 1000)
+
+    @override_settings(SLOW_REQUEST_ROUND_TRIPS=2)
+    def test_round_trip_warning(self):
+        """Test that requests with many round trips are logged"""
+        def view(request):
+            for request_id in range(3):
+                self.issue_command(request_id, 10)
+            return HttpResponse(b'{}')
+
+        with self.assertLogs('octofit_tracker.slow_queries', level='WARNING') as logs:
+            QueryProfilingMiddleware(view)(RequestFactory().get('/api/teams/'))
+        self.assertIn('issued 3 DB round trips', logs.output[0])
+
+
+class QueryProfilingAPITest(APITestCase):
+    """Test cases for profiling headers on API responses"""
+
+    def test_server_timing_header(self):
+        """Test that API responses report DB round trips and render time"""
+        Team.objects.create(name="Team", description="Desc")
+        response = self.client.get('/api/teams/')
+        self.assertIn('Server-Timing', response)
+        self.assertNotIn('desc="0 round trips"', response['Server-Timing'])
+        self.assertIn('render;dur=', response['Server-Timing'])
+
+
+class BenchmarkCompareTest(SimpleTestCase):
+    """Test cases for benchmark baseline comparison"""
+
+    baseline = {
+        '100/teams': {'p50_ms': 2.0, 'p95_ms': 4.0, 'p99_ms': 5.0, 'round_trips': 1, 'peak_kib': 100.0},
+    }
+
+    def test_within_threshold(self):
+        """Test that growth within the threshold passes"""
+        results = {'100/teams': {'p50_ms': 2.4, 'p95_ms': 4.9, 'p99_ms': 6.0, 'round_trips': 1, 'peak_kib': 120.0}}
+        self.assertEqual(compare(results, self.baseline, 0.25), [])
+
+    def test_regressions(self):
+        """Test that slower responses and extra round trips are reported"""
+        results = {
+            '100/teams': {'p50_ms': 2.0, 'p95_ms': 9.0, 'p99_ms': 5.0, 'round_trips': 3, 'peak_kib': 100.0},
+            '1000/teams': {'p50_ms': 50.0, 'p95_ms': 90.0, 'p99_ms': 99.0, 'round_trips': 9, 'peak_kib': 1.0},
+        }
+        regressions = compare(results, self.baseline, 0.25)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith('100/teams: p95_ms'))
+        self.assertTrue(regressions[1].startswith('100/teams: round_trips'))
+
+    def test_percentile(self):
+        """Test nearest-rank percentiles, including exact rank boundaries"""
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 0.5), 50)
+        self.assertEqual(percentile(samples, 0.99), 99)
+        self.assertEqual(percentile(samples, 0.995), 100)
+        self.assertEqual(percentile(samples, 1.0), 100)
+        self.assertEqual(percentile(samples, 0.0), 1)
+        self.assertEqual(percentile([1, 2, 3, 4], 0.5), 2)
+
+
+class TeamLeaderboardTest(APITestCase):
+    """Test cases for incrementally maintained team standings"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.marvel = Team.objects.create(name="Team Marvel")
+        self.dc = Team.objects.create(name="Team DC")
+        self.tony = self.create_user("Tony", self.marvel)
+        self.steve = self.create_user("Steve", self.marvel)
+        self.bruce = self.create_user("Bruce", self.dc)
+
+    def create_user(self, name, team):
+        response = self.client.post(reverse('user-list'), {
+            'name': name, 'email': f'{name.lower()}@example.com', 'team_id': str(team._id)
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['_id']
+
+    def post_activity(self, user_id, calories):
+        response = self.client.post(reverse('activity-list'), {
+            'user_id': user_id, 'activity_type': 'Running', 'duration': 30,
+            'calories': calories, 'date': datetime.now(timezone.utc).isoformat()
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def standing(self, team):
+        return TeamLeaderboard.objects.get(team_id=str(team._id))
+
+    def test_standings_follow_activities(self):
+        """Test totals, averages, member counts and ranks per team"""
+        self.post_activity(self.tony, 300)
+        self.post_activity(self.steve, 100)
+        self.post_activity(self.bruce, 500)
+        marvel, dc = self.standing(self.marvel), self.standing(self.dc)
+        self.assertEqual((marvel.total_calories, marvel.member_count, marvel.total_activities), (400, 2, 2))
+        self.assertEqual(marvel.average_calories, 200.0)
+        self.assertEqual((dc.rank, marvel.rank), (1, 2))
+
+        response = self.client.get(reverse('team-leaderboard-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['team_name'] for row in response.data['results']], ["Team DC", "Team Marvel"])
+
+    def test_switching_teams_moves_totals(self):
+        """Test that a user's totals follow them to their new team"""
+        self.post_activity(self.tony, 300)
+        self.post_activity(self.bruce, 200)
+        response = self.client.patch(reverse('user-detail', args=[self.tony]), {'team_id': str(self.dc._id)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        marvel, dc = self.standing(self.marvel), self.standing(self.dc)
+        self.assertEqual((marvel.total_calories, marvel.member_count), (0, 1))
+        self.assertEqual((dc.total_calories, dc.member_count, dc.rank), (500, 2, 1))
+        self.assertEqual(marvel.rank, 2)
+
+    def test_rebuild_matches_incremental(self):
+        """Test that a full rebuild yields the incrementally maintained standings"""
+        self.post_activity(self.tony, 300)
+        self.post_activity(self.bruce, 300)
+        fields = ('team_id', 'member_count', 'total_calories', 'total_activities', 'average_calories', 'rank')
+        incremental = sorted(TeamLeaderboard.objects.values_list(*fields))
+        rebuild_team_leaderboard()
+        self.assertEqual(sorted(TeamLeaderboard.objects.values_list(*fields)), incremental)
+
+    def test_rebuild_swaps_in_indexed_collection(self):
+        """Test that a rebuild replaces the standings through an indexed shadow collection"""
+        self.post_activity(self.tony, 300)
+        rebuild_team_leaderboard()
+        database = TeamLeaderboard.objects.mongo_database
+        self.assertNotIn('team_leaderboard_rebuild', database.list_collection_names())
+        self.assertEqual(missing_indexes(TeamLeaderboard), {})
+        self.assertEqual(self.standing(self.marvel).total_calories, 300)
+
+
+class DenormalizedNamesTest(APITestCase):
+    """Test cases for propagating user and team names to the leaderboards"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.team = Team.objects.create(name="Avengers")
+        self.other = Team.objects.create(name="Justice League")
+        self.user = User.objects.create(name="Tony", email="tony@example.com", team_id=str(self.team._id))
+        self.entry = Leaderboard.objects.create(
+            user_id=str(self.user._id), user_name="Tony",
+            team_id=str(self.team._id), team_name="Avengers", total_calories=100
+        )
+
+    def test_user_rename(self):
+        """Test that renaming a user updates their leaderboard entry"""
+        response = self.client.patch(reverse('user-detail', args=[self.user._id]), {'name': "Iron Man"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Leaderboard.objects.get(user_id=str(self.user._id)).user_name, "Iron Man")
+
+    def test_team_rename(self):
+        """Test that renaming a team updates entries and the team standing"""
+        response = self.client.patch(reverse('team-detail', args=[self.team._id]), {'name': "New Avengers"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Leaderboard.objects.get(user_id=str(self.user._id)).team_name, "New Avengers")
+        self.assertEqual(TeamLeaderboard.objects.get(team_id=str(self.team._id)).team_name, "New Avengers")
+
+    def test_team_switch(self):
+        """Test that switching teams repoints the leaderboard entry"""
+        response = self.client.patch(reverse('user-detail', args=[self.user._id]), {'team_id': str(self.other._id)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        entry = Leaderboard.objects.get(user_id=str(self.user._id))
+        self.assertEqual((entry.team_id, entry.team_name), (str(self.other._id), "Justice League"))
+
+    def test_batched_sync(self):
+        """Test that the batched sync repairs writes that bypassed signals"""
+        User.objects.mongo_update_one({'_id': self.user._id}, {'$set': {'name': "Stark"}})
+        Team.objects.mongo_update_one({'_id': self.team._id}, {'$set': {'name': "Renamed"}})
+        self.assertEqual(sync_denormalized_names(batch_size=1), 2)
+        entry = Leaderboard.objects.get(user_id=str(self.user._id))
+        self.assertEqual((entry.user_name, entry.team_name), ("Stark", "Renamed"))
+        self.assertEqual(sync_denormalized_names(), 0)
+
+
+@override_settings(JOBS_AUTOSTART=False, JOB_RETRY_BACKOFF=0)
+class JobQueueTest(APITestCase):
+    """Test cases for the background job queue"""
+
+    def setUp(self):
+        self.calls = []
+
+        @task('test.record', max_attempts=2)
+        def record(value, fail=False):
+            self.calls.append(value)
+            if fail:
+                raise RuntimeError('boom')
+
+        self.addCleanup(TASKS.pop, 'test.record')
+
+    def test_identical_pending_jobs_are_deduplicated(self):
+        """Test that enqueueing the same task and arguments twice queues one job"""
+        first = enqueue('test.record', value=1)
+        second = enqueue('test.record', value=1)
+        enqueue('test.record', value=2)
+        self.assertEqual(first['_id'], second['_id'])
+        self.assertEqual(Job.objects.count(), 2)
+
+        self.assertEqual(run_pending(), 2)
+        self.assertEqual(sorted(self.calls), [1, 2])
+        self.assertEqual(Job.objects.filter(status='done').count(), 2)
+
+    @override_settings(JOB_RETRY_BACKOFF=0)
+    def test_failed_job_is_retried_then_marked_failed(self):
+        """Test that a failing job is retried up to max_attempts"""
+        job = enqueue('test.record', value=1, fail=True)
+        run_pending()
+        stored = Job.objects.mongo_find_one({'_id': job['_id']})
+        self.assertEqual(stored['status'], 'failed')
+        self.assertEqual(stored['attempts'], 2)
+        self.assertIn('boom', stored['last_error'])
+        self.assertEqual(self.calls, [1, 1])
+
+    def test_concurrent_duplicate_enqueue_is_absorbed(self):
+        """Test that a pending duplicate inserted by a racing enqueue is returned, not doubled"""
+        ensure_indexes(Job)
+        job = enqueue('test.record', value=1)
+        with self.assertRaises(DuplicateKeyError):
+            Job.objects.mongo_insert_one({**job, '_id': ObjectId()})
+        self.assertEqual(enqueue('test.record', value=1)['_id'], job['_id'])
+
+    def test_stale_job_without_attempts_left_is_failed(self):
+        """Test that an abandoned last attempt is marked failed instead of run again"""
+        job = enqueue('test.record', value=1)
+        Job.objects.mongo_update_one({'_id': job['_id']}, {'$set': {
+            'status': 'running', 'attempts': 2, 'locked_at': datetime(2024, 1, 1, tzinfo=timezone.utc),
+        }})
+        self.assertEqual(run_pending(), 0)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(Job.objects.mongo_find_one({'_id': job['_id']})['status'], 'failed')
+
+    def test_heartbeat_refreshes_lock(self):
+        """Test that a running job's locked_at keeps moving"""
+        job = enqueue('test.record', value=1)
+        old = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        job = Job.objects.mongo_find_one_and_update(
+            {'_id': job['_id']}, {'$set': {'status': 'running', 'locked_by': 'w', 'locked_at': old}},
+            return_document=True,
+        )
+        with Heartbeat(job, interval=0.01):
+            time.sleep(0.1)
+        locked_at = Job.objects.mongo_find_one({'_id': job['_id']})['locked_at']
+        self.assertGreater(locked_at.replace(tzinfo=timezone.utc), old)
+
+    def test_unknown_task_is_rejected(self):
+        """Test that enqueueing an unregistered task raises"""
+        with self.assertRaises(ValueError):
+            enqueue('test.missing')
+
+    def test_rebuild_action_queues_job(self):
+        """Test that the leaderboard rebuild action queues a job and validates scope"""
+        url = reverse('leaderboard-rebuild')
+        response = self.client.post(url, {'scope': 'teams'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['name'], 'team_leaderboard.rebuild')
+        self.assertEqual(response.data['status'], 'pending')
+
+        response = self.client.post(url, {'scope': 'everything'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(url, ['teams'], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CompetitionRanksTest(SimpleTestCase):
+    """Test cases for ranking merged total histograms"""
+
+    def test_ties_share_rank_and_skip_positions(self):
+        """Test that tied totals share a rank and the next total skips past them"""
+        self.assertEqual(
+            competition_ranks({900: 1, 500: 2, 0: 3}),
+            {900: 1, 500: 2, 0: 4}
+        )
+
+    def test_empty_histogram(self):
+        """Test that an empty histogram yields no ranks"""
+        self.assertEqual(competition_ranks({}), {})
+
+
+class LeaderboardRebuildTest(TestCase):
+    """Test cases for the full leaderboard rebuild"""
+
+    def setUp(self):
+        self.team = Team.objects.create(name="Rebuild Team")
+        self.users = [
+            User.objects.create(name=name, email=f"{name.lower()}@example.com", team_id=str(self.team._id))
+            for name in ("Ann", "Ben", "Cat", "Dan")
+        ]
+        calories = {"Ann": [300, 200], "Ben": [500], "Cat": [100]}
+        Activity.objects.mongo_insert_many([
+            {
+                'user_id': str(user._id),
+                'activity_type': 'Running',
+                'duration': 30,
+                'calories': value,
+                'date': datetime.now(timezone.utc),
+            }
+            for user in self.users
+            for value in calories.get(user.name, [])
+        ] + [{'user_id': 'unknown', 'activity_type': 'Running', 'duration': 30, 'calories': 50}])
+        # Drifted state the rebuild must replace
+        Leaderboard.objects.mongo_insert_one({'user_id': 'stale', 'total_calories': 10 ** 6, 'rank': 1})
+
+    def test_rebuild_recomputes_totals_and_ranks(self):
+        """Test that the rebuild replaces the leaderboard with totals and ranks from activities"""
+        result = rebuild_leaderboard(processes=1, shards=3, batch_size=2)
+        self.assertEqual(result['entries'], 4)
+        self.assertEqual(result['orphaned_activities'], 1)
+
+        entries = {entry.user_name: entry for entry in Leaderboard.objects.all()}
+        self.assertEqual(set(entries), {"Ann", "Ben", "Cat", "Dan"})
+        self.assertEqual(
+            [(entries[name].total_calories, entries[name].rank) for name in ("Ann", "Ben", "Cat", "Dan")],
+            [(500, 1), (500, 1), (100, 3), (0, 4)]
+        )
+        self.assertEqual(entries["Ann"].total_activities, 2)
+        self.assertEqual(entries["Ann"].team_name, "Rebuild Team")
+
+    def test_rebuild_command(self):
+        """Test that the management command rebuilds the leaderboard and team standings"""
+        out = StringIO()
+        call_command('rebuild_leaderboard', processes=1, stdout=out)
+        self.assertIn('Rebuilt 4 leaderboard entries', out.getvalue())
+        self.assertEqual(TeamLeaderboard.objects.get(team_id=str(self.team._id)).total_calories, 1100)
+
+
+class InMemoryHub(LeaderboardHub):
+    """Leaderboard hub reading from a dict instead of Mongo"""
+
+    def __init__(self, **kwargs):
+        super().__init__(tick=3600, **kwargs)
+        self.data = {}
+        self.data_version = 1
+
+    def set(self, user_id, total, rank, team_id='t1'):
+        self.data[user_id] = {
+            'user_id': user_id, 'user_name': user_id, 'team_id': team_id, 'team_name': team_id,
+            'total_calories': total, 'total_activities': 1, 'rank': rank,
+        }
+        self.data_version += 1
+
+    async def current_version(self):
+        return self.data_version
+
+    async def load(self):
+        return {user_id: dict(entry) for user_id, entry in self.data.items()}
+
+
+class LiveLeaderboardTest(SimpleTestCase):
+    """Test cases for the live leaderboard stream"""
+
+    def hub(self, **kwargs):
+        hub = InMemoryHub(**kwargs)
+        hub.set('ann', 500, 1)
+        hub.set('ben', 300, 2, team_id='t2')
+        return hub
+
+    @staticmethod
+    def drain(subscription):
+        frames = []
+        while not subscription.queue.empty():
+            frames.append(subscription.queue.get_nowait())
+        return frames
+
+    def test_diff_entries(self):
+        """Test that diffs report new, changed and removed entries"""
+        previous = {'a': {'rank': 1}, 'b': {'rank': 2}}
+        current = {'a': {'rank': 2}, 'c': {'rank': 1}}
+        changed, removed = diff_entries(previous, current)
+        self.assertEqual(changed, [({'rank': 2}, {'rank': 1}), ({'rank': 1}, None)])
+        self.assertEqual(removed, [{'rank': 2}])
+
+    async def test_burst_is_coalesced_into_one_delta(self):
+        """Test that several writes between ticks produce one delta frame"""
+        hub = self.hub()
+        subscription = await hub.subscribe()
+        self.assertEqual(self.drain(subscription)[0]['type'], 'snapshot')
+
+        hub.set('ben', 600, 1, team_id='t2')
+        hub.set('ann', 500, 2)
+        hub.set('cat', 100, 3)
+        self.assertTrue(await hub.poll())
+        self.assertFalse(await hub.poll())
+
+        frames = self.drain(subscription)
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0]['type'], 'delta')
+        self.assertEqual([entry['user_id'] for entry in frames[0]['changed']], ['ben', 'ann', 'cat'])
+        hub.unsubscribe(subscription)
+
+    async def test_team_filter(self):
+        """Test that team subscribers only see their team and members who leave it"""
+        hub = self.hub()
+        subscription = await hub.subscribe(team_id='t2')
+        snapshot = self.drain(subscription)[0]
+        self.assertEqual([entry['user_id'] for entry in snapshot['entries']], ['ben'])
+
+        hub.set('ann', 700, 1)
+        await hub.poll()
+        self.assertEqual(self.drain(subscription), [])
+
+        hub.set('ben', 300, 2, team_id='t1')
+        await hub.poll()
+        frame = self.drain(subscription)[0]
+        self.assertEqual((frame['changed'], frame['removed']), ([], ['ben']))
+        hub.unsubscribe(subscription)
+
+    async def test_slow_consumer_is_resynced(self):
+        """Test that a full queue is replaced by a single fresh snapshot"""
+        hub = self.hub(queue_size=2)
+        subscription = await hub.subscribe()
+        for total in (600, 700, 800):
+            hub.set('ben', total, 1, team_id='t2')
+            await hub.poll()
+
+        # snapshot + delta(600) filled the queue; delta(700) overflowed it
+        frames = self.drain(subscription)
+        self.assertEqual([frame['type'] for frame in frames], ['snapshot', 'delta'])
+        totals = {entry['user_id']: entry['total_calories'] for entry in frames[0]['entries']}
+        self.assertEqual(totals['ben'], 700)
+        self.assertEqual(frames[1]['changed'][0]['total_calories'], 800)
+        hub.unsubscribe(subscription)
+
+    async def test_immediate_resubscribe_restarts_poller(self):
+        """Test that subscribing right after the last client left gets a live poller"""
+        hub = self.hub()
+        first = await hub.subscribe()
+        hub.unsubscribe(first)
+        second = await hub.subscribe()
+        await asyncio.sleep(0)
+        self.assertFalse(hub.idle())
+        self.assertFalse(hub._task.cancelled())
+        hub.unsubscribe(second)
+
+    async def test_server_sent_events(self):
+        """Test the SSE endpoint through the ASGI wrapper"""
+        hub = self.hub()
+        app = live_leaderboard(None, hub=hub)
+        received, sent = asyncio.Queue(), asyncio.Queue()
+        scope = {'type': 'http', 'method': 'GET', 'path': '/api/stream/leaderboard/', 'query_string': b'team_id=t1'}
+        server = asyncio.ensure_future(app(scope, received.get, sent.put))
+
+        start = await asyncio.wait_for(sent.get(), 1)
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), start['headers'])
+        body = (await asyncio.wait_for(sent.get(), 1))['body'].decode()
+        self.assertTrue(body.startswith('event: snapshot\n'))
+        data = json.loads(body.split('data: ', 1)[1])
+        self.assertEqual([entry['user_id'] for entry in data['entries']], ['ann'])
+
+        await received.put({'type': 'http.disconnect'})
+        await asyncio.wait_for(server, 1)
+        self.assertEqual(hub.subscribers, set())
+
+    async def test_websocket(self):
+        """Test the WebSocket endpoint through the ASGI wrapper"""
+        hub = self.hub()
+        app = live_leaderboard(None, hub=hub)
+        received, sent = asyncio.Queue(), asyncio.Queue()
+        scope = {'type': 'websocket', 'path': '/ws/leaderboard/', 'query_string': b''}
+        await received.put({'type': 'websocket.connect'})
+        server = asyncio.ensure_future(app(scope, received.get, sent.put))
+
+        self.assertEqual((await asyncio.wait_for(sent.get(), 1))['type'], 'websocket.accept')
+        message = await asyncio.wait_for(sent.get(), 1)
+        self.assertEqual(len(json.loads(message['text'])['entries']), 2)
+
+        hub.set('ann', 900, 1)
+        await hub.poll()
+        message = await asyncio.wait_for(sent.get(), 1)
+        self.assertEqual(json.loads(message['text'])['type'], 'delta')
+
+        await received.put({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.wait_for(server, 1)
+
+
+class CatalogSnapshotTest(SimpleTestCase):
+    """Test cases for in-memory workout facet filtering"""
+
+    def setUp(self):
+        self.snapshot = CatalogSnapshot([
+            {'_id': f'{i:024x}', 'name': f'W{i}', 'difficulty': difficulty, 'category': category, 'duration': duration}
+            for i, (difficulty, category, duration) in enumerate([
+                ('Advanced', 'Strength', 60),
+                ('Advanced', 'Strength', 90),
+                ('Beginner', 'Strength', 30),
+                ('Advanced', 'Cardio', 45),
+            ])
+        ])
+
+    def names(self, **facets):
+        return [row['name'] for row in self.snapshot.filter(**facets)]
+
+    def test_unfiltered_rows_are_newest_first(self):
+        """Test that rows are ordered by descending id"""
+        self.assertEqual(self.names(), ['W3', 'W2', 'W1', 'W0'])
+
+    def test_combined_facets(self):
+        """Test intersecting difficulty, category and duration range"""
+        self.assertEqual(self.names(difficulty='Advanced', category='Strength', max_duration=60), ['W0'])
+        self.assertEqual(self.names(min_duration=45, max_duration=60), ['W3', 'W0'])
+        self.assertEqual(self.names(category='Yoga'), [])
+
+
+class WorkoutCatalogAPITest(APITestCase):
+    """Test cases for workout reads served from the catalog snapshot"""
+
+    def setUp(self):
+        for name, difficulty, category, duration in [
+            ("Heavy", "Advanced", "Strength", 60),
+            ("Long", "Advanced", "Strength", 90),
+            ("Easy", "Beginner", "Strength", 30),
+        ]:
+            Workout.objects.create(
+                name=name, description="D", difficulty=difficulty,
+                category=category, duration=duration, exercises=[{'name': 'Squat'}]
+            )
+
+    def test_facets_are_served_without_round_trips(self):
+        """Test combined facets and that warm catalog reads skip Mongo"""
+        url = reverse('workout-list')
+        self.client.get(url)
+        response = self.client.get(url, {'difficulty': 'Advanced', 'category': 'Strength', 'max_duration': 60})
+        self.assertEqual([row['name'] for row in response.data['results']], ["Heavy"])
+        self.assertEqual(response.data['results'][0]['exercises'], [{'name': 'Squat'}])
+        self.assertIn('desc="0 round trips"', response['Server-Timing'])
+
+    def test_edits_swap_the_snapshot(self):
+        """Test that API edits are visible on the next read"""
+        workout = Workout.objects.get(name="Easy")
+        url = reverse('workout-detail', args=[str(workout._id)])
+        self.assertEqual(self.client.get(url).data['duration'], 30)
+        response = self.client.patch(url, {'duration': 35}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(url).data['duration'], 35)
+
+    @override_settings(CACHE_VERSION_TTL=0)
+    def test_edits_from_other_processes_swap_the_snapshot(self):
+        """Test that an edit recorded only in Mongo reaches this process's snapshot"""
+        workout = Workout.objects.get(name="Easy")
+        url = reverse('workout-detail', args=[str(workout._id)])
+        self.assertEqual(self.client.get(url).data['duration'], 30)
+        Workout.objects.mongo_update_one({'_id': workout._id}, {'$set': {'duration': 40}})
+        CacheVersion.objects.mongo_update_one({'namespace': CATALOG}, {'$inc': {'version': 1}})
+        self.assertEqual(self.client.get(url).data['duration'], 40)
+
+    def test_pages_and_invalid_duration(self):
+        """Test cursor pages over catalog rows and duration validation"""
+        response = self.client.get(reverse('workout-list'), {'page_size': 2, 'fields': 'name'})
+        self.assertEqual(response.data['results'], [{'name': "Easy"}, {'name': "Long"}])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.data['results'], [{'name': "Heavy"}])
+        self.assertIsNotNone(response.data['previous'])
+
+        response = self.client.get(reverse('workout-list'), {'max_duration': 'long'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecommendationScoringTest(SimpleTestCase):
+    """Test cases for vectorized workout scoring"""
+
+    def setUp(self):
+        self.snapshot = CatalogSnapshot([
+            {'_id': '1', 'name': 'Lift', 'difficulty': 'Advanced', 'category': 'Strength', 'duration': 60},
+            {'_id': '2', 'name': 'Jog', 'difficulty': 'Beginner', 'category': 'Cardio', 'duration': 30},
+            {'_id': '3', 'name': 'Spar', 'difficulty': 'Intermediate', 'category': 'Combat', 'duration': 45},
+        ])
+        self.matrix = WorkoutMatrix(self.snapshot)
+
+    def best(self, profile):
+        scores = self.matrix.scores(*user_features(profile))
+        return self.matrix.rows[int(scores.argmax())]['name']
+
+    def test_activity_mix_drives_focus(self):
+        """Test that users are matched to workouts of the kind they do"""
+        lifter = {'mix': {'Weight Training': 1.0}, 'weight': 1.0, 'minutes': 60, 'calories': 720}
+        runner = {'mix': {'Running': 1.0}, 'weight': 1.0, 'minutes': 30, 'calories': 240}
+        self.assertEqual(self.best(lifter), 'Lift')
+        self.assertEqual(self.best(runner), 'Jog')
+
+    def test_new_user_gets_defaults(self):
+        """Test that users without activity are scored with neutral features"""
+        focus, minutes, intensity = user_features(None)
+        self.assertAlmostEqual(float((focus ** 2).sum()), 1.0)
+        self.assertEqual(minutes, 45)
+        self.assertEqual(len(self.matrix.scores(focus, minutes, intensity)), 3)
+
+    def test_recent_activities_weigh_more(self):
+        """Test that an activity weighs twice as much as one a half-life older"""
+        recent = datetime(2024, 3, 1, tzinfo=timezone.utc)
+        self.assertAlmostEqual(activity_weight(recent) / activity_weight(recent - timedelta(days=14)), 2.0)
+
+    def test_weights_stay_finite_far_from_epoch(self):
+        """Test that weights relative to a profile's ref do not overflow for distant dates"""
+        ref = datetime(2200, 1, 1, tzinfo=timezone.utc)
+        self.assertEqual(activity_weight(ref, ref), 1.0)
+        self.assertAlmostEqual(activity_weight(ref - timedelta(days=14), ref), 0.5)
+        self.assertEqual(activity_weight(datetime(2024, 1, 1, tzinfo=timezone.utc), ref), 0.0)
+
+
+class WorkoutRecommendationAPITest(APITestCase):
+    """Test cases for the recommended workouts action"""
+
+    def setUp(self):
+        self.user = User.objects.create(name="Boxer", email="boxer@example.com")
+        for name, difficulty, category, duration in [
+            ("Spar", "Advanced", "Combat", 60),
+            ("Stretch", "Beginner", "Flexibility", 20),
+        ]:
+            Workout.objects.create(
+                name=name, description="D", difficulty=difficulty,
+                category=category, duration=duration, exercises=[]
+            )
+
+    def test_recommendations_follow_new_activities(self):
+        """Test that posted activities update the profile used for scoring"""
+        for _ in range(3):
+            response = self.client.post(reverse('activity-list'), {
+                'user_id': str(self.user._id),
+                'activity_type': 'Boxing',
+                'duration': 60,
+                'calories': 700,
+                'date': datetime.now(timezone.utc).isoformat()
+            })
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        url = reverse('workout-recommended')
+        response = self.client.get(url, {'user_id': str(self.user._id), 'limit': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['name'] for row in response.data], ["Spar"])
+        self.assertIn('score', response.data[0])
+
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_profile_rebases_and_cancels(self):
+        """Test that a far newer activity rebases the profile and removals cancel exactly"""
+        old = Activity(
+            user_id=str(self.user._id), activity_type='Boxing', duration=60, calories=700,
+            date=datetime(2024, 1, 1, tzinfo=timezone.utc)
+        )
+        new = Activity(
+            user_id=str(self.user._id), activity_type='Boxing', duration=30, calories=300,
+            date=datetime(2026, 1, 1, tzinfo=timezone.utc)
+        )
+        apply_activity_changes(added=[old])
+        apply_activity_changes(added=[new])
+        profile = ActivityProfile.objects.mongo_find_one({'user_id': str(self.user._id)})
+        self.assertEqual(profile['ref'].replace(tzinfo=timezone.utc), new.date)
+        self.assertAlmostEqual(profile['minutes'] / profile['weight'], 30, places=3)
+
+        apply_activity_changes(removed=[old, new])
+        profile = ActivityProfile.objects.mongo_find_one({'user_id': str(self.user._id)})
+        self.assertEqual((profile['weight'], profile['minutes']), (0.0, 0.0))
+
+    def test_far_future_activity_is_rejected(self):
+        """Test that activities dated far in the future are a validation error, not a 500"""
+        response = self.client.post(reverse('activity-list'), {
+            'user_id': str(self.user._id),
+            'activity_type': 'Boxing',
+            'duration': 60,
+            'calories': 700,
+            'date': '2100-01-01T00:00:00Z'
+        })
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('date', response.data)
+
+
+class UserBatchItemTest(SimpleTestCase):
+    """Test cases for batch user item validation"""
+
+    def test_requires_id_or_email(self):
+        """Test that an item must name a user by _id or email"""
+        self.assertFalse(UserBatchItemSerializer(data={'name': 'Nobody'}).is_valid())
+        self.assertTrue(UserBatchItemSerializer(data={'email': 'a@example.com'}).is_valid())
+
+    def test_rejects_malformed_id(self):
+        """Test that _id must be an ObjectId"""
+        serializer = UserBatchItemSerializer(data={'_id': 'nope'})
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('_id', serializer.errors)
+
+
+class UserBatchAPITest(APITestCase):
+    """Test cases for batch user upserts and team reassignment"""
+
+    def setUp(self):
+        self.red = Team.objects.create(name="Red")
+        self.blue = Team.objects.create(name="Blue")
+        self.user = User.objects.create(name="Mover", email="mover@example.com", team_id=str(self.red._id))
+        Team.objects.filter(_id=self.red._id).update(member_count=1)
+        Leaderboard.objects.create(
+            user_id=str(self.user._id), user_name="Mover", team_id=str(self.red._id), team_name="Red",
+            total_calories=400, total_activities=2, rank=1
+        )
+        rebuild_team_leaderboard()
+        self.url = reverse('user-batch')
+
+    def test_unordered_batch_propagates_changes(self):
+        """Test per-item results and that moves reach counters, entries and standings"""
+        response = self.client.post(self.url, {'users': [
+            {'_id': str(self.user._id), 'team_id': str(self.blue._id), 'name': "Moved"},
+            {'email': 'new@example.com', 'name': "New", 'team_id': str(self.blue._id)},
+            {'email': 'lost@example.com', 'name': "Lost", 'team_id': str(ObjectId())},
+            {'name': "Anonymous"},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['updated', 'created', 'error', 'error']
+        )
+
+        self.assertEqual(Team.objects.get(_id=self.red._id).member_count, 0)
+        self.assertEqual(Team.objects.get(_id=self.blue._id).member_count, 2)
+        entry = Leaderboard.objects.get(user_id=str(self.user._id))
+        self.assertEqual((entry.team_name, entry.user_name), ("Blue", "Moved"))
+        blue = TeamLeaderboard.objects.get(team_id=str(self.blue._id))
+        self.assertEqual((blue.total_calories, blue.member_count, blue.rank), (400, 2, 1))
+        self.assertEqual(TeamLeaderboard.objects.get(team_id=str(self.red._id)).total_calories, 0)
+        self.assertTrue(User.objects.filter(email='new@example.com').exists())
+
+    def test_ordered_batch_stops_at_first_error(self):
+        """Test that ordered batches skip every item after a failure"""
+        response = self.client.post(self.url, {'ordered': True, 'users': [
+            {'email': 'first@example.com', 'name': "First"},
+            {'_id': str(ObjectId()), 'name': "Ghost"},
+            {'email': 'third@example.com', 'name': "Third"},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['created', 'error', 'skipped']
+        )
+        self.assertFalse(User.objects.filter(email='third@example.com').exists())
+
+    def test_ordered_must_be_a_boolean(self):
+        """Test that string flags are parsed as booleans and other values rejected"""
+        response = self.client.post(self.url, {'ordered': 'false', 'users': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data['ordered'])
+        response = self.client.post(self.url, {'ordered': 'sometimes', 'users': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_lost_to_concurrent_insert_is_an_error(self):
+        """Test that a create whose upsert matched a concurrently inserted user is not reported as created"""
+        def load_teams(validated):
+            User.objects.mongo_insert_one({'name': "Racer", 'email': 'race@example.com', 'team_id': None})
+            return {}
+
+        with mock.patch.object(roster, '_load_teams', load_teams):
+            result = apply_user_batch([{'email': 'race@example.com', 'name': "Late"}])
+        self.assertEqual((result['created'], result['errors']), (0, 1))
+        self.assertEqual(User.objects.get(email='race@example.com').name, "Racer")
+
+
+class ActivityExportEncodingTest(SimpleTestCase):
+    """Test cases for activity export filters and CSV encoding"""
+
+    def test_filter_combines_range_and_cursor(self):
+        """Test that start/end bound the date and after resumes past an _id"""
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        after = ObjectId()
+        query = export_filter(user_id='u1', start=start, after=str(after))
+        self.assertEqual(query, {'user_id': 'u1', 'date': {'$gte': start}, '_id': {'$gt': after}})
+        with self.assertRaises(ValueError):
+            export_filter(after='nope')
+
+    def test_csv_chunk_per_batch(self):
+        """Test that each batch becomes one chunk and only the first has the header"""
+        object_id = ObjectId()
+        row = {
+            '_id': object_id, 'user_id': 'u1', 'activity_type': 'Running', 'duration': 30,
+            'calories': 300, 'date': datetime(2025, 1, 2), 'notes': 'line one\nline two',
+        }
+        chunks = list(_csv_chunks(iter([[row], [row]]), header=True))
+        self.assertEqual(len(chunks), 2)
+        self.assertTrue(chunks[0].startswith(b'_id,user_id,'))
+        self.assertTrue(chunks[1].startswith(str(object_id).encode()))
+        self.assertIn(b',,2025-01-02T00:00:00+00:00,"line one\nline two"', chunks[1])
+
+    def test_resume_point_drops_partial_row(self):
+        """Test that resuming truncates a cut-off row and returns the last complete _id"""
+        first, second = ObjectId(), ObjectId()
+        with tempfile.NamedTemporaryFile('wb', suffix='.csv', delete=False) as file:
+            file.write(f'_id,user_id\r\n{first},u1\r\n{second},u'.encode())
+        self.addCleanup(os.remove, file.name)
+        self.assertEqual(resume_point(file.name), str(first))
+        with open(file.name, 'rb') as exported:
+            self.assertTrue(exported.read().endswith(f'{first},u1\r\n'.encode()))
+
+
+class ActivityExportAPITest(APITestCase):
+    """Test cases for the streaming activity export endpoint"""
+
+    def setUp(self):
+        self.user = User.objects.create(name="Exporter", email="exporter@example.com")
+        self.activities = [
+            Activity.objects.create(
+                user_id=str(self.user._id), activity_type=activity_type, duration=30, calories=300,
+                date=datetime(2025, 1, day, tzinfo=timezone.utc)
+            )
+            for day, activity_type in ((1, "Running"), (2, "Cycling"), (3, "Running"))
+        ]
+        self.url = reverse('activity-export')
+
+    def rows(self, response):
+        return b''.join(response.streaming_content).decode().splitlines()[1:]
+
+    def test_export_filters_by_type_and_range(self):
+        """Test that CSV rows match the type and date filters"""
+        response = self.client.get(self.url, {'activity_type': 'Running', 'start': '2025-01-02'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = self.rows(response)
+        self.assertEqual([row.split(',')[0] for row in rows], [str(self.activities[2]._id)])
+
+    def test_export_resumes_after_cursor(self):
+        """Test that after skips rows already exported"""
+        response = self.client.get(self.url, {'after': str(self.activities[0]._id)})
+        self.assertEqual(
+            [row.split(',')[0] for row in self.rows(response)],
+            [str(activity._id) for activity in self.activities[1:]]
+        )
+
+    def test_export_rejects_bad_params(self):
+        """Test that unknown formats and malformed cursors return 400"""
+        self.assertEqual(self.client.get(self.url, {'output': 'xlsx'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'after': 'nope'}).status_code, status.HTTP_400_BAD_REQUEST)
@@ -14,18 +14,22 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from rest_framework import routers
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 import os
+from . import async_views
 from .views import (
     UserViewSet,
     TeamViewSet,
     ActivityViewSet,
     LeaderboardViewSet,
-    WorkoutViewSet
+    TeamLeaderboardViewSet,
+    WorkoutViewSet,
+    JobViewSet,
+    db_health
 )
 
 
@@ -46,7 +50,9 @@ def api_root(request, format=None):
         'teams': f'{base_url}/api/teams/',
         'activities': f'{base_url}/api/activities/',
         'leaderboard': f'{base_url}/api/leaderboard/',
+        'team-leaderboard': f'{base_url}/api/team-leaderboard/',
         'workouts': f'{base_url}/api/workouts/',
+        'jobs': f'{base_url}/api/jobs/',
         'admin': f'{base_url}/admin/',
     })
 
@@ -56,10 +62,16 @@ router.register(r'users', UserViewSet, basename='user')
 router.register(r'teams', TeamViewSet, basename='team')
 router.register(r'activities', ActivityViewSet, basename='activity')
 router.register(r'leaderboard', LeaderboardViewSet, basename='leaderboard')
+router.register(r'team-leaderboard', TeamLeaderboardViewSet, basename='team-leaderboard')
 router.register(r'workouts', WorkoutViewSet, basename='workout')
+router.register(r'jobs', JobViewSet, basename='job')
 
 urlpatterns = [
     path('', api_root, name='api-root'),
+    re_path(r'^api/health/db/?$', db_health, name='health-db'),
+    path('api/async/leaderboard/', async_views.leaderboard, name='async-leaderboard'),
+    path('api/async/activities/by_user/', async_views.activities_by_user, name='async-activities-by-user'),
+    path('api/async/workouts/', async_views.workouts, name='async-workouts'),
     path('api/', include(router.urls)),
     path('admin/', admin.site.urls),
 ]
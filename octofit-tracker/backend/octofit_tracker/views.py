@@ -1,38 +1,194 @@
+import copy
+from datetime import datetime, time, timezone
+from io import BytesIO
+from time import perf_counter
+
+from django.conf import settings
+from django.http import Http404, StreamingHttpResponse
+from django.utils.dateparse import parse_date, parse_datetime
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import BooleanField
 from rest_framework.response import Response
-from .models import User, Team, Activity, Leaderboard, Workout
+from pymongo.errors import PyMongoError
+from .models import User, Team, Activity, Leaderboard, TeamLeaderboard, Workout, Job
 from .serializers import (
     UserSerializer,
     TeamSerializer,
     ActivitySerializer,
     LeaderboardSerializer,
-    WorkoutSerializer
+    TeamLeaderboardSerializer,
+    WorkoutSerializer,
+    JobSerializer,
+    LeanSerializer
+)
+from .cache import LEADERBOARD, cached_response
+from .rollups import PERIODS, windowed_totals
+from .signals import send_activities_changed, send_membership_changed
+from .stats import activity_stats
+from .ranking import ranking
+from .ingest import ingest, iter_json_array, iter_ndjson
+from .roster import apply_user_batch
+from .catalog import catalog
+from .recommendations import recommend
+from .pool_metrics import pool_metrics
+from .jobs import enqueue
+from .export import CONTENT_TYPES, FORMATS, export_chunks, export_filter
+
+# Background recomputations that can be requested through the API
+REBUILD_TASKS = {
+    'ranks': 'leaderboard.rerank',
+    'full': 'leaderboard.rebuild',
+    'teams': 'team_leaderboard.rebuild',
+    'rollups': 'rollups.rebuild',
+    'profiles': 'recommendations.rebuild',
+    'names': 'leaderboard.sync_names',
+}
+
+MAX_RECOMMENDATIONS = 50
+
+POOL_SETTINGS = (
+    'maxPoolSize', 'minPoolSize', 'waitQueueTimeoutMS',
+    'serverSelectionTimeoutMS', 'connectTimeoutMS', 'socketTimeoutMS',
 )
 
 
-class UserViewSet(viewsets.ModelViewSet):
+def parse_since(value):
+    """Parse a ``since`` query param given as an ISO date or datetime"""
+    try:
+        since = parse_datetime(value)
+        if since is None:
+            day = parse_date(value)
+            if day is not None:
+                since = datetime.combine(day, time.min, tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    return since
+
+
+def parse_limit(params, name, default, maximum):
+    """Read a positive integer query param, clamped to ``[1, maximum]``"""
+    try:
+        value = int(params.get(name, default))
+    except ValueError:
+        raise ValidationError({name: ['must be an integer']})
+    return min(max(value, 1), maximum)
+
+
+def split_fields(value):
+    """Split a comma-separated ``fields``/``exclude`` query param"""
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+class PaginatedActionMixin:
+    """
+    Gives ``list``, ``retrieve`` and custom list-style actions cursor
+    pagination, sparse fieldsets (``fields=``/``exclude=``) and the lean
+    read-only serialization path.
+    """
+
+    def get_lean_serializer(self, required=()):
+        """Return the lean serializer narrowed to the requested fieldset"""
+        lean = LeanSerializer.for_serializer(self.get_serializer_class())
+        fields = split_fields(self.request.query_params.get('fields'))
+        exclude = split_fields(self.request.query_params.get('exclude'))
+        if not fields and not exclude:
+            return lean
+        ordering = getattr(self, 'cursor_ordering', self.paginator.ordering if self.paginator else None)
+        if ordering:
+            # The cursor position is the ordering field plus ``_id``
+            required = tuple(required) + (ordering.lstrip('-'), '_id')
+        try:
+            return lean.restrict(fields, exclude, required=required)
+        except ValueError as exc:
+            raise ValidationError({'fields': [str(exc)]})
+
+    def list(self, request, *args, **kwargs):
+        return self.list_response(self.filter_queryset(self.get_queryset()))
+
+    def retrieve(self, request, *args, **kwargs):
+        lean = self.get_lean_serializer()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        )
+        row = lean.project(queryset).first()
+        if row is None:
+            raise Http404
+        return Response(lean.to_representation(row))
+
+    def list_response(self, queryset):
+        """Serialize one page of a queryset into a paginated response"""
+        lean = self.get_lean_serializer()
+        rows = lean.project(queryset)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(lean.serialize(page))
+        return Response(lean.serialize(rows))
+
+
+class UserViewSet(PaginatedActionMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing User instances.
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
+    def perform_create(self, serializer):
+        user = serializer.save()
+        send_membership_changed(str(user._id), None, user.team_id)
+
+    def perform_update(self, serializer):
+        previous_team_id = serializer.instance.team_id
+        user = serializer.save()
+        send_membership_changed(str(user._id), previous_team_id, user.team_id)
+
+    def perform_destroy(self, instance):
+        user_id, team_id = str(instance._id), instance.team_id
+        instance.delete()
+        send_membership_changed(user_id, team_id, None)
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """Upsert users and reassign teams in bulk, with a result per item"""
+        payload = request.data
+        ordered = False
+        if isinstance(payload, dict):
+            try:
+                ordered = BooleanField().to_internal_value(payload.get('ordered', False))
+            except ValidationError:
+                return Response({"error": "ordered must be a boolean"}, status=status.HTTP_400_BAD_REQUEST)
+            payload = payload.get('users')
+        if not isinstance(payload, list):
+            return Response(
+                {"error": "expected a list of users or {\"users\": [...], \"ordered\": bool}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        result = apply_user_batch(payload, ordered=ordered)
+
+        if not result['errors'] and not result['skipped']:
+            response_status = status.HTTP_200_OK
+        elif result['created'] or result['updated'] or result['unchanged']:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response(result, status=response_status)
+
     @action(detail=False, methods=['get'])
     def by_team(self, request):
         """Get all users in a specific team"""
         team_id = request.query_params.get('team_id')
         if team_id:
             users = self.queryset.filter(team_id=team_id)
-            serializer = self.get_serializer(users, many=True)
-            return Response(serializer.data)
+            return self.list_response(users)
         return Response(
             {"error": "team_id parameter is required"},
             status=status.HTTP_400_BAD_REQUEST
         )
 
 
-class TeamViewSet(viewsets.ModelViewSet):
+class TeamViewSet(PaginatedActionMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Team instances.
     """
@@ -40,21 +196,54 @@ class TeamViewSet(viewsets.ModelViewSet):
     serializer_class = TeamSerializer
 
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class ActivityViewSet(PaginatedActionMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Activity instances.
     """
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
+    cursor_ordering = '-date'
+
+    def perform_create(self, serializer):
+        activity = serializer.save()
+        send_activities_changed(added=[activity])
+
+    def perform_update(self, serializer):
+        previous = copy.copy(serializer.instance)
+        activity = serializer.save()
+        send_activities_changed(added=[activity], removed=[previous])
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        send_activities_changed(removed=[instance])
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Ingest a JSON array or NDJSON stream of activities in batches"""
+        # Read the raw stream so the payload is never parsed into memory whole;
+        # DRF has no stream for an empty body
+        stream = request.stream or BytesIO()
+        if request.content_type.startswith('application/x-ndjson'):
+            records = iter_ndjson(stream)
+        else:
+            records = iter_json_array(stream)
+        result = ingest(records)
+
+        if not result['errors']:
+            response_status = status.HTTP_201_CREATED
+        elif result['created']:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response(result, status=response_status)
 
     @action(detail=False, methods=['get'])
     def by_user(self, request):
         """Get all activities for a specific user"""
         user_id = request.query_params.get('user_id')
         if user_id:
-            activities = self.queryset.filter(user_id=user_id).order_by('-date')
-            serializer = self.get_serializer(activities, many=True)
-            return Response(serializer.data)
+            activities = self.queryset.filter(user_id=user_id)
+            return self.list_response(activities)
         return Response(
             {"error": "user_id parameter is required"},
             status=status.HTTP_400_BAD_REQUEST
@@ -65,59 +254,277 @@ class ActivityViewSet(viewsets.ModelViewSet):
         """Get all activities of a specific type"""
         activity_type = request.query_params.get('activity_type')
         if activity_type:
-            activities = self.queryset.filter(activity_type=activity_type).order_by('-date')
-            serializer = self.get_serializer(activities, many=True)
-            return Response(serializer.data)
+            activities = self.queryset.filter(activity_type=activity_type)
+            return self.list_response(activities)
         return Response(
             {"error": "activity_type parameter is required"},
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        """Get totals and a per-type breakdown for a user, team, type and/or date range"""
+        params = request.query_params
+        filters = {
+            name: params.get(name)
+            for name in ('user_id', 'team_id', 'activity_type')
+            if params.get(name)
+        }
+        for name in ('start', 'end'):
+            if params.get(name):
+                filters[name] = parse_since(params[name])
+                if filters[name] is None:
+                    return Response(
+                        {"error": f"{name} must be an ISO 8601 date or datetime"},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+        if not filters:
+            return Response(
+                {"error": "one of user_id, team_id, activity_type, start or end is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(activity_stats(**filters))
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream activities as CSV, Arrow or Parquet (``output=``) for analytics.
+
+        Filters by user_id, activity_type and a start/end date range. Rows
+        come in ``_id`` order; to resume an interrupted export pass the last
+        ``_id`` received as ``after``.
+        """
+        params = request.query_params
+        output = params.get('output', 'csv')
+        if output not in FORMATS:
+            return Response(
+                {"error": f"output must be one of {', '.join(FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        filters = {
+            name: params.get(name)
+            for name in ('user_id', 'activity_type', 'after')
+            if params.get(name)
+        }
+        for name in ('start', 'end'):
+            if params.get(name):
+                filters[name] = parse_since(params[name])
+                if filters[name] is None:
+                    return Response(
+                        {"error": f"{name} must be an ISO 8601 date or datetime"},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+        try:
+            query = export_filter(**filters)
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(export_chunks(query, output), content_type=CONTENT_TYPES[output])
+        response['Content-Disposition'] = f'attachment; filename="activities.{output}"'
+        return response
 
-class LeaderboardViewSet(viewsets.ModelViewSet):
+
+class LeaderboardViewSet(PaginatedActionMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Leaderboard instances.
     """
     queryset = Leaderboard.objects.all().order_by('rank')
     serializer_class = LeaderboardSerializer
+    cursor_ordering = 'rank'
+
+    @cached_response(LEADERBOARD)
+    def list(self, request, *args, **kwargs):
+        if 'window' in request.query_params:
+            return self.windowed_response(request)
+        return super().list(request, *args, **kwargs)
+
+    def windowed_response(self, request, team_id=None):
+        """Answer window/since leaderboard queries from the activity rollups"""
+        period = request.query_params.get('window')
+        if period not in PERIODS:
+            return Response(
+                {"error": f"window must be one of {', '.join(PERIODS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        since = None
+        if request.query_params.get('since'):
+            since = parse_since(request.query_params['since'])
+            if since is None:
+                return Response(
+                    {"error": "since must be an ISO 8601 date or datetime"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        limit = parse_limit(request.query_params, 'limit', 50, self.paginator.max_page_size)
+
+        start, results = windowed_totals(period, since=since, team_id=team_id, limit=limit)
+        names = {
+            user_id: (user_name, team_name)
+            for user_id, user_name, team_name in self.queryset.filter(
+                user_id__in=[row['user_id'] for row in results]
+            ).values_list('user_id', 'user_name', 'team_name')
+        }
+        for row in results:
+            row['user_name'], row['team_name'] = names.get(row['user_id'], (None, None))
+        return Response({'window': period, 'since': start, 'results': results})
+
+    def ranked_response(self, ranked):
+        """Serialize entries for ``(user_id, rank)`` pairs in ranking-index order"""
+        lean = self.get_lean_serializer(required=('user_id',))
+        user_ids = [user_id for user_id, _ in ranked]
+        rows = {row['user_id']: row for row in lean.project(self.queryset.filter(user_id__in=user_ids))}
+        ordered = []
+        for user_id, rank in ranked:
+            row = rows.get(user_id)
+            if row is not None:
+                row['rank'] = rank
+                ordered.append(row)
+        return Response(lean.serialize(ordered))
 
     @action(detail=False, methods=['get'])
+    @cached_response(LEADERBOARD)
     def top_users(self, request):
-        """Get top N users from leaderboard"""
-        limit = int(request.query_params.get('limit', 10))
-        top_users = self.queryset[:limit]
-        serializer = self.get_serializer(top_users, many=True)
-        return Response(serializer.data)
+        """Get top N users from the in-memory ranking index"""
+        limit = parse_limit(request.query_params, 'limit', 10, self.paginator.max_page_size)
+        ranked = ranking.read(
+            lambda index: [(user_id, index.rank(user_id)) for user_id, _ in index.top(limit)]
+        )
+        return self.ranked_response(ranked)
+
+    @action(detail=False, methods=['get'])
+    def rank(self, request):
+        """Get a user's rank without sorting the leaderboard"""
+        user_id = request.query_params.get('user_id')
+        if not user_id:
+            return Response(
+                {"error": "user_id parameter is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        def read_rank(index):
+            if user_id not in index:
+                return None
+            return {
+                'user_id': user_id,
+                'rank': index.rank(user_id),
+                'total_calories': index.total(user_id),
+                'total_users': len(index),
+            }
+
+        result = ranking.read(read_rank)
+        if result is None:
+            return Response(
+                {"error": "user is not on the leaderboard"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(result)
 
     @action(detail=False, methods=['get'])
+    def around(self, request):
+        """Get the leaderboard entries ranked just above and below a user"""
+        user_id = request.query_params.get('user_id')
+        if not user_id:
+            return Response(
+                {"error": "user_id parameter is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        radius = parse_limit(request.query_params, 'radius', 5, 50)
+
+        def read_around(index):
+            if user_id not in index:
+                return None
+            return [(other, index.rank(other)) for other, _ in index.around(user_id, radius)]
+
+        ranked = ranking.read(read_around)
+        if ranked is None:
+            return Response(
+                {"error": "user is not on the leaderboard"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return self.ranked_response(ranked)
+
+    @action(detail=False, methods=['post'])
+    def rebuild(self, request):
+        """Queue a background recomputation of ranks, team standings, rollups or names"""
+        if not isinstance(request.data, dict):
+            return Response(
+                {"error": "expected an object like {\"scope\": \"ranks\"}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        scope = request.data.get('scope', 'ranks')
+        if scope not in REBUILD_TASKS:
+            return Response(
+                {"error": f"scope must be one of {', '.join(REBUILD_TASKS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        job = enqueue(REBUILD_TASKS[scope])
+        serializer = LeanSerializer.for_serializer(JobSerializer)
+        return Response(serializer.to_representation(job), status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['get'])
+    @cached_response(LEADERBOARD)
     def by_team(self, request):
         """Get leaderboard entries for a specific team"""
         team_id = request.query_params.get('team_id')
+        if team_id and 'window' in request.query_params:
+            return self.windowed_response(request, team_id=team_id)
         if team_id:
             entries = self.queryset.filter(team_id=team_id)
-            serializer = self.get_serializer(entries, many=True)
-            return Response(serializer.data)
+            return self.list_response(entries)
         return Response(
             {"error": "team_id parameter is required"},
             status=status.HTTP_400_BAD_REQUEST
         )
 
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+class TeamLeaderboardViewSet(PaginatedActionMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    ViewSet for viewing team standings.
+
+    Standings are maintained from activity and membership changes (see
+    team_leaderboard.py), so this resource is read-only.
+    """
+    queryset = TeamLeaderboard.objects.all().order_by('rank')
+    serializer_class = TeamLeaderboardSerializer
+    cursor_ordering = 'rank'
+
+    @cached_response(LEADERBOARD)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+
+class JobViewSet(PaginatedActionMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    ViewSet for following background jobs.
+    """
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+
+
+class WorkoutViewSet(PaginatedActionMixin, viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing Workout instances.
+
+    Reads are served from the in-memory catalog snapshot (catalog.py) and
+    accept any combination of ``difficulty``, ``category``,
+    ``min_duration`` and ``max_duration``.
     """
     queryset = Workout.objects.all()
     serializer_class = WorkoutSerializer
 
+    def list(self, request, *args, **kwargs):
+        return self.catalog_response()
+
+    def retrieve(self, request, *args, **kwargs):
+        row = catalog.snapshot().get(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        if row is None:
+            raise Http404
+        return Response(self.pick_fields(self.get_lean_serializer(), row))
+
     @action(detail=False, methods=['get'])
     def by_difficulty(self, request):
         """Get workouts filtered by difficulty"""
-        difficulty = request.query_params.get('difficulty')
-        if difficulty:
-            workouts = self.queryset.filter(difficulty=difficulty)
-            serializer = self.get_serializer(workouts, many=True)
-            return Response(serializer.data)
+        if request.query_params.get('difficulty'):
+            return self.catalog_response()
         return Response(
             {"error": "difficulty parameter is required"},
             status=status.HTTP_400_BAD_REQUEST
@@ -126,12 +533,75 @@ class WorkoutViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def by_category(self, request):
         """Get workouts filtered by category"""
-        category = request.query_params.get('category')
-        if category:
-            workouts = self.queryset.filter(category=category)
-            serializer = self.get_serializer(workouts, many=True)
-            return Response(serializer.data)
+        if request.query_params.get('category'):
+            return self.catalog_response()
         return Response(
             {"error": "category parameter is required"},
             status=status.HTTP_400_BAD_REQUEST
         )
+
+    @action(detail=False, methods=['get'])
+    def recommended(self, request):
+        """Get the workouts that best match a user's recent activity"""
+        user_id = request.query_params.get('user_id')
+        if not user_id:
+            return Response(
+                {"error": "user_id parameter is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = parse_limit(request.query_params, 'limit', 5, MAX_RECOMMENDATIONS)
+
+        lean = self.get_lean_serializer()
+        return Response([
+            {**self.pick_fields(lean, row), 'score': round(score, 4)}
+            for row, score in recommend(user_id, catalog.snapshot(), limit)
+        ])
+
+    def catalog_response(self):
+        """Filter, paginate and project catalog rows without querying Mongo"""
+        params = self.request.query_params
+        facets = {name: params.get(name) or None for name in ('difficulty', 'category')}
+        for name in ('min_duration', 'max_duration'):
+            value = params.get(name)
+            try:
+                facets[name] = int(value) if value else None
+            except ValueError:
+                raise ValidationError({name: ['must be an integer']})
+
+        lean = self.get_lean_serializer()
+        rows = catalog.snapshot().filter(**facets)
+        page = self.paginator.paginate_rows(rows, self.request, view=self) if self.paginator else None
+        if page is not None:
+            return self.get_paginated_response([self.pick_fields(lean, row) for row in page])
+        return Response([self.pick_fields(lean, row) for row in rows])
+
+    @staticmethod
+    def pick_fields(lean, row):
+        """Narrow a pre-serialized row to the lean serializer's fields"""
+        return {name: row[name] for name in lean.field_names}
+
+
+@api_view(['GET'])
+def db_health(request):
+    """
+    Ping Mongo and report connection pool settings and metrics.
+
+    Returns 503 when the server cannot be reached within the server
+    selection timeout.
+    """
+    client_settings = settings.DATABASES['default'].get('CLIENT', {})
+    body = {
+        'status': 'ok',
+        'pool_settings': {key: client_settings.get(key) for key in POOL_SETTINGS},
+    }
+    started = perf_counter()
+    try:
+        User.objects.mongo_database.client.admin.command('ping')
+    except PyMongoError as exc:
+        body['status'] = 'unavailable'
+        body['error'] = str(exc)
+    else:
+        body['ping_ms'] = round((perf_counter() - started) * 1000, 3)
+    body['pools'] = pool_metrics.snapshot()
+    status_code = status.HTTP_200_OK if body['status'] == 'ok' else status.HTTP_503_SERVICE_UNAVAILABLE
+    return Response(body, status=status_code)